@@ -0,0 +1,60 @@
+"""
+Run the benchmark suite:
+
+    python -m benchmarks                                  # run every case
+    python -m benchmarks --filter waterfall --quick       # run a subset with fewer iterations
+    python -m benchmarks --save baseline.json             # save the results as a baseline
+    python -m benchmarks --compare baseline.json          # exit with 1 if p50 of any case regressed by more than 10%
+"""
+
+import argparse
+import json
+import platform
+import sys
+from pathlib import Path
+
+from .suite import find_regressions, get_cases, run_case
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("--filter", default="", help="only run the cases whose name contains this substring")
+    parser.add_argument("--iterations", type=int, default=2000, help="number of measured operations per case")
+    parser.add_argument("--quick", action="store_true", help="run 10 times fewer iterations")
+    parser.add_argument("--save", type=Path, help="save the results as a JSON baseline to this file")
+    parser.add_argument("--compare", type=Path, help="compare the results to a JSON baseline from this file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed p50 regression, 0.1 is 10%%")
+    args = parser.parse_args(argv)
+
+    iterations = args.iterations // 10 if args.quick else args.iterations
+    results = {}
+    print(f"{'case':<72} {'ops/sec':>10} {'p50 us':>9} {'p99 us':>9} {'peak KiB':>9} {'blocks/op':>9}")
+    for case in get_cases():
+        if args.filter not in case.name:
+            continue
+        result = results[case.name] = run_case(case, iterations)
+        print(
+            f"{case.name:<72} {result.ops_per_sec:>10.0f} {result.p50_us:>9.1f} {result.p99_us:>9.1f} "
+            f"{result.peak_memory_bytes / 1024:>9.1f} {result.net_blocks_per_op:>9.2f}",
+        )
+
+    if args.save is not None:
+        report = {
+            "python": sys.version,
+            "platform": platform.platform(),
+            "cases": {name: result._asdict() for name, result in results.items()},
+        }
+        args.save.write_text(json.dumps(report, indent=2))
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())["cases"]
+        regressions = find_regressions(results, baseline, args.threshold)
+        for name, (baseline_p50, p50) in regressions.items():
+            print(f"REGRESSION {name}: p50 {baseline_p50:.1f}us -> {p50:.1f}us")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
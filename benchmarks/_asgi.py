@@ -0,0 +1,57 @@
+"""Helpers for calling ASGI apps in-process without a network or a test client"""
+
+import asyncio
+from typing import Any
+
+from starlette.types import ASGIApp, Message, Scope
+
+
+def make_http_scope(
+    path: str,
+    *,
+    method: str = "GET",
+    headers: dict[str, str] | None = None,
+    query_string: bytes = b"",
+) -> Scope:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "client": ("testclient", 50000),
+        "root_path": "",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string,
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    }
+
+
+async def call_app(app: ASGIApp, scope: Scope) -> int:
+    """Run a single request through the app and return its status code"""
+    status_code = 0
+    request_sent = False
+
+    async def receive() -> Message:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Streaming responses listen for a disconnect until the response is sent so we never send it
+        await asyncio.Event().wait()
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    async def send(message: Message) -> None:
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+
+    # Apps modify the scope so every request must get a copy of it
+    await app(_copy_scope(scope), receive, send)
+    return status_code
+
+
+def _copy_scope(scope: Scope) -> dict[str, Any]:
+    return {**scope, "headers": list(scope["headers"])}
@@ -0,0 +1,279 @@
+"""
+In-process benchmarks of the routing overhead that verselect adds over plain FastAPI.
+
+Every case drives the ASGI app directly (no network and no test client) and is measured as:
+
+* ops/sec and p50/p99 latency of individual operations
+* peak traced memory and the net number of allocated blocks per operation (a growing number points to a leak)
+"""
+
+import asyncio
+import gc
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import PlainTextResponse
+from starlette.types import ASGIApp, Scope
+
+from verselect import HeaderRoutingFastAPI
+
+from . import version_dependency
+from ._asgi import call_app, make_http_scope
+
+VERSION_COUNTS = (1, 20)
+ROUTE_COUNTS = (10, 200)
+# path shape -> path template of the i-th route
+PATH_SHAPES = {
+    "static": "/resource{i}",
+    "param": "/resource{i}/{{item_id}}",
+    "nested": "/orgs/{{org_id}}/resource{i}/{{item_id}}/details",
+}
+FIRST_VERSION = date(2000, 1, 1)
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+class BenchmarkCase(NamedTuple):
+    name: str
+    # returns the operation to measure. Setup is not measured
+    setup: Callable[[], Callable[[], Awaitable[Any]]]
+    # startup cases are much slower than requests so they need fewer iterations
+    iteration_factor: float = 1.0
+
+
+class CaseResult(NamedTuple):
+    ops_per_sec: float
+    mean_us: float
+    p50_us: float
+    p99_us: float
+    peak_memory_bytes: int
+    net_blocks_per_op: float
+
+
+def get_versions(version_count: int) -> list[str]:
+    return [(FIRST_VERSION + timedelta(days=30 * i)).isoformat() for i in range(version_count)]
+
+
+def make_router(route_count: int, shape: str) -> APIRouter:
+    router = APIRouter()
+    for i in range(route_count):
+
+        async def endpoint() -> PlainTextResponse:
+            return PlainTextResponse("ok")
+
+        router.add_api_route(PATH_SHAPES[shape].format(i=i), endpoint, methods=["GET"])
+    return router
+
+
+def make_request_path(route_count: int, shape: str) -> str:
+    # The last route is the worst case for a linear scan
+    return PATH_SHAPES[shape].format(i=route_count - 1).replace("{item_id}", "42").replace("{org_id}", "7")
+
+
+def make_versioned_app(version_count: int, route_count: int, shape: str) -> HeaderRoutingFastAPI:
+    app = HeaderRoutingFastAPI(openapi_url=None)
+    router = make_router(route_count, shape)
+    for version in get_versions(version_count):
+        app.add_header_versioned_routers(router, header_value=version)
+    app.add_unversioned_routers(make_router(route_count, shape))
+    return app
+
+
+def make_bulk_app(version_count: int, route_count: int, shape: str) -> HeaderRoutingFastAPI:
+    """The same app as make_versioned_app but with every version registered at once"""
+    app = HeaderRoutingFastAPI(openapi_url=None)
+    router = make_router(route_count, shape)
+    app.add_versions(dict.fromkeys(get_versions(version_count), router))
+    app.add_unversioned_routers(make_router(route_count, shape))
+    return app
+
+
+def make_ranged_app(version_count: int, route_count: int, shape: str) -> HeaderRoutingFastAPI:
+    """The same routes as make_versioned_app but declared once with a version range"""
+    app = HeaderRoutingFastAPI(openapi_url=None)
+    first_version, *other_versions = get_versions(version_count)
+    app.add_version_ranged_routers(make_router(route_count, shape), since=first_version)
+    for version in other_versions:
+        # an empty range only marks the version
+        app.add_version_ranged_routers(APIRouter(), since=version)
+    app.add_unversioned_routers(make_router(route_count, shape))
+    return app
+
+
+def make_plain_app(route_count: int, shape: str) -> FastAPI:
+    app = FastAPI(openapi_url=None)
+    app.include_router(make_router(route_count, shape))
+    return app
+
+
+def _request_case(name: str, make_app: Callable[[], ASGIApp], scope: Scope, expected_status: int) -> BenchmarkCase:
+    def setup() -> Callable[[], Awaitable[Any]]:
+        app = make_app()
+        status_code = asyncio.run(call_app(app, scope))
+        if status_code != expected_status:
+            raise AssertionError(f"{name}: expected {expected_status}, got {status_code}")
+        return lambda: call_app(app, scope)
+
+    return BenchmarkCase(name, setup)
+
+
+def _startup_case(
+    name: str,
+    version_count: int,
+    route_count: int,
+    shape: str,
+    make_app: Callable[[int, int, str], ASGIApp] = make_versioned_app,
+) -> BenchmarkCase:
+    def setup() -> Callable[[], Awaitable[Any]]:
+        async def start_app() -> None:
+            make_app(version_count, route_count, shape)
+
+        return start_app
+
+    return BenchmarkCase(name, setup, iteration_factor=0.01)
+
+
+def _cold_start_case(name: str, version_count: int, route_count: int, shape: str, make_app: str) -> BenchmarkCase:
+    """A fresh interpreter that imports verselect and builds the app, like a worker process that starts"""
+    code = f"from benchmarks.suite import {make_app}; {make_app}({version_count}, {route_count}, {shape!r})"
+
+    def setup() -> Callable[[], Awaitable[Any]]:
+        async def start_process() -> None:
+            process = await asyncio.create_subprocess_exec(sys.executable, "-c", code, cwd=ROOT_DIR)
+            if await process.wait():
+                raise subprocess.CalledProcessError(process.returncode, code)
+
+        return start_process
+
+    return BenchmarkCase(name, setup, iteration_factor=0.001)
+
+
+def get_cases() -> list[BenchmarkCase]:
+    cases = []
+    for version_count in VERSION_COUNTS:
+        for route_count in ROUTE_COUNTS:
+            for shape in PATH_SHAPES:
+                cases.extend(_get_grid_cases(version_count, route_count, shape))
+    for with_version_dependency in (True, False):
+        cases.append(
+            _request_case(
+                f"many_dependencies[version_dependency={with_version_dependency}]",
+                lambda flag=with_version_dependency: version_dependency.make_app(with_version_dependency=flag),
+                make_http_scope("/items/42", headers={"x-api-version": "2022-01-01"}),
+                200,
+            ),
+        )
+    params = f"[versions={VERSION_COUNTS[-1]},routes={ROUTE_COUNTS[-1]},shape=param]"
+    for make_app in ("make_versioned_app", "make_bulk_app"):
+        name = f"cold_start_{make_app}{params}"
+        cases.append(_cold_start_case(name, VERSION_COUNTS[-1], ROUTE_COUNTS[-1], "param", make_app))
+    return cases
+
+
+def _get_grid_cases(version_count: int, route_count: int, shape: str) -> Iterable[BenchmarkCase]:
+    params = f"[versions={version_count},routes={route_count},shape={shape}]"
+    path = make_request_path(route_count, shape)
+    last_version = date.fromisoformat(get_versions(version_count)[-1])
+
+    def make_app() -> ASGIApp:
+        return make_versioned_app(version_count, route_count, shape)
+
+    def request(path: str, version: date | str | None = None) -> Scope:
+        headers = {} if version is None else {"x-api-version": str(version)}
+        return make_http_scope(path, headers=headers)
+
+    if version_count == VERSION_COUNTS[0]:
+        # plain FastAPI doesn't have versions so one is enough
+        yield _request_case(
+            f"plain_fastapi{params}",
+            lambda: make_plain_app(route_count, shape),
+            request(path),
+            200,
+        )
+    yield _request_case(f"exact{params}", make_app, request(path, last_version), 200)
+    yield _request_case(f"waterfall{params}", make_app, request(path, last_version + timedelta(days=1)), 200)
+    yield _request_case(f"unversioned{params}", make_app, request(path), 200)
+    yield _request_case(f"not_found{params}", make_app, request("/does/not/exist", last_version), 404)
+    yield _request_case(f"invalid_header{params}", make_app, request(path, "2022-13-45"), 422)
+    yield _startup_case(f"startup{params}", version_count, route_count, shape)
+    yield _startup_case(f"startup_bulk{params}", version_count, route_count, shape, make_bulk_app)
+    yield _request_case(
+        f"ranged_waterfall{params}",
+        lambda: make_ranged_app(version_count, route_count, shape),
+        request(path, last_version + timedelta(days=1)),
+        200,
+    )
+    yield _startup_case(f"startup_ranged{params}", version_count, route_count, shape, make_ranged_app)
+
+
+def run_case(case: BenchmarkCase, iterations: int) -> CaseResult:
+    operation = case.setup()
+    iterations = max(int(iterations * case.iteration_factor), 3)
+    return asyncio.run(_measure(operation, iterations))
+
+
+async def _measure(operation: Callable[[], Awaitable[Any]], iterations: int) -> CaseResult:
+    # warm up the caches so that only the steady state is measured
+    for _ in range(min(iterations, 10)):
+        await operation()
+
+    gc.collect()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        await operation()
+        timings.append(time.perf_counter_ns() - start)
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(iterations):
+        await operation()
+    gc.collect()
+    blocks_after = sys.getallocatedblocks()
+
+    tracemalloc.start()
+    try:
+        memory_before, _ = tracemalloc.get_traced_memory()
+        for _ in range(iterations):
+            await operation()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    mean_ns = statistics.fmean(timings)
+    return CaseResult(
+        ops_per_sec=1_000_000_000 / mean_ns,
+        mean_us=mean_ns / 1000,
+        p50_us=_percentile(timings, 0.5) / 1000,
+        p99_us=_percentile(timings, 0.99) / 1000,
+        peak_memory_bytes=peak_memory - memory_before,
+        net_blocks_per_op=(blocks_after - blocks_before) / iterations,
+    )
+
+
+def _percentile(sorted_timings: list[int], percentile: float) -> float:
+    return sorted_timings[min(int(len(sorted_timings) * percentile), len(sorted_timings) - 1)]
+
+
+def find_regressions(
+    results: dict[str, CaseResult],
+    baseline: dict[str, dict[str, float]],
+    threshold: float,
+) -> dict[str, tuple[float, float]]:
+    """Return the cases whose p50 latency grew by more than threshold (0.1 is 10%) as name -> (old p50, new p50)"""
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        baseline_p50 = baseline[name]["p50_us"]
+        if result.p50_us > baseline_p50 * (1 + threshold):
+            regressions[name] = (baseline_p50, result.p50_us)
+    return regressions
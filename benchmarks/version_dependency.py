@@ -0,0 +1,76 @@
+"""
+Compares the cost of a versioned route with the version header dependency that verselect used to add to every
+versioned route against the same route without it.
+
+    python -m benchmarks.version_dependency
+"""
+
+import asyncio
+import time
+from collections.abc import Callable
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Header
+
+from verselect import HeaderRoutingFastAPI
+from verselect.middleware import _get_api_version_dependency
+
+from ._asgi import call_app, make_http_scope
+
+DEPENDENCY_COUNT = 10
+REQUEST_COUNT = 5000
+
+
+def _make_dependency(index: int) -> Callable[..., int]:
+    def dependency(x_request_id: Annotated[str | None, Header()] = None) -> int:
+        return index
+
+    return dependency
+
+
+def make_app(*, with_version_dependency: bool) -> HeaderRoutingFastAPI:
+    router = APIRouter()
+
+    @router.get("/items/{item_id}", dependencies=[Depends(_make_dependency(i)) for i in range(DEPENDENCY_COUNT)])
+    async def get_item(item_id: int) -> dict[str, int]:
+        return {"item_id": item_id}
+
+    if with_version_dependency:
+        # This is how versioned routes used to be included
+        router_with_version_dependency = APIRouter()
+        router_with_version_dependency.include_router(
+            router,
+            dependencies=[Depends(_get_api_version_dependency("x-api-version", "2022-01-01"))],
+        )
+        router = router_with_version_dependency
+    app = HeaderRoutingFastAPI(openapi_url=None)
+    app.add_header_versioned_routers(router, header_value="2022-01-01")
+    return app
+
+
+async def measure(app: HeaderRoutingFastAPI) -> float:
+    """Return the mean time of a request in microseconds"""
+    scope = make_http_scope("/items/42", headers={"x-api-version": "2022-01-01"})
+    assert await call_app(app, scope) == 200
+    start = time.perf_counter()
+    for _ in range(REQUEST_COUNT):
+        await call_app(app, scope)
+    return (time.perf_counter() - start) / REQUEST_COUNT * 1_000_000
+
+
+def main() -> None:
+    apps = {flag: make_app(with_version_dependency=flag) for flag in (True, False)}
+    # Runs are interleaved and the best one is taken to reduce the noise
+    timings: dict[bool, list[float]] = {True: [], False: []}
+    for _ in range(3):
+        for flag, app in apps.items():
+            timings[flag].append(asyncio.run(measure(app)))
+    with_dependency, without_dependency = min(timings[True]), min(timings[False])
+    print(f"Route with {DEPENDENCY_COUNT} dependencies")
+    print(f"  with the version header dependency:    {with_dependency:8.1f} us/request")
+    print(f"  without the version header dependency: {without_dependency:8.1f} us/request")
+    print(f"  saved: {with_dependency - without_dependency:.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import asyncio
+
+from fastapi import APIRouter
+
+from verselect import HeaderRoutingFastAPI
+
+VERSIONS = ("2022-01-01", "2023-01-01")
+
+
+def slow_function() -> int:
+    return sum(range(1000))
+
+
+def other_function() -> int:
+    return 1
+
+
+router = APIRouter()
+
+
+@router.get("/items/{item_id}")
+async def get_item(item_id: int):
+    await asyncio.sleep(0)
+    return {"item_id": item_id, "total": slow_function()}
+
+
+@router.get("/users")
+async def get_users():
+    return other_function()
+
+
+def make_app(**kwargs: object) -> HeaderRoutingFastAPI:
+    """Build an app whose versions all share the same /items/{item_id} and /users routes"""
+    app = HeaderRoutingFastAPI(**kwargs)
+    for version in VERSIONS:
+        app.add_header_versioned_routers(router, header_value=version)
+    return app
@@ -0,0 +1,27 @@
+import os
+
+from fastapi import APIRouter, Request
+
+from verselect import HeaderRoutingFastAPI
+
+
+def make_version_router(version: str) -> APIRouter:
+    router = APIRouter()
+
+    @router.get("/whoami")
+    async def whoami():
+        return {"version": version, "pid": os.getpid()}
+
+    @router.post("/echo")
+    async def echo(request: Request):
+        return {"version": version, "body": (await request.body()).decode()}
+
+    return router
+
+
+def create_app(versions: tuple[str, ...]) -> HeaderRoutingFastAPI:
+    """Build an app with the routes of only the given versions"""
+    app = HeaderRoutingFastAPI()
+    for version in versions:
+        app.add_header_versioned_routers(make_version_router(version), header_value=version)
+    return app
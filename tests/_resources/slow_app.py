@@ -0,0 +1,91 @@
+import asyncio
+
+import httpx
+from fastapi import APIRouter, Response
+
+from verselect import HeaderRoutingFastAPI
+from verselect.coalescing import no_coalescing
+from verselect.response_cache import cache_response
+
+VERSIONS = ("2020-01-01", "2021-01-01", "2022-01-01", "2023-01-01")
+
+
+class SlowEndpoint:
+    """An endpoint whose calls wait until release is set and return the number of the call"""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self) -> int:
+        self.calls += 1
+        call = self.calls
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await self.release.wait()
+        finally:
+            self.running -= 1
+        return call
+
+
+def make_app(endpoint: SlowEndpoint, **kwargs: object) -> HeaderRoutingFastAPI:
+    app = HeaderRoutingFastAPI(**kwargs)
+    router = APIRouter()
+
+    @router.get("/items")
+    async def get_items(q: str = ""):
+        return {"q": q, "call": await endpoint()}
+
+    @router.post("/items")
+    async def create_item():
+        return await endpoint()
+
+    @router.get("/side-effects")
+    @no_coalescing
+    async def get_with_side_effects():
+        return await endpoint()
+
+    @router.get("/cookies")
+    async def get_cookies(response: Response):
+        response.set_cookie("session", "1")
+        return await endpoint()
+
+    @router.get("/errors")
+    async def get_error(response: Response):
+        response.status_code = 500
+        return await endpoint()
+
+    @router.get("/cached")
+    @cache_response(ttl=60)
+    async def get_cached():
+        return await endpoint()
+
+    for version in VERSIONS:
+        app.add_header_versioned_routers(router, header_value=version)
+
+    unversioned_router = APIRouter()
+    unversioned_router.get("/unversioned-items")(get_items)
+    app.add_unversioned_routers(unversioned_router)
+    return app
+
+
+async def send_concurrently(
+    app: HeaderRoutingFastAPI,
+    endpoint: SlowEndpoint,
+    requests: list[tuple[str, str, dict[str, str]]],
+    *,
+    wait: float = 0,
+) -> list[httpx.Response]:
+    """Send the (method, url, headers) requests at once and release the endpoint once all of them reached it"""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        responses = [
+            asyncio.create_task(client.request(method, url, headers=headers)) for method, url, headers in requests
+        ]
+        for _ in range(20):
+            await asyncio.sleep(0)
+        await asyncio.sleep(wait)
+        endpoint.release.set()
+        return await asyncio.gather(*responses)
@@ -0,0 +1,149 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from tests._resources.slow_app import SlowEndpoint, make_app, send_concurrently
+from verselect.admission import AdmissionControl, ConcurrencyLimit
+from verselect.instrumentation import RoutingMetrics
+
+
+def get(url: str, version: str | None = None) -> tuple[str, str, dict[str, str]]:
+    return ("GET", url, {} if version is None else {"X-API-VERSION": version})
+
+
+async def test__admission_control__over_the_limit__rejected_with_retry_after():
+    endpoint = SlowEndpoint()
+    admission_control = AdmissionControl([ConcurrencyLimit(2, version="2020-01-01")], retry_after=5)
+    app = make_app(endpoint, admission_control=admission_control)
+
+    responses = await send_concurrently(
+        app,
+        endpoint,
+        [
+            get("/items", "2020-01-01"),
+            get("/items", "2020-06-01"),
+            get("/items", "2020-01-01"),
+            get("/items", "2021-01-01"),
+        ],
+    )
+
+    assert [response.status_code for response in responses] == [200, 200, 503, 200]
+    assert responses[2].headers["retry-after"] == "5"
+    assert responses[2].headers["x-api-version"] == "2020-01-01"
+    assert responses[2].json() == {"detail": "Too many concurrent requests of version 2020-01-01"}
+    snapshot = admission_control.snapshot()["2020-01-01"]
+    assert (snapshot["active"], snapshot["admitted"], snapshot["rejected"]) == (0, 2, 1)
+
+
+async def test__admission_control__rejected__response_built_by_exception_handler():
+    endpoint = SlowEndpoint()
+    app = make_app(endpoint, admission_control=AdmissionControl([ConcurrencyLimit(1, version="2020-01-01")]))
+
+    @app.exception_handler(HTTPException)
+    async def handle_http_exception(request: Request, exc: HTTPException) -> PlainTextResponse:
+        return PlainTextResponse(exc.detail, status_code=exc.status_code, headers=exc.headers)
+
+    responses = await send_concurrently(app, endpoint, [get("/items", "2020-01-01"), get("/items", "2020-01-01")])
+
+    assert [response.status_code for response in responses] == [200, 503]
+    assert responses[1].text == "Too many concurrent requests of version 2020-01-01"
+    assert responses[1].headers["retry-after"] == "1"
+
+
+async def test__admission_control__range_limit__shared_by_its_versions_and_queued():
+    endpoint = SlowEndpoint()
+    admission_control = AdmissionControl(
+        [ConcurrencyLimit(1, max_queue=2, queue_timeout=5, until="2022-01-01")],
+        status_code=429,
+    )
+    app = make_app(endpoint, admission_control=admission_control)
+
+    responses = await send_concurrently(
+        app,
+        endpoint,
+        [
+            get("/items", "2020-01-01"),
+            get("/items", "2021-01-01"),
+            get("/items", "2020-01-01"),
+            get("/items", "2021-01-01"),
+            # newer versions and unversioned requests are not limited
+            get("/items", "2022-01-01"),
+            get("/unversioned-items"),
+        ],
+    )
+
+    assert [response.status_code for response in responses] == [200, 200, 200, 429, 200, 200]
+    snapshot = admission_control.snapshot()["..2022-01-01"]
+    assert snapshot["admitted"] == 3
+    assert snapshot["queued"] == 2
+    assert snapshot["rejected"] == 1
+    assert snapshot["wait_seconds"]["count"] == 2
+    assert (snapshot["active"], snapshot["waiting"]) == (0, 0)
+    # the queued requests only ran after the first one finished
+    assert endpoint.calls == 5
+
+
+async def test__admission_control__queue_timeout__rejected():
+    endpoint = SlowEndpoint()
+    admission_control = AdmissionControl([ConcurrencyLimit(1, max_queue=1, queue_timeout=0.01, since="2023-01-01")])
+    app = make_app(endpoint, admission_control=admission_control, instrumentation=RoutingMetrics())
+
+    responses = await send_concurrently(
+        app,
+        endpoint,
+        [get("/items", "2023-01-01"), get("/items", "2024-01-01")],
+        wait=0.05,
+    )
+
+    assert [response.status_code for response in responses] == [200, 503]
+    snapshot = admission_control.snapshot()["2023-01-01.."]
+    assert (snapshot["timed_out"], snapshot["waiting"], snapshot["active"]) == (1, 0, 0)
+    assert endpoint.max_running == 1
+
+
+async def test__admission_control__version_limit__takes_precedence_over_ranges():
+    endpoint = SlowEndpoint()
+    admission_control = AdmissionControl(
+        [ConcurrencyLimit(1, since="2020-01-01"), ConcurrencyLimit(3, version="2022-01-01")],
+    )
+    app = make_app(endpoint, admission_control=admission_control)
+
+    responses = await send_concurrently(
+        app,
+        endpoint,
+        [get("/items", "2022-01-01")] * 3 + [get("/items", "2020-01-01")] * 2,
+    )
+
+    assert [response.status_code for response in responses] == [200, 200, 200, 200, 503]
+
+
+def test__admission_control__invalid_limits__rejected():
+    with pytest.raises(ValueError, match="either a version or a range"):
+        AdmissionControl([ConcurrencyLimit(1, version="2020-01-01", since="2020-01-01")])
+    with pytest.raises(ValueError, match="at least 1"):
+        AdmissionControl([ConcurrencyLimit(0)])
+
+
+async def test__admission_control__queued_request_cancelled__slot_not_leaked():
+    endpoint = SlowEndpoint()
+    admission_control = AdmissionControl([ConcurrencyLimit(1, max_queue=1, queue_timeout=5, version="2020-01-01")])
+    app = make_app(endpoint, admission_control=admission_control)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        headers = {"X-API-VERSION": "2020-01-01"}
+        first = asyncio.create_task(client.get("/items", headers=headers))
+        queued = asyncio.create_task(client.get("/items", headers=headers))
+        for _ in range(20):
+            await asyncio.sleep(0)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        endpoint.release.set()
+        assert (await first).status_code == 200
+        assert (await client.get("/items", headers=headers)).status_code == 200
+
+    assert admission_control.snapshot()["2020-01-01"]["active"] == 0
+    assert admission_control.snapshot()["2020-01-01"]["waiting"] == 0
@@ -0,0 +1,42 @@
+import json
+from pathlib import Path
+
+from benchmarks.__main__ import main
+from benchmarks.suite import CaseResult, find_regressions
+
+CASE_NAME = "exact[versions=1,routes=10,shape=static]"
+
+
+def make_result(p50_us: float) -> CaseResult:
+    return CaseResult(
+        ops_per_sec=1,
+        mean_us=p50_us,
+        p50_us=p50_us,
+        p99_us=p50_us,
+        peak_memory_bytes=0,
+        net_blocks_per_op=0,
+    )
+
+
+def test__find_regressions__only_cases_slower_than_threshold():
+    results = {
+        "slower": make_result(120),
+        "a_bit_slower": make_result(105),
+        "faster": make_result(50),
+        "new": make_result(1),
+    }
+    baseline = {name: {"p50_us": 100} for name in ["slower", "a_bit_slower", "faster"]}
+
+    assert find_regressions(results, baseline, threshold=0.1) == {"slower": (100, 120)}
+
+
+def test__benchmarks_main__saves_baseline_and_fails_on_regression(tmp_path: Path):
+    baseline_path = tmp_path / "baseline.json"
+    assert main(["--filter", CASE_NAME, "--iterations", "5", "--save", str(baseline_path)]) == 0
+    baseline = json.loads(baseline_path.read_text())
+    assert list(baseline["cases"]) == [CASE_NAME]
+    assert baseline["cases"][CASE_NAME]["p50_us"] > 0
+
+    baseline["cases"][CASE_NAME]["p50_us"] = 0.001
+    baseline_path.write_text(json.dumps(baseline))
+    assert main(["--filter", CASE_NAME, "--iterations", "5", "--compare", str(baseline_path)]) == 1
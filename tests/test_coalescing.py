@@ -0,0 +1,117 @@
+from tests._resources.slow_app import SlowEndpoint, make_app, send_concurrently
+from verselect.coalescing import RequestCoalescing
+from verselect.instrumentation import RoutingMetrics
+from verselect.response_cache import ResponseCache
+
+
+async def test__request_coalescing__identical_requests__share_one_execution():
+    endpoint = SlowEndpoint()
+    request_coalescing = RequestCoalescing()
+    app = make_app(endpoint, request_coalescing=request_coalescing)
+    headers = {"X-API-VERSION": "2022-01-01"}
+
+    responses = await send_concurrently(
+        app,
+        endpoint,
+        [
+            ("GET", "/items", headers),
+            # another requested version that resolves to the same version
+            ("GET", "/items", {"X-API-VERSION": "2022-06-01"}),
+            ("GET", "/items", headers),
+            ("GET", "/items", {"X-API-VERSION": "2023-01-01"}),
+            ("GET", "/items?q=a", headers),
+            ("GET", "/items", {**headers, "Authorization": "other"}),
+        ],
+    )
+
+    assert [response.json() for response in responses] == [
+        {"q": "", "call": 1},
+        {"q": "", "call": 1},
+        {"q": "", "call": 1},
+        {"q": "", "call": 2},
+        {"q": "a", "call": 3},
+        {"q": "", "call": 4},
+    ]
+    assert responses[1].headers["x-api-version"] == "2022-06-01"
+    assert responses[0].headers["x-api-version"] == "2022-01-01"
+    assert request_coalescing.snapshot() == {"executions": 4, "coalesced_requests": 2, "fallbacks": 0, "in_flight": 0}
+
+
+async def test__request_coalescing__unsafe_methods_and_opted_out_routes__not_coalesced():
+    endpoint = SlowEndpoint()
+    request_coalescing = RequestCoalescing()
+    app = make_app(endpoint, request_coalescing=request_coalescing)
+    headers = {"X-API-VERSION": "2022-01-01"}
+
+    responses = await send_concurrently(
+        app,
+        endpoint,
+        [("POST", "/items", headers)] * 2
+        + [("GET", "/side-effects", headers)] * 2
+        + [("GET", "/cookies", headers)] * 2,
+    )
+
+    assert [response.json() for response in responses] == [1, 2, 3, 5, 4, 6]
+    assert all("session" in response.headers.get("set-cookie", "") for response in responses[4:])
+    # the waiting requests ran the endpoints themselves
+    assert request_coalescing.fallbacks == 2
+    assert request_coalescing.coalesced_requests == 0
+
+    # the opted out route is known now so its requests no longer wait for each other
+    endpoint.release.clear()
+    await send_concurrently(app, endpoint, [("GET", "/side-effects", headers)] * 2)
+    assert request_coalescing.fallbacks == 2
+
+
+async def test__request_coalescing__different_credentials__not_coalesced():
+    endpoint = SlowEndpoint()
+    request_coalescing = RequestCoalescing(headers=["x-tenant"])
+    app = make_app(endpoint, request_coalescing=request_coalescing)
+    headers = {"X-API-VERSION": "2022-01-01"}
+
+    responses = await send_concurrently(
+        app,
+        endpoint,
+        [
+            ("GET", "/items", {**headers, "Authorization": "first"}),
+            ("GET", "/items", {**headers, "Authorization": "second"}),
+            ("GET", "/items", {**headers, "Cookie": "session=first"}),
+            ("GET", "/items", {**headers, "Cookie": "session=second"}),
+            ("GET", "/items", {**headers, "X-Tenant": "first"}),
+            ("GET", "/items", {**headers, "Authorization": "first"}),
+        ],
+    )
+
+    assert [response.json()["call"] for response in responses] == [1, 2, 3, 4, 5, 1]
+
+
+async def test__request_coalescing__unsuccessful_response__not_shared():
+    endpoint = SlowEndpoint()
+    request_coalescing = RequestCoalescing()
+    app = make_app(endpoint, request_coalescing=request_coalescing)
+
+    responses = await send_concurrently(app, endpoint, [("GET", "/errors", {"X-API-VERSION": "2022-01-01"})] * 2)
+
+    assert [(response.status_code, response.json()) for response in responses] == [(500, 1), (500, 2)]
+    assert request_coalescing.fallbacks == 1
+    assert request_coalescing.coalesced_requests == 0
+
+
+async def test__request_coalescing__with_response_cache_and_instrumentation():
+    endpoint = SlowEndpoint()
+    response_cache = ResponseCache()
+    metrics = RoutingMetrics()
+    app = make_app(
+        endpoint,
+        request_coalescing=RequestCoalescing(),
+        response_cache=response_cache,
+        instrumentation=metrics,
+    )
+    headers = {"X-API-VERSION": "2022-01-01"}
+
+    responses = await send_concurrently(app, endpoint, [("GET", "/cached", headers)] * 3)
+    responses += await send_concurrently(app, endpoint, [("GET", "/cached", headers)])
+
+    assert [response.json() for response in responses] == [1, 1, 1, 1]
+    assert response_cache.hits == 1
+    assert metrics.requests == 4
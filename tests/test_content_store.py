@@ -0,0 +1,50 @@
+from verselect.content_store import ContentStore
+
+
+def test__intern__identical_subtrees__shared():
+    store = ContentStore()
+    first = store.intern({"schemas": {"Error": {"type": "object", "required": ["code"]}}, "title": "v1"})
+    second = store.intern({"schemas": {"Error": {"type": "object", "required": ["code"]}}, "title": "v2"})
+
+    assert first == {"schemas": {"Error": {"type": "object", "required": ["code"]}}, "title": "v1"}
+    assert first is not second
+    assert first["schemas"] is second["schemas"]
+    assert store.intern({"type": "object", "required": ["code"]}) is first["schemas"]["Error"]
+
+
+def test__intern__equal_but_differently_serialized__not_shared():
+    store = ContentStore()
+    assert store.intern({"a": 1, "b": 2}) is not store.intern({"b": 2, "a": 1})
+    assert store.intern([1]) is not store.intern([True])
+    assert store.intern([1]) is not store.intern([1.0])
+    assert store.intern([1])[0] is not True
+
+
+def test__release__values_only_used_by_released_value__forgotten():
+    store = ContentStore()
+    kept = store.intern({"kept": ["a"], "shared": {"type": "object"}})
+    released = store.intern({"dropped": ["b"], "shared": {"type": "object"}})
+
+    store.release(released)
+
+    # the root, "kept", ["a"], "a", "shared", {"type": "object"}, "type" and "object"
+    assert len(store) == 8
+    assert store.intern({"kept": ["a"], "shared": {"type": "object"}}) is kept
+    assert store.intern({"type": "object"}) is kept["shared"]
+    assert store.intern(["b"]) is not released["dropped"]
+    store.clear()
+    assert len(store) == 0
+
+
+def test__release__value_interned_several_times__kept_until_every_one_released():
+    store = ContentStore()
+    first = store.intern({"schemas": ["Error"]})
+    second = store.intern({"schemas": ["Error"]})
+    assert first is second
+
+    store.release(first)
+    assert store.intern({"schemas": ["Error"]}) is first
+    store.release(first)
+    store.release(first)
+
+    assert len(store) == 0
@@ -0,0 +1,49 @@
+import gzip
+import json
+from pathlib import Path
+
+import pytest
+
+from tests._resources.versioned_app.app import versioned_app
+from verselect.__main__ import main
+from verselect.export import export_docs, load_app
+
+APP_IMPORT_STRING = "tests._resources.versioned_app.app:versioned_app"
+VERSIONS = ("2021-01-01", "2022-02-02", "unversioned")
+
+
+def assert_exported(directory: Path) -> None:
+    for version in VERSIONS:
+        openapi = (directory / "openapi" / f"{version}.json").read_bytes()
+        assert json.loads(openapi) == versioned_app.swaggers[version]
+        assert gzip.decompress((directory / "openapi" / f"{version}.json.gz").read_bytes()) == openapi
+        assert f"'../openapi/{version}.json'" in (directory / "swagger" / f"{version}.html").read_text()
+    dashboard = (directory / "index.html").read_text()
+    for version in VERSIONS:
+        assert f'<a href="swagger/{version}.html">' in dashboard
+
+
+def test__export_docs__in_current_process(tmp_path: Path):
+    assert export_docs(versioned_app, tmp_path) == VERSIONS
+    assert_exported(tmp_path)
+
+
+def test__export_docs__in_process_pool(tmp_path: Path):
+    assert export_docs(versioned_app, tmp_path, import_string=APP_IMPORT_STRING, processes=2) == VERSIONS
+    assert_exported(tmp_path)
+
+
+def test__export_cli(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    assert main(["export", APP_IMPORT_STRING, str(tmp_path / "docs"), "--processes", "1"]) == 0
+    assert_exported(tmp_path / "docs")
+    assert capsys.readouterr().out == f"Exported 3 versions to {tmp_path / 'docs'}\n"
+
+
+def test__load_app__invalid_import_string__error():
+    with pytest.raises(ValueError, match='The app should be given as "module:attribute"'):
+        load_app("tests._resources.versioned_app.app")
+
+
+def test__load_app__not_header_routing_app__error():
+    with pytest.raises(TypeError, match="is not a HeaderRoutingFastAPI app"):
+        load_app("tests._resources.versioned_app.app:client")
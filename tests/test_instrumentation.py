@@ -0,0 +1,162 @@
+from datetime import date
+
+from starlette.testclient import TestClient
+
+from tests._resources.items_app import make_app
+from verselect.instrumentation import Histogram, RoutingInstrumentation, RoutingMetrics, RoutingRecord
+from verselect.usage import VersionUsage, merge_version_usage_snapshots
+
+
+class RecordingInstrumentation(RoutingInstrumentation):
+    def __init__(self, *, server_timing: bool = False) -> None:
+        super().__init__(server_timing=server_timing)
+        self.records: list[RoutingRecord] = []
+
+    def on_request(self, record: RoutingRecord) -> None:
+        self.records.append(record)
+
+
+def test__instrumentation__records_every_request():
+    instrumentation = RecordingInstrumentation()
+    client = TestClient(make_app(instrumentation=instrumentation))
+
+    assert client.get("/items/1", headers={"X-API-VERSION": "2022-06-01"}).status_code == 200
+    assert client.get("/items/1", headers={"X-API-VERSION": "2022-06-01"}).status_code == 200
+    assert client.get("/items/1", headers={"X-API-VERSION": "2021-01-01"}).status_code == 404
+    assert client.get("/items/1", headers={"X-API-VERSION": "2022-13-45"}).status_code == 422
+    assert client.get("/openapi.json?version=2022-01-01").status_code == 200
+
+    first, second, too_old, invalid, unversioned = instrumentation.records
+    assert first.requested_version == "2022-06-01"
+    assert first.resolved_version == date(2022, 1, 1)
+    assert first.cache_hit is False
+    assert first.routes_scanned == 1
+    assert first.match_ns > 0
+    assert first.resolve_ns > 0
+    assert first.validate_ns > 0
+    assert second.cache_hit is True
+    assert too_old.requested_version == "2021-01-01"
+    assert too_old.resolved_version is None
+    assert invalid.requested_version == "2022-13-45"
+    assert invalid.cache_hit is None
+    assert invalid.match_ns == 0
+    assert unversioned.requested_version is None
+    assert unversioned.cache_hit is None
+    assert unversioned.routes_scanned == 1
+
+
+def test__instrumentation__server_timing():
+    client = TestClient(make_app(instrumentation=RoutingInstrumentation(server_timing=True)))
+    response = client.get("/items/1", headers={"X-API-VERSION": "2022-06-01"})
+    assert response.headers["server-timing"].startswith("verselect-validate;dur=")
+    assert "verselect-resolve;dur=" in response.headers["server-timing"]
+    assert "verselect-match;dur=" in response.headers["server-timing"]
+
+    client = TestClient(make_app(instrumentation=RoutingInstrumentation()))
+    assert "server-timing" not in client.get("/items/1", headers={"X-API-VERSION": "2022-06-01"}).headers
+
+
+def test__instrumentation__disabled_by_default():
+    client = TestClient(make_app())
+    response = client.get("/items/1", headers={"X-API-VERSION": "2022-06-01"})
+    assert response.status_code == 200
+    assert "server-timing" not in response.headers
+
+
+def test__instrumentation__router_without_middleware():
+    instrumentation = RecordingInstrumentation(server_timing=True)
+    app = make_app(instrumentation=instrumentation)
+    client = TestClient(app.router)
+    response = client.get("/items/1", headers={"X-API-VERSION": "2023-01-01"})
+    assert response.status_code == 200
+    assert "verselect-match;dur=" in response.headers["server-timing"]
+    (record,) = instrumentation.records
+    assert record.resolved_version == date(2023, 1, 1)
+    assert record.validate_ns == 0
+
+
+def test__routing_metrics():
+    metrics = RoutingMetrics()
+    client = TestClient(make_app(instrumentation=metrics))
+    client.get("/items/1", headers={"X-API-VERSION": "2022-06-01"})
+    client.get("/items/1", headers={"X-API-VERSION": "2022-06-01"})
+    client.get("/items/1", headers={"X-API-VERSION": "2021-01-01"})
+    client.get("/openapi.json?version=2022-01-01")
+
+    snapshot = metrics.snapshot()
+    assert snapshot["requests"] == 4
+    assert snapshot["unversioned_requests"] == 1
+    assert snapshot["unresolved_requests"] == 1
+    assert snapshot["cache_hits"] == 1
+    assert snapshot["cache_misses"] == 2
+    assert snapshot["match_seconds"]["count"] == 4
+    assert snapshot["routes_scanned"]["buckets"]["+Inf"] == 4
+
+
+def test__histogram():
+    histogram = Histogram([1, 5])
+    for value in (0, 1, 2, 10):
+        histogram.observe(value)
+    assert histogram.snapshot() == {"buckets": {"1": 2, "5": 3, "+Inf": 4}, "sum": 13.0, "count": 4}
+
+
+def test__version_usage():
+    app = make_app(version_usage_url="/version-usage", instrumentation=RoutingMetrics())
+    client = TestClient(app)
+
+    client.get("/items/1", headers={"X-API-VERSION": "2022-06-01"})
+    client.get("/items/1", headers={"X-API-VERSION": "2022-06-01"})
+    client.get("/items/1", headers={"X-API-VERSION": "2023-01-01"})
+    client.get("/nothing", headers={"X-API-VERSION": "2023-01-01"})
+    client.get("/items/1", headers={"X-API-VERSION": "2021-01-01"})
+    client.get("/items/1", headers={"X-API-VERSION": "2022-13-45"})
+
+    response = client.get("/version-usage")
+    assert response.status_code == 200
+    assert response.json() == {
+        "requested_values": {"2022-06-01": 2, "2023-01-01": 2, "2021-01-01": 1, "2022-13-45": 1},
+        "resolved_versions": {"2022-01-01": 2, "2023-01-01": 2},
+        "routes": {
+            "2022-01-01": {"GET /items/{item_id}": 2},
+            "2023-01-01": {"GET /items/{item_id}": 1, "<no route>": 1},
+        },
+        "too_old_requests": 1,
+        "invalid_requests": 1,
+    }
+    assert app.router.instrumentation.instrumentations[0].requests == 7
+    assert "/version-usage" not in client.get("/openapi.json").text
+
+
+def test__version_usage__limits_requested_values():
+    usage = VersionUsage(max_requested_values=1)
+    for value in ("2022-01-01", "2022-01-02", "2022-01-03", "2022-01-01"):
+        record = RoutingRecord()
+        record.requested_version = value
+        record.routed = True
+        record.resolved_version = date(2022, 1, 1)
+        usage.on_request(record)
+    assert usage.snapshot()["requested_values"] == {"2022-01-01": 2, "other": 2}
+
+
+def test__merge_version_usage_snapshots():
+    first = {
+        "requested_values": {"2022-01-01": 1},
+        "resolved_versions": {"2022-01-01": 1},
+        "routes": {"2022-01-01": {"GET /a": 1}},
+        "too_old_requests": 1,
+        "invalid_requests": 0,
+    }
+    second = {
+        "requested_values": {"2022-01-01": 2, "2023-01-01": 1},
+        "resolved_versions": {"2022-01-01": 2, "2023-01-01": 1},
+        "routes": {"2022-01-01": {"GET /a": 1, "GET /b": 1}, "2023-01-01": {"GET /a": 1}},
+        "too_old_requests": 0,
+        "invalid_requests": 2,
+    }
+    assert merge_version_usage_snapshots([first, second]) == {
+        "requested_values": {"2022-01-01": 3, "2023-01-01": 1},
+        "resolved_versions": {"2022-01-01": 3, "2023-01-01": 1},
+        "routes": {"2022-01-01": {"GET /a": 2, "GET /b": 1}, "2023-01-01": {"GET /a": 1}},
+        "too_old_requests": 1,
+        "invalid_requests": 2,
+    }
@@ -1,11 +1,19 @@
 import re
+import subprocess
+import sys
+from datetime import date
 from typing import cast
+from unittest import mock
+from unittest.mock import ANY
 
 import pytest
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRoute
 from fastapi.testclient import TestClient
+from starlette.routing import BaseRoute
 
+from tests._resources.app_for_testing_routing import router as routing_test_router
 from tests._resources.utils import BASIC_HEADERS, DEFAULT_API_VERSION
 from tests._resources.versioned_app.app import (
     client_without_headers,
@@ -14,8 +22,11 @@ from tests._resources.versioned_app.app import (
     v2021_01_01_router,
     v2022_01_02_router,
     versioned_app,
+    webhooks_router,
 )
 from verselect.app import HeaderRoutingFastAPI
+from verselect.middleware import _get_api_version_dependency
+from verselect.routing_table import RoutingTable
 
 
 def test__header_routing__invalid_version_format__error():
@@ -124,3 +135,348 @@ def test__empty_root():
 
 def test__lifespan_context_exists():
     assert versioned_app.router.lifespan_context is lifespan
+
+
+def test__header_based_versioning__invalid_version_header__same_error_as_fastapi_validation():
+    resp = client_without_headers.get("/v1", headers={"X-API-VERSION": "2025-40-01"})
+    assert resp.status_code == 422
+    assert resp.json() == [
+        {
+            "type": "date_from_datetime_parsing",
+            "loc": ["header", "x-api-version"],
+            "msg": "Input should be a valid date or datetime, month value is outside expected range of 1-12",
+            "input": "2025-40-01",
+            "ctx": {"error": "month value is outside expected range of 1-12"},
+            "url": ANY,
+        },
+    ]
+
+
+def test__header_based_versioning__non_iso_date_accepted_by_fastapi__normalized():
+    resp = client_without_headers.get("/v1", headers={"X-API-VERSION": "2022-02-02T00:00:00"})
+    assert resp.status_code == 200
+    assert resp.json() == {"my_version2": 2}
+    assert resp.headers["X-API-VERSION"] == "2022-02-02"
+
+
+def test__header_based_versioning__streaming_response__version_header_added_once():
+    router = APIRouter()
+
+    @router.get("/stream")
+    def stream():
+        return StreamingResponse(iter([b"first ", b"second"]), headers={"X-API-VERSION": "overridden"})
+
+    app = HeaderRoutingFastAPI()
+    app.add_header_versioned_routers(router, header_value="2022-01-01")
+
+    resp = TestClient(app).get("/stream", headers={"X-API-VERSION": "2023-05-05"})
+
+    assert resp.text == "first second"
+    assert resp.headers.get_list("X-API-VERSION") == ["2023-05-05"]
+
+
+def test__openapi__registration__no_openapi_generated_until_requested(monkeypatch: pytest.MonkeyPatch):
+    app = HeaderRoutingFastAPI()
+    generated_openapis = []
+    original_generate_openapi = app.generate_openapi
+
+    def generate_openapi(routes: list[BaseRoute]):
+        generated_openapis.append(routes)
+        return original_generate_openapi(routes)
+
+    monkeypatch.setattr(app.swaggers, "generate_openapi", generate_openapi)
+    for version in ["2021-01-01", "2022-01-01", "2023-01-01"]:
+        app.add_header_versioned_routers(v2021_01_01_router, header_value=version)
+    assert generated_openapis == []
+    assert sorted(app.swaggers) == ["2021-01-01", "2022-01-01", "2023-01-01"]
+
+    client = TestClient(app)
+    assert client.get("/openapi.json?version=2022-01-01").status_code == 200
+    assert client.get("/openapi.json?version=2022-01-01").status_code == 200
+    assert generated_openapis == [app.router.versioned_routes[date(2022, 1, 1)]]
+
+    app.enrich_swagger()
+    assert len(generated_openapis) == len(app.swaggers) == 3
+
+
+def test__openapi__routes_added_to_version__only_that_version_regenerated():
+    app = HeaderRoutingFastAPI()
+    app.add_header_versioned_routers(v2021_01_01_router, header_value="2021-01-01")
+    app.add_header_versioned_routers(v2021_01_01_router, header_value="2022-01-01")
+    openapi_2021 = app.swaggers["2021-01-01"]
+    openapi_2022 = app.swaggers["2022-01-01"]
+
+    app.add_header_versioned_routers(webhooks_router, header_value="2022-01-01")
+
+    assert app.swaggers["2021-01-01"] is openapi_2021
+    assert app.swaggers["2022-01-01"] is not openapi_2022
+    assert "/v1/webhooks" in app.swaggers["2022-01-01"]["paths"]
+
+
+def test__openapi__unversioned_routes_without_schema__no_unversioned_openapi():
+    app = HeaderRoutingFastAPI()
+    assert "unversioned" not in app.swaggers
+    assert list(app.swaggers) == []
+
+    app.add_unversioned_routers(webhooks_router)
+    assert "unversioned" in app.swaggers
+    assert list(app.swaggers["unversioned"]["paths"]) == ["/v1/webhooks"]
+
+
+def test__openapi__identical_parts_of_versions__shared():
+    app = HeaderRoutingFastAPI()
+    router = APIRouter()
+
+    @router.get("/users")
+    async def get_users():
+        raise NotImplementedError
+
+    app.add_header_versioned_routers(router, header_value="2021-01-01")
+    app.add_header_versioned_routers(router, header_value="2022-01-01")
+    client = TestClient(app)
+    openapi_2021 = client.get("/openapi.json?version=2021-01-01").json()
+    assert client.get("/openapi.json?version=2022-01-01").status_code == 200
+
+    assert app.swaggers["2021-01-01"] == openapi_2021
+    assert app.swaggers["2021-01-01"]["info"] is app.swaggers["2022-01-01"]["info"]
+    schemas = app.swaggers["2021-01-01"]["components"]["schemas"]
+    assert schemas is app.swaggers["2022-01-01"]["components"]["schemas"]
+    report = app.swaggers.get_sharing_report()
+    assert list(report.bytes_saved_per_version) == ["2021-01-01", "2022-01-01"]
+    assert report.bytes_saved_per_version["2022-01-01"] > report.bytes_saved_per_version["2021-01-01"]
+    assert report.approximate_bytes_saved == sum(report.bytes_saved_per_version.values())
+
+    app.swaggers.invalidate("2022-01-01")
+    assert app.swaggers["2021-01-01"]["components"]["schemas"] is schemas
+    assert app.swaggers["2022-01-01"]["components"]["schemas"] is schemas
+
+
+def test__get_openapi__gzip_accepted__compressed_with_etag():
+    resp = client_without_headers.get("/openapi.json?version=2021-01-01", headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["Vary"] == "Accept-Encoding"
+    assert resp.headers["ETag"].endswith('-gzip"')
+    assert resp.json() == versioned_app.swaggers["2021-01-01"]
+
+
+@pytest.mark.parametrize("accept_encoding", ["identity", "gzip;q=0", "gzip;q=invalid", "deflate, *;q=0", ""])
+def test__get_openapi__gzip_not_accepted__not_compressed(accept_encoding: str):
+    resp = client_without_headers.get(
+        "/openapi.json?version=2021-01-01",
+        headers={"Accept-Encoding": accept_encoding},
+    )
+    assert resp.status_code == 200
+    assert "Content-Encoding" not in resp.headers
+    assert resp.json() == versioned_app.swaggers["2021-01-01"]
+
+
+@pytest.mark.parametrize("accept_encoding", ["identity", "gzip"])
+def test__get_openapi__if_none_match_any_etag_of_the_version__304(accept_encoding: str):
+    etag = client_without_headers.get("/openapi.json?version=2021-01-01").headers["ETag"]
+    headers = {"Accept-Encoding": accept_encoding}
+
+    for if_none_match in [etag, f"W/{etag}", f'"other", {etag}', "*"]:
+        resp = client_without_headers.get(
+            "/openapi.json?version=2021-01-01",
+            headers=headers | {"If-None-Match": if_none_match},
+        )
+        assert resp.status_code == 304
+        assert resp.content == b""
+
+    resp = client_without_headers.get("/openapi.json?version=2022-02-02", headers=headers | {"If-None-Match": etag})
+    assert resp.status_code == 200
+
+
+def test__header_routing__same_router_in_many_versions__routes_shared():
+    app = HeaderRoutingFastAPI()
+    first_routes = app.add_header_versioned_routers(v2021_01_01_router, header_value="2021-01-01")
+    second_routes = app.add_header_versioned_routers(v2021_01_01_router, header_value="2022-01-01")
+    third_routes = app.add_header_versioned_routers(v2021_01_01_router, header_value="2023-01-01")
+
+    assert len(first_routes) == 2
+    assert all(
+        first is second is third for first, second, third in zip(first_routes, second_routes, third_routes, strict=True)
+    )
+    assert app.routes[-2:] == first_routes
+    assert len(app.routes) == 4
+
+    report = app.get_route_sharing_report()
+    assert report.registered_routes == 6
+    assert report.unique_routes == 2
+    assert report.approximate_bytes_saved > 0
+
+
+def test__get_memory_report__shared_routes__reported_per_version():
+    app = HeaderRoutingFastAPI(memory_report_url="/memory-report")
+    app.add_header_versioned_routers(v2021_01_01_router, header_value="2021-01-01")
+    app.add_header_versioned_routers(v2021_01_01_router, header_value="2022-01-01")
+    app.add_header_versioned_routers(v2022_01_02_router, header_value="2022-01-02")
+    app.swaggers["2021-01-01"]
+
+    report = app.get_memory_report()
+
+    assert report.unique_routes == 3 + len(app.router.unversioned_routes)
+    first, second, third = report.versions["2021-01-01"], report.versions["2022-01-01"], report.versions["2022-01-02"]
+    assert (first.routes, first.shared_routes) == (2, 2)
+    assert (second.routes, second.shared_routes) == (2, 2)
+    assert (third.routes, third.shared_routes) == (1, 0)
+    assert first.approximate_exclusive_routing_bytes < first.approximate_routing_bytes
+    assert third.approximate_exclusive_routing_bytes > first.approximate_exclusive_routing_bytes
+    assert first.compiled_regexes == 2
+    # the routes of both routers have the same path so re compiled them into the same pattern
+    assert report.compiled_regexes == 2 + report.versions["unversioned"].compiled_regexes
+    assert report.approximate_routing_bytes < sum(
+        version.approximate_routing_bytes for version in report.versions.values()
+    )
+    assert first.approximate_openapi_bytes is not None
+    assert second.approximate_openapi_bytes is None
+    assert report.approximate_openapi_bytes >= first.approximate_openapi_bytes
+
+    resp = TestClient(app).get("/memory-report")
+    assert resp.status_code == 200
+    assert resp.json()["versions"]["2022-01-02"]["shared_routes"] == 0
+
+
+def test__header_routing__router_changed_between_versions__routes_not_shared():
+    router = APIRouter()
+    router.get("/first")(lambda: 1)
+    app = HeaderRoutingFastAPI()
+    [first_route] = app.add_header_versioned_routers(router, header_value="2021-01-01")
+    router.get("/second")(lambda: 2)
+
+    added_routes = app.add_header_versioned_routers(router, header_value="2022-01-01")
+
+    assert [cast("APIRoute", route).path for route in added_routes] == ["/first", "/second"]
+    assert added_routes[0] is not first_route
+    assert app.get_route_sharing_report() == (3, 3, 0)
+
+
+def test__get_openapi__shared_routes__version_header_example_is_per_version():
+    app = HeaderRoutingFastAPI()
+    versions = ["2021-01-01", "2022-02-02"]
+    for version in versions:
+        app.add_header_versioned_routers(v2021_01_01_router, header_value=version)
+
+    for version in versions:
+        [parameter] = app.swaggers[version]["paths"]["/v1"]["get"]["parameters"]
+        assert parameter["name"] == "x-api-version"
+        assert parameter["schema"]["default"] == version
+        assert parameter["schema"]["examples"] == [version]
+
+
+path_and_query_params_router = APIRouter()
+
+
+@path_and_query_params_router.get("/items/{item_id}")
+async def get_item(item_id: int, q: str = ""):
+    return {"item_id": item_id, "q": q}
+
+
+@pytest.mark.parametrize(
+    "router",
+    [v2021_01_01_router, webhooks_router, routing_test_router, path_and_query_params_router],
+)
+def test__get_openapi__version_header__documented_like_a_header_dependency(router: APIRouter):
+    app = HeaderRoutingFastAPI()
+    app.add_header_versioned_routers(router, header_value="2021-01-01")
+    app_with_header_dependency = FastAPI()
+    app_with_header_dependency.include_router(
+        router,
+        dependencies=[Depends(_get_api_version_dependency("x-api-version", "2021-01-01"))],
+    )
+
+    assert app.swaggers["2021-01-01"] == app.generate_openapi(app_with_header_dependency.routes)
+
+
+def test__header_routing__versioned_routes__no_version_header_dependency():
+    app = HeaderRoutingFastAPI()
+    [route, _] = app.add_header_versioned_routers(v2021_01_01_router, header_value="2021-01-01")
+
+    assert cast("APIRoute", route).dependant.dependencies == []
+
+
+def test__add_versions__every_version_added_with_one_routing_table():
+    first_router = APIRouter()
+    first_router.get("/items")(lambda: "first")
+    second_router = APIRouter()
+    second_router.get("/items")(lambda: "second")
+    users_router = APIRouter()
+    users_router.get("/users")(lambda: "users")
+    app = HeaderRoutingFastAPI()
+    client = TestClient(app)
+    assert client.get("/openapi.json?version=2021-01-01").status_code == 404
+    build_routing_table = mock.patch.object(RoutingTable, "replace", side_effect=RoutingTable.replace, autospec=True)
+
+    with build_routing_table as replace:
+        added_routes = app.add_versions(
+            {"2021-01-01": first_router, "2022-01-01": [second_router, users_router], "2023-01-01": []},
+        )
+
+    replace.assert_called_once()
+
+    assert [cast("APIRoute", route).path for route in added_routes["2022-01-01"]] == ["/items", "/users"]
+    assert added_routes["2023-01-01"] == []
+    assert list(app.router.versioned_routes) == [date(2021, 1, 1), date(2022, 1, 1)]
+    assert client.get("/items", headers={"X-API-VERSION": "2021-06-01"}).json() == "first"
+    assert client.get("/items", headers={"X-API-VERSION": "2022-06-01"}).json() == "second"
+    assert client.get("/users", headers={"X-API-VERSION": "2021-06-01"}).status_code == 404
+    assert "/users" in client.get("/openapi.json?version=2022-01-01").json()["paths"]
+
+
+def test__add_versions__invalid_version__nothing_added():
+    app = HeaderRoutingFastAPI()
+    with pytest.raises(ValueError, match=re.escape("header_value should be in ISO 8601 format")):
+        app.add_versions({"2021-01-01": v2021_01_01_router, "2022-01_01": v2022_01_02_router})
+    assert app.router.versioned_routes == {}
+    assert app.get_route_sharing_report().registered_routes == 0
+
+
+def test__templates__built_on_first_use():
+    code = (
+        "import sys; from verselect import HeaderRoutingFastAPI; HeaderRoutingFastAPI(); "
+        "assert 'jinja2' not in sys.modules; HeaderRoutingFastAPI.templates; assert 'jinja2' in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+    assert HeaderRoutingFastAPI().templates is HeaderRoutingFastAPI.templates
+
+
+def test__warm_up__on_startup__versions_resolved_and_openapis_generated(caplog: pytest.LogCaptureFixture):
+    caplog.set_level("INFO", logger="verselect.app")
+    app = HeaderRoutingFastAPI(warm_up=True)
+    app.add_header_versioned_routers(v2021_01_01_router, header_value="2021-01-01")
+    app.add_header_versioned_routers(v2022_01_02_router, header_value="2022-01-02")
+
+    with TestClient(app):
+        for version in ("2021-01-01", "2022-01-02"):
+            assert app.swaggers.get_generated(version) is not None
+        assert app.router.routing_table.is_resolved(b"2021-01-01")
+        assert app.router.routing_table.is_resolved(b"2022-01-02")
+
+    assert "Warmed up 2 versions" in caplog.text
+
+
+def test__warm_up__sync_dependency__thread_pool_started():
+    router = APIRouter()
+
+    def sync_dependency():
+        return 1
+
+    @router.get("/sync")
+    async def endpoint(value: int = Depends(sync_dependency)):
+        return value
+
+    app = HeaderRoutingFastAPI(openapi_url=None, warm_up=True)
+    app.add_header_versioned_routers(router, header_value="2021-01-01")
+
+    with mock.patch("verselect.app.run_in_threadpool") as run_in_threadpool, TestClient(app) as client:
+        run_in_threadpool.assert_called_once()
+        assert client.get("/sync", headers={"x-api-version": "2021-01-01"}).json() == 1
+
+
+def test__warm_up__not_enabled__nothing_generated_on_startup():
+    app = HeaderRoutingFastAPI()
+    app.add_header_versioned_routers(v2021_01_01_router, header_value="2021-01-01")
+
+    with TestClient(app):
+        assert app.swaggers.get_generated("2021-01-01") is None
@@ -0,0 +1,168 @@
+import asyncio
+import subprocess
+import sys
+from contextvars import ContextVar
+from datetime import date
+from pathlib import Path
+
+import pytest
+from fastapi import APIRouter
+from starlette.testclient import TestClient
+
+from verselect import HeaderRoutingFastAPI
+from verselect.pinning import SQLiteVersionPinning, VersionPinning
+
+
+class DictVersionPinning(VersionPinning):
+    def __init__(self, pins: dict[str, date], **kwargs: float) -> None:
+        super().__init__(**kwargs)
+        self.pins = pins
+        self.loaded_client_ids: list[str] = []
+
+    async def load_pinned_version(self, client_id: str) -> date | None:
+        self.loaded_client_ids.append(client_id)
+        await asyncio.sleep(0)
+        return self.pins.get(client_id)
+
+
+def make_scope(client_id: str) -> dict:
+    return {"type": "http", "headers": [(b"x-api-key", client_id.encode())]}
+
+
+def make_app(version_pinning: VersionPinning, api_version_var: ContextVar[date | None]) -> HeaderRoutingFastAPI:
+    app = HeaderRoutingFastAPI(version_pinning=version_pinning, api_version_var=api_version_var)
+    for version in ("2022-01-01", "2023-01-01"):
+        router = APIRouter()
+
+        @router.get("/users")
+        async def get_users(version: str = version):
+            return {"version": version, "api_version": api_version_var.get().isoformat()}
+
+        app.add_header_versioned_routers(router, header_value=version)
+    webhooks = APIRouter()
+
+    @webhooks.post("/webhooks")
+    async def webhook():
+        return "webhook"
+
+    app.add_unversioned_routers(webhooks)
+    return app
+
+
+def test__sqlite_version_pinning__request_without_header__routed_to_pinned_version(tmp_path: Path):
+    version_pinning = SQLiteVersionPinning(tmp_path / "pins.sqlite3")
+    version_pinning.create_table()
+    version_pinning.pin("integrator", "2022-06-01")
+    version_pinning.pin("too-old", "2021-01-01")
+    api_version_var: ContextVar[date | None] = ContextVar("api_version", default=None)
+    client = TestClient(make_app(version_pinning, api_version_var))
+
+    response = client.get("/users", headers={"X-API-Key": "integrator"})
+    assert response.json() == {"version": "2022-01-01", "api_version": "2022-06-01"}
+    assert response.headers["x-api-version"] == "2022-06-01"
+    # an explicit header always wins over the pinned version
+    response = client.get("/users", headers={"X-API-Key": "integrator", "X-API-VERSION": "2023-01-01"})
+    assert response.json()["version"] == "2023-01-01"
+    # the pinned clients still get the unversioned routes
+    assert client.post("/webhooks", headers={"X-API-Key": "integrator"}).json() == "webhook"
+    assert client.post("/webhooks", headers={"X-API-Key": "too-old"}).json() == "webhook"
+    assert client.get("/users", headers={"X-API-Key": "too-old"}).status_code == 404
+    assert client.get("/users", headers={"X-API-Key": "unknown"}).status_code == 404
+    assert "x-api-version" not in client.get("/users").headers
+
+    version_pinning.pin("integrator", "2023-01-01")
+    assert client.get("/users", headers={"X-API-Key": "integrator"}).json()["version"] == "2023-01-01"
+    version_pinning.pin("integrator", None)
+    assert client.get("/users", headers={"X-API-Key": "integrator"}).status_code == 404
+
+
+def test__sqlite_version_pinning__invalid_table__error(tmp_path: Path):
+    with pytest.raises(ValueError, match="table should be a valid identifier"):
+        SQLiteVersionPinning(tmp_path / "pins.sqlite3", table="pins; DROP TABLE pins")
+
+
+async def test__version_pinning__cached_and_coalesced():
+    version_pinning = DictVersionPinning({"integrator": date(2022, 1, 1)})
+
+    versions = await asyncio.gather(*(version_pinning.resolve(make_scope("integrator")) for _ in range(5)))
+    assert versions == [date(2022, 1, 1)] * 5
+    assert await version_pinning.resolve(make_scope("integrator")) == date(2022, 1, 1)
+    assert await version_pinning.resolve({"type": "http", "headers": []}) is None
+
+    assert version_pinning.loaded_client_ids == ["integrator"]
+
+
+async def test__version_pinning__expired__stale_version_used_while_refreshed():
+    version_pinning = DictVersionPinning({"integrator": date(2022, 1, 1)}, ttl=0)
+    assert await version_pinning.resolve(make_scope("integrator")) == date(2022, 1, 1)
+    version_pinning.pins["integrator"] = date(2023, 1, 1)
+
+    assert await version_pinning.resolve(make_scope("integrator")) == date(2022, 1, 1)
+    assert await version_pinning.resolve(make_scope("integrator")) == date(2022, 1, 1)
+    await asyncio.sleep(0.01)
+
+    assert await version_pinning.resolve(make_scope("integrator")) == date(2023, 1, 1)
+    assert len(version_pinning.loaded_client_ids) == 2
+
+
+async def test__version_pinning__cache__is_bounded():
+    version_pinning = DictVersionPinning({}, cache_size=2)
+    for client_id in ("a", "b", "a", "c"):
+        await version_pinning.resolve(make_scope(client_id))
+
+    assert list(version_pinning._cache) == ["a", "c"]
+    version_pinning.invalidate()
+    assert list(version_pinning._cache) == []
+
+
+async def test__version_pinning__load_failed__known_version_kept(caplog: pytest.LogCaptureFixture):
+    version_pinning = DictVersionPinning({"integrator": date(2022, 1, 1)}, ttl=0)
+    assert await version_pinning.resolve(make_scope("integrator")) == date(2022, 1, 1)
+
+    async def fail(client_id: str) -> date | None:
+        raise ConnectionError
+
+    version_pinning.load_pinned_version = fail
+    assert await version_pinning.resolve(make_scope("integrator")) == date(2022, 1, 1)
+    await asyncio.sleep(0.01)
+    assert await version_pinning.resolve(make_scope("integrator")) == date(2022, 1, 1)
+    assert await version_pinning.resolve(make_scope("unknown")) is None
+    assert "Failed to load the pinned version of a client" in caplog.text
+
+
+async def test__version_pinning__load_failed__not_retried_until_failure_ttl():
+    version_pinning = DictVersionPinning({}, failure_ttl=60)
+    calls = 0
+
+    async def fail(client_id: str) -> date | None:
+        nonlocal calls
+        calls += 1
+        raise ConnectionError
+
+    version_pinning.load_pinned_version = fail
+    for _ in range(3):
+        assert await version_pinning.resolve(make_scope("integrator")) is None
+    assert calls == 1
+
+    version_pinning.failure_ttl = 0
+    version_pinning.invalidate("integrator")
+    for _ in range(2):
+        assert await version_pinning.resolve(make_scope("integrator")) is None
+        await asyncio.sleep(0.01)
+    assert calls == 3
+
+
+def test__version_pinning__load_pinned_version_not_implemented__error():
+    class NoVersionPinning(VersionPinning):
+        pass
+
+    with pytest.raises(TypeError, match="load_pinned_version"):
+        NoVersionPinning()  # type: ignore[abstract]
+
+
+def test__version_pinning__not_imported_unless_used():
+    code = (
+        "import sys; from verselect import HeaderRoutingFastAPI; HeaderRoutingFastAPI(); "
+        "assert 'verselect.pinning' not in sys.modules and 'sqlite3' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,118 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+
+import pytest
+from starlette.testclient import TestClient
+from starlette.types import Receive, Scope, Send
+
+from tests._resources.items_app import make_app, other_function, slow_function
+from verselect.profiling import RequestProfiler
+
+
+def get_functions(snapshot: dict, version: str, route: str) -> list[str]:
+    return [function["function"] for function in snapshot[version][route]["functions"]]
+
+
+def test__request_profiler__profiles_selected_version_and_route():
+    profiler = RequestProfiler(sample_rate=1, versions=["2022-01-01"], paths=["/items/{item_id}"])
+    client = TestClient(make_app(profiler=profiler, profiles_url="/profiles"))
+
+    for version in ("2022-06-01", "2022-01-01", "2023-01-01"):
+        assert client.get("/items/1", headers={"X-API-VERSION": version}).json() == {"item_id": 1, "total": 499500}
+        assert client.get("/users", headers={"X-API-VERSION": version}).json() == 1
+    snapshot = client.get("/profiles?limit=1000").json()
+
+    assert list(snapshot) == ["2022-01-01"]
+    assert list(snapshot["2022-01-01"]) == ["GET /items/{item_id}"]
+    assert snapshot["2022-01-01"]["GET /items/{item_id}"]["requests"] == 2
+    functions = get_functions(snapshot, "2022-01-01", "GET /items/{item_id}")
+    assert any(function.endswith("(slow_function)") for function in functions)
+    function = snapshot["2022-01-01"]["GET /items/{item_id}"]["functions"][0]
+    assert function.keys() == {"function", "calls", "primitive_calls", "total_seconds", "cumulative_seconds"}
+    assert len(client.get("/profiles?limit=1").json()["2022-01-01"]["GET /items/{item_id}"]["functions"]) == 1
+    assert client.get("/profiles?limit=a").status_code == 422
+
+    profiler.reset()
+    assert client.get("/profiles").json() == {}
+
+
+def test__request_profiler__trigger_header():
+    profiler = RequestProfiler(sample_rate=0, trigger_token="secret")
+    client = TestClient(make_app(profiler=profiler, profiles_url="/profiles"))
+
+    client.get("/users", headers={"X-API-VERSION": "2023-01-01"})
+    client.get("/users", headers={"X-API-VERSION": "2023-01-01", "X-Verselect-Profile": "wrong"})
+    client.get("/users", headers={"X-API-VERSION": "2023-01-01", "X-Verselect-Profile": "secret"})
+    client.get("/profiles", headers={"X-Verselect-Profile": "secret"})
+
+    snapshot = profiler.snapshot(limit=1000)
+    assert snapshot["2023-01-01"]["GET /users"]["requests"] == 1
+    assert any(
+        function.endswith("(other_function)") for function in get_functions(snapshot, "2023-01-01", "GET /users")
+    )
+    assert snapshot["unversioned"]["GET,HEAD /profiles"]["requests"] == 1
+
+
+def test__request_profiler__disabled__not_served():
+    client = TestClient(make_app(profiles_url="/profiles"))
+
+    assert client.get("/users", headers={"X-API-VERSION": "2023-01-01"}).json() == 1
+    assert client.get("/profiles").status_code == 404
+
+
+async def test__request_profiler__concurrent_requests__profiled_separately():
+    profiler = RequestProfiler(sample_rate=1)
+    first_started = asyncio.Event()
+    second_finished = asyncio.Event()
+
+    async def first_endpoint() -> None:
+        first_started.set()
+        await second_finished.wait()
+        slow_function()
+
+    async def second_endpoint() -> None:
+        await first_started.wait()
+        other_function()
+        second_finished.set()
+
+    class FakeRoute:
+        def __init__(self, path: str, endpoint: Callable[[], Awaitable[None]]) -> None:
+            self.path = path
+            self.endpoint = endpoint
+
+        async def handle(self, scope: Scope, receive: Receive, send: Send) -> None:
+            await self.endpoint()
+
+    scope = {"type": "http", "headers": []}
+    await asyncio.gather(
+        profiler.handle(FakeRoute("/first", first_endpoint), None, scope, None, None),
+        profiler.handle(FakeRoute("/second", second_endpoint), None, scope, None, None),
+    )
+
+    snapshot = profiler.snapshot(limit=100)
+    first_functions = get_functions(snapshot, "unversioned", "/first")
+    second_functions = get_functions(snapshot, "unversioned", "/second")
+    assert any(function.endswith("(slow_function)") for function in first_functions)
+    assert not any(function.endswith("(other_function)") for function in first_functions)
+    assert any(function.endswith("(other_function)") for function in second_functions)
+    assert not any(function.endswith("(slow_function)") for function in second_functions)
+
+
+async def test__request_profiler__failed_request__still_profiled():
+    profiler = RequestProfiler(sample_rate=1)
+
+    class FailingRoute:
+        path = "/failing"
+
+        async def handle(self, scope: Scope, receive: Receive, send: Send) -> None:
+            await asyncio.sleep(0)
+            raise ZeroDivisionError
+
+    with pytest.raises(ZeroDivisionError):
+        await profiler.handle(FailingRoute(), None, {"type": "http", "headers": []}, None, None)
+    assert profiler.snapshot()["unversioned"]["/failing"]["requests"] == 1
+
+
+def test__request_profiler__invalid_sample_rate__error():
+    with pytest.raises(ValueError, match="sample_rate should be between 0 and 1"):
+        RequestProfiler(sample_rate=2)
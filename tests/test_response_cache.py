@@ -0,0 +1,206 @@
+import time
+from collections.abc import Iterator
+
+import pytest
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from starlette.testclient import TestClient
+
+from verselect import HeaderRoutingFastAPI
+from verselect.instrumentation import RoutingMetrics
+from verselect.response_cache import ResponseCache, cache_response
+from verselect.usage import VersionUsage
+
+
+class Calls:
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self) -> int:
+        self.count += 1
+        return self.count
+
+
+def make_app(response_cache: ResponseCache, calls: Calls, **kwargs: object) -> HeaderRoutingFastAPI:
+    app = HeaderRoutingFastAPI(response_cache=response_cache, **kwargs)
+    for version in ("2022-01-01", "2023-01-01"):
+        router = APIRouter()
+
+        @router.get("/countries")
+        @cache_response(ttl=60, query_params=["lang"], vary=["accept-language"])
+        async def get_countries(lang: str = "en", version: str = version):
+            return {"version": version, "lang": lang, "call": calls()}
+
+        @router.get("/users")
+        async def get_users():
+            return calls()
+
+        @router.get("/private")
+        @cache_response(ttl=60)
+        async def get_private(response: Response):
+            response.headers["Cache-Control"] = "private"
+            return calls()
+
+        @router.get("/vary-all")
+        @cache_response(ttl=60)
+        async def get_vary_all(response: Response):
+            response.headers["Vary"] = "*"
+            return calls()
+
+        @router.get("/vary-user-agent")
+        @cache_response(ttl=60)
+        async def get_vary_user_agent(response: Response):
+            response.headers["Vary"] = "User-Agent"
+            return calls()
+
+        @router.get("/stream")
+        @cache_response(ttl=60)
+        async def get_stream():
+            def chunks() -> Iterator[bytes]:
+                yield b"first,"
+                yield str(calls()).encode()
+
+            return StreamingResponse(chunks())
+
+        app.add_header_versioned_routers(router, header_value=version)
+    unversioned = APIRouter()
+
+    @unversioned.get("/countries")
+    @cache_response(ttl=60)
+    async def get_unversioned_countries():
+        return {"version": None, "call": calls()}
+
+    app.add_unversioned_routers(unversioned)
+    return app
+
+
+def test__response_cache__keyed_by_resolved_version():
+    calls = Calls()
+    response_cache = ResponseCache()
+    client = TestClient(make_app(response_cache, calls))
+
+    first = client.get("/countries", headers={"X-API-VERSION": "2022-01-01"})
+    assert first.json() == {"version": "2022-01-01", "lang": "en", "call": 1}
+    # another requested version that resolves to the same version
+    second = client.get("/countries", headers={"X-API-VERSION": "2022-06-01"})
+    assert second.json() == first.json()
+    assert second.headers["x-api-version"] == "2022-06-01"
+    assert second.headers["age"] == "0"
+    assert client.get("/countries", headers={"X-API-VERSION": "2023-01-01"}).json()["call"] == 2
+    assert client.get("/countries").json() == {"version": None, "call": 3}
+    assert client.get("/countries").json() == {"version": None, "call": 3}
+    assert client.get("/countries", headers={"X-API-VERSION": "2021-01-01"}).status_code == 404
+    # routes that are not marked as cacheable are never cached
+    assert client.get("/users", headers={"X-API-VERSION": "2022-01-01"}).json() == 4
+    assert client.get("/users", headers={"X-API-VERSION": "2022-01-01"}).json() == 5
+    assert response_cache.hits == 2
+    assert len(response_cache) == 3
+
+
+def test__response_cache__keyed_by_selected_query_params_and_vary():
+    calls = Calls()
+    client = TestClient(make_app(ResponseCache(), calls))
+    headers = {"X-API-VERSION": "2022-01-01"}
+
+    assert client.get("/countries?lang=de&page=1", headers=headers).json()["call"] == 1
+    assert client.get("/countries?page=2&lang=de", headers=headers).json()["call"] == 1
+    assert client.get("/countries?lang=fr", headers=headers).json()["call"] == 2
+    assert client.get("/countries?lang=fr", headers={**headers, "Accept-Language": "fr"}).json()["call"] == 3
+    assert client.get("/vary-user-agent", headers={**headers, "User-Agent": "a"}).json() == 4
+    assert client.get("/vary-user-agent", headers={**headers, "User-Agent": "a"}).json() == 4
+    assert client.get("/vary-user-agent", headers={**headers, "User-Agent": "b"}).json() == 5
+    assert client.get("/vary-all", headers=headers).json() == 6
+    assert client.get("/vary-all", headers=headers).json() == 7
+
+
+def test__response_cache__uncacheable_responses__not_cached():
+    calls = Calls()
+    client = TestClient(make_app(ResponseCache(max_entry_bytes=10), calls))
+    headers = {"X-API-VERSION": "2022-01-01"}
+
+    assert client.get("/private", headers=headers).json() == 1
+    assert client.get("/private", headers=headers).json() == 2
+    # larger than max_entry_bytes
+    assert client.get("/countries", headers=headers).json()["call"] == 3
+    assert client.get("/countries", headers=headers).json()["call"] == 4
+    assert client.post("/countries", headers=headers).status_code == 405
+
+
+def test__response_cache__endpoint_behind_auth__not_served_to_other_credentials():
+    def require_token(authorization: str | None = Header(None)) -> None:
+        if authorization != "Bearer valid":
+            raise HTTPException(status_code=401)
+
+    app = HeaderRoutingFastAPI(response_cache=ResponseCache())
+    router = APIRouter()
+
+    @router.get("/secret", dependencies=[Depends(require_token)])
+    @cache_response(ttl=60)
+    async def get_secret():
+        return {"secret": "data"}
+
+    app.add_header_versioned_routers(router, header_value="2022-01-01")
+    client = TestClient(app, headers={"X-API-VERSION": "2022-01-01"})
+
+    assert client.get("/secret", headers={"Authorization": "Bearer valid"}).json() == {"secret": "data"}
+    assert client.get("/secret", headers={"Authorization": "Bearer valid"}).headers["age"] == "0"
+    assert client.get("/secret").status_code == 401
+    assert client.get("/secret", headers={"Authorization": "Bearer other"}).status_code == 401
+    assert client.get("/secret", headers={"Cookie": "session=1"}).status_code == 401
+
+
+def test__response_cache__streaming_response__cached_once_complete():
+    calls = Calls()
+    client = TestClient(make_app(ResponseCache(), calls))
+
+    assert client.get("/stream", headers={"X-API-VERSION": "2022-01-01"}).text == "first,1"
+    assert client.get("/stream", headers={"X-API-VERSION": "2022-01-01"}).text == "first,1"
+
+
+def test__response_cache__expired_evicted_and_invalidated(monkeypatch: pytest.MonkeyPatch):
+    calls = Calls()
+    response_cache = ResponseCache(max_entries=2)
+    client = TestClient(make_app(response_cache, calls))
+    headers = {"X-API-VERSION": "2022-01-01"}
+
+    for lang in ("en", "de", "en", "fr"):
+        client.get(f"/countries?lang={lang}", headers=headers)
+    assert len(response_cache) == 2
+    # "de" was the least recently used
+    assert client.get("/countries?lang=de", headers=headers).json()["call"] == 4
+    assert client.get("/countries?lang=fr", headers=headers).json()["call"] == 3
+
+    response_cache.invalidate(version="2023-01-01")
+    assert len(response_cache) == 2
+    response_cache.invalidate(version="2022-01-01", path="/countries")
+    assert len(response_cache) == 0
+    assert response_cache.size == 0
+
+    client.get("/countries", headers=headers)
+    now = time.monotonic() + 61
+    monkeypatch.setattr("verselect.response_cache.time.monotonic", lambda: now)
+    assert client.get("/countries", headers=headers).json()["call"] == 6
+    response_cache.clear()
+    assert len(response_cache) == 0
+
+
+def test__response_cache__max_bytes():
+    response_cache = ResponseCache(max_bytes=300)
+    client = TestClient(make_app(response_cache, Calls()))
+
+    for lang in ("en", "de", "fr", "it"):
+        client.get(f"/countries?lang={lang}", headers={"X-API-VERSION": "2022-01-01"})
+
+    assert 0 < response_cache.size <= 300
+    assert 0 < len(response_cache) < 4
+
+
+def test__response_cache__instrumented__hit_counted_for_its_route():
+    app = make_app(ResponseCache(), Calls(), instrumentation=RoutingMetrics(), version_usage_url="/version-usage")
+    client = TestClient(app)
+
+    client.get("/countries", headers={"X-API-VERSION": "2022-01-01"})
+    client.get("/countries", headers={"X-API-VERSION": "2022-01-01"})
+
+    assert client.get("/version-usage").json()["routes"] == {"2022-01-01": {"GET /countries": 2}}
+    assert isinstance(app.router.instrumentation.instrumentations[1], VersionUsage)
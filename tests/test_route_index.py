@@ -0,0 +1,199 @@
+from datetime import date
+from typing import Any
+
+import pytest
+from fastapi import APIRouter
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import BaseRoute, Host, Match, Mount, Route, WebSocketRoute
+from starlette.testclient import TestClient
+from starlette.types import Scope
+
+from verselect.app import HeaderRoutingFastAPI
+from verselect.route_index import EMPTY_ROUTE_INDEX, RouteIndex
+
+
+def endpoint(request: Request):
+    return PlainTextResponse(request.url.path)
+
+
+ROUTES: list[BaseRoute] = [
+    Route("/", endpoint),
+    Route("/users", endpoint, methods=["GET"]),
+    Route("/users", endpoint, methods=["POST"]),
+    Route("/users/me", endpoint),
+    Route("/users/{user_id:int}", endpoint, methods=["GET"]),
+    Route("/users/{username}", endpoint, methods=["DELETE"]),
+    Route("/users/{username}/files/{file_path:path}", endpoint),
+    Route("/reports/{name}.{extension}", endpoint),
+    Route("/static{file_path:path}", endpoint),
+    Route("/trailing/", endpoint),
+    WebSocketRoute("/users/{username}", endpoint),
+    Mount("/mounted", routes=[Route("/hello", endpoint)]),
+    Host("example.org", app=endpoint),
+]
+
+PATHS = [
+    "/",
+    "/users",
+    "/users/",
+    "/users/me",
+    "/users/83",
+    "/users/tom",
+    "/users/tom/files/",
+    "/users/tom/files/a/b/c.txt",
+    "/users/tom/files",
+    "/reports/daily.csv",
+    "/reports/daily",
+    "/static",
+    "/static/css/main.css",
+    "/trailing",
+    "/trailing/",
+    "/mounted/hello",
+    "/unknown/path",
+    "//",
+]
+
+
+def first_matches(routes: list[BaseRoute], scope: Scope):
+    full = partial = None
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL and full is None:
+            full = route
+        if match == Match.PARTIAL and partial is None:
+            partial = route
+    return full, partial
+
+
+@pytest.mark.parametrize("path", PATHS)
+@pytest.mark.parametrize("scope_type", ["http", "websocket"])
+@pytest.mark.parametrize("method", ["GET", "POST", "DELETE"])
+def test__route_index__candidates__same_result_as_linear_scan(path: str, scope_type: str, method: str):
+    scope = {"type": scope_type, "path": path, "method": method, "root_path": "", "headers": []}
+    index = RouteIndex(ROUTES)
+
+    candidates = [candidate.route for candidate in index.candidates(scope)]
+
+    assert first_matches(candidates, scope) == first_matches(ROUTES, scope)
+    assert [ROUTES.index(route) for route in candidates] == sorted(ROUTES.index(route) for route in candidates)
+
+
+def test__route_index__lifespan_scope__only_fallback_routes_are_candidates():
+    index = RouteIndex(ROUTES)
+
+    assert [candidate.route for candidate in index.candidates({"type": "lifespan"})] == ROUTES[-2:]
+
+
+def test__route_index__is_stale():
+    routes = list(ROUTES)
+    index = RouteIndex(routes)
+
+    assert not index.is_stale(routes)
+    assert index.is_stale(list(routes))
+    routes.append(Route("/new", endpoint))
+    assert index.is_stale(routes)
+
+
+def test__route_index__routes_added_after_first_request__are_routed():
+    app = HeaderRoutingFastAPI()
+    client = TestClient(app)
+    app.add_unversioned_routes(Route("/first", endpoint))
+    assert client.get("/first").status_code == 200
+    assert client.get("/second").status_code == 404
+
+    app.add_unversioned_routes(Route("/second", endpoint))
+
+    assert client.get("/second").status_code == 200
+
+
+def make_versioned_app(**kwargs: Any) -> HeaderRoutingFastAPI:
+    app = HeaderRoutingFastAPI(**kwargs)
+    router = APIRouter()
+
+    @router.get("/users/")
+    async def get_users():
+        return "users"
+
+    app.add_header_versioned_routers(router, header_value="2022-01-01")
+    return app
+
+
+def count_route_matching(monkeypatch: pytest.MonkeyPatch, app: HeaderRoutingFastAPI) -> list[str]:
+    matched_paths = []
+    original_find_route = app.router.find_route
+
+    def find_route(scope: Scope, routes: RouteIndex):
+        matched_paths.append(scope["path"])
+        return original_find_route(scope, routes)
+
+    monkeypatch.setattr(app.router, "find_route", find_route)
+    return matched_paths
+
+
+def test__misses_cache__repeated_miss__not_matched_again(monkeypatch: pytest.MonkeyPatch):
+    app = make_versioned_app()
+    matched_paths = count_route_matching(monkeypatch, app)
+    client = TestClient(app, headers={"X-API-VERSION": "2022-06-01"})
+
+    for _ in range(3):
+        assert client.get("/wp-login.php").status_code == 404
+        response = client.get("/users", follow_redirects=False)
+        assert response.status_code == 307
+        assert response.headers["location"] == "http://testserver/users/"
+    response = client.get("https://example.org/users", follow_redirects=False)
+    assert response.headers["location"] == "https://example.org/users/"
+
+    assert matched_paths == ["/wp-login.php", "/users"]
+
+
+def test__misses_cache__routes_changed__misses_forgotten():
+    app = make_versioned_app()
+    client = TestClient(app, headers={"X-API-VERSION": "2022-06-01"})
+    assert client.get("/users/me").status_code == 404
+
+    app.add_header_versioned_routers(APIRouter(routes=[Route("/users/me", endpoint)]), header_value="2022-01-01")
+
+    assert client.get("/users/me").status_code == 200
+
+
+def test__misses_cache__redirect_slashes_disabled__not_redirected():
+    app = make_versioned_app()
+    client = TestClient(app, headers={"X-API-VERSION": "2022-06-01"})
+    assert client.get("/users", follow_redirects=False).status_code == 307
+
+    app.router.redirect_slashes = False
+
+    assert client.get("/users", follow_redirects=False).status_code == 404
+
+
+def test__misses_cache__is_bounded():
+    app = make_versioned_app(misses_cache_size=2)
+    client = TestClient(app, headers={"X-API-VERSION": "2022-06-01"})
+    for path in ("/a", "/b", "/c"):
+        assert client.get(path).status_code == 404
+
+    index = app.router.routing_table.get_route_index(date(2022, 1, 1))
+    assert [key[3] for key in index._misses] == ["/b", "/c"]
+
+
+def test__misses_cache__requests_older_than_all_versions__misses_not_shared():
+    app = make_versioned_app()
+    client = TestClient(app, headers={"X-API-VERSION": "2000-01-01"})
+    for path in ("/a", "/b"):
+        assert client.get(path).status_code == 404
+
+    assert not EMPTY_ROUTE_INDEX.caches_misses
+    assert EMPTY_ROUTE_INDEX._misses == {}
+
+
+@pytest.mark.parametrize("misses_cache_size", [0, 1024])
+def test__misses_cache__routes_matching_by_more_than_path__disabled(misses_cache_size: int):
+    scope = {"type": "http", "path": "/missing", "method": "GET", "root_path": "", "headers": []}
+    index = RouteIndex(ROUTES, misses_cache_size=misses_cache_size)
+
+    index.cache_miss(scope, redirect_slashes=True, redirects=False)
+
+    assert not index.caches_misses
+    assert index.get_cached_miss(scope, redirect_slashes=True) is None
+    assert RouteIndex(ROUTES[:-1]).caches_misses
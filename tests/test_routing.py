@@ -1,10 +1,13 @@
+from datetime import date
+
 import pytest
+from fastapi import APIRouter
 from starlette.requests import Request
-from starlette.responses import PlainTextResponse
+from starlette.responses import PlainTextResponse, Response
 from starlette.routing import Match, NoMatchFound, Route
 from starlette.testclient import TestClient
 
-from tests._resources.app_for_testing_routing import mixed_hosts_app
+from tests._resources.app_for_testing_routing import mixed_hosts_app, router
 from verselect.app import HeaderRoutingFastAPI
 
 
@@ -132,3 +135,50 @@ def test__fewfewfew():
 
     response = client.get("/v1/doggies/tom")
     assert response.status_code == 200
+
+
+def test__resolved_versions_cache__repeated_header__resolved_once(monkeypatch: pytest.MonkeyPatch):
+    app = HeaderRoutingFastAPI()
+    app.add_header_versioned_routers(router, header_value="2022-01-10")
+    client = TestClient(app, headers={"X-API-VERSION": "2022-02-11"})
+    resolved_versions = []
+    original_resolve_version = app.router.routing_table.resolve_version
+
+    def resolve_version(request_header_value: date):
+        resolved_versions.append(request_header_value)
+        return original_resolve_version(request_header_value)
+
+    monkeypatch.setattr(app.router.routing_table, "resolve_version", resolve_version)
+
+    assert client.get("/v1/users").status_code == 200
+    assert client.get("/v1/users").status_code == 200
+    assert client.get("/v1/users", headers={"X-API-VERSION": "1999-01-01"}).status_code == 404
+    assert client.get("/v1/users", headers={"X-API-VERSION": "1999-01-01"}).status_code == 404
+
+    assert resolved_versions == [date(2022, 2, 11), date(1999, 1, 1)]
+
+
+def test__resolved_versions_cache__is_bounded():
+    app = HeaderRoutingFastAPI(resolved_versions_cache_size=2)
+    app.add_header_versioned_routers(router, header_value="2022-01-10")
+    client = TestClient(app)
+
+    for version in ["2022-01-11", "2022-01-12", "2022-01-13"]:
+        assert client.get("/v1/users", headers={"X-API-VERSION": version}).status_code == 200
+
+    assert list(app.router.routing_table._resolved_versions) == [b"2022-01-12", b"2022-01-13"]
+
+
+def test__resolved_versions_cache__version_added_after_first_request__is_picked():
+    app = HeaderRoutingFastAPI()
+    app.add_header_versioned_routers(router, header_value="2022-01-10")
+    client = TestClient(app, headers={"X-API-VERSION": "2022-03-01"})
+    assert client.get("/v1/users").status_code == 200
+    assert client.get("/v1/").status_code == 200
+
+    later_router = APIRouter(prefix="/v1")
+    later_router.get("/users")(lambda: Response("Later users", media_type="text/plain"))
+    app.add_header_versioned_routers(later_router, header_value="2022-02-01")
+
+    assert client.get("/v1/users").text == "Later users"
+    assert client.get("/v1/").status_code == 404
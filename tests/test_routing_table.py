@@ -0,0 +1,147 @@
+import asyncio
+from datetime import date
+
+from fastapi import APIRouter
+from httpx import ASGITransport, AsyncClient
+from starlette.testclient import TestClient
+
+from verselect import HeaderRoutingFastAPI
+from verselect.routing_table import RoutingTable
+
+
+def make_router(path: str, body: str) -> APIRouter:
+    router = APIRouter()
+
+    @router.get(path)
+    async def endpoint():
+        return body
+
+    return router
+
+
+def test__routing_table__is_replaced_not_mutated():
+    app = HeaderRoutingFastAPI()
+    app.add_header_versioned_routers(make_router("/users", "2022"), header_value="2022-01-01")
+    table = app.router.routing_table
+    versioned_routes = app.router.versioned_routes
+
+    app.add_header_versioned_routers(make_router("/users", "2023"), header_value="2023-01-01")
+
+    assert app.router.routing_table is not table
+    assert list(versioned_routes) == [date(2022, 1, 1)]
+    assert table.sorted_versions == (date(2022, 1, 1),)
+    assert app.router.sorted_versions == (date(2022, 1, 1), date(2023, 1, 1))
+    # the unchanged version keeps its routes and its compiled index
+    new_table = app.router.routing_table
+    assert new_table.get_version_routes(date(2022, 1, 1)) is table.get_version_routes(date(2022, 1, 1))
+    assert new_table.get_route_index(date(2022, 1, 1)) is table.get_route_index(date(2022, 1, 1))
+    assert new_table.unversioned_index is table.unversioned_index
+
+
+def test__routing_table__versions_with_same_routes__share_index():
+    app = HeaderRoutingFastAPI()
+    router = make_router("/users", "users")
+    for version in ("2022-01-01", "2023-01-01", "2024-01-01"):
+        app.add_header_versioned_routers(router, header_value=version)
+    table = app.router.routing_table
+    indexes = {id(table.get_route_index(version)) for version in table.sorted_versions}
+    assert len(indexes) == 1
+
+
+def test__sorted_versioned_routes__built_once_per_table():
+    app = HeaderRoutingFastAPI()
+    app.add_header_versioned_routers(make_router("/users", "2023"), header_value="2023-01-01")
+    app.add_header_versioned_routers(make_router("/users", "2022"), header_value="2022-01-01")
+    sorted_versioned_routes = app.router.sorted_versioned_routes
+
+    assert list(sorted_versioned_routes) == [date(2022, 1, 1), date(2023, 1, 1)]
+    assert app.router.sorted_versioned_routes is sorted_versioned_routes
+
+    app.add_header_versioned_routers(make_router("/users", "2024"), header_value="2024-01-01")
+
+    assert list(app.router.sorted_versioned_routes) == [date(2022, 1, 1), date(2023, 1, 1), date(2024, 1, 1)]
+
+
+def test__routing_table__empty():
+    table = RoutingTable()
+    version, routes = table.resolve_header_value(b"2022-01-01")
+    assert version is None
+    assert len(routes) == 0
+    assert table.min_routes_version is None
+
+
+def test__remove_version():
+    app = HeaderRoutingFastAPI()
+    app.add_header_versioned_routers(make_router("/users", "2022"), header_value="2022-01-01")
+    router_2023 = make_router("/users", "2023")
+    app.add_header_versioned_routers(router_2023, header_value="2023-01-01")
+    client = TestClient(app, headers={"X-API-VERSION": "2023-06-01"})
+    unversioned_client = TestClient(app)
+    assert client.get("/users").json() == "2023"
+    assert unversioned_client.get("/openapi.json?version=2023-01-01").status_code == 200
+
+    removed_routes = app.remove_version("2023-01-01")
+
+    assert [route.path for route in removed_routes] == ["/users"]
+    assert client.get("/users").json() == "2022"
+    assert unversioned_client.get("/openapi.json?version=2023-01-01").status_code == 404
+    assert list(app.swaggers) == ["2022-01-01"]
+    assert not any(route is removed_routes[0] for route in app.routes)
+    assert app.get_route_sharing_report().registered_routes == 1
+
+
+def test__remove_version__shared_router__stays_in_other_versions():
+    app = HeaderRoutingFastAPI()
+    router = make_router("/users", "users")
+    app.add_header_versioned_routers(router, header_value="2022-01-01")
+    app.add_header_versioned_routers(router, header_value="2023-01-01")
+
+    app.remove_version("2023-01-01")
+
+    client = TestClient(app, headers={"X-API-VERSION": "2023-06-01"})
+    assert client.get("/users").json() == "users"
+    assert app.get_route_sharing_report().registered_routes == 1
+
+
+def test__remove_version__router_included_twice__routes_dropped_with_last_version():
+    app = HeaderRoutingFastAPI()
+    router = make_router("/users", "users")
+    app.add_header_versioned_routers(router, header_value="2022-01-01")
+    app.add_header_versioned_routers(router, router, header_value="2023-01-01")
+
+    removed_routes = app.remove_version("2023-01-01")
+
+    client = TestClient(app, headers={"X-API-VERSION": "2023-06-01"})
+    assert client.get("/users").json() == "users"
+    assert app.get_route_sharing_report().registered_routes == 1
+
+    app.remove_version("2022-01-01")
+
+    assert not any(route is removed_routes[0] for route in app.routes)
+    assert app.get_route_sharing_report().registered_routes == 0
+
+
+async def test__versions_changed_during_request__request_uses_its_table():
+    app = HeaderRoutingFastAPI()
+    request_started = asyncio.Event()
+    versions_changed = asyncio.Event()
+    router = APIRouter()
+
+    @router.get("/slow")
+    async def slow():
+        request_started.set()
+        await versions_changed.wait()
+        return "slow"
+
+    app.add_header_versioned_routers(router, header_value="2022-01-01")
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+        request = asyncio.create_task(client.get("/slow", headers={"X-API-VERSION": "2022-01-01"}))
+        await request_started.wait()
+        app.add_header_versioned_routers(make_router("/fast", "fast"), header_value="2023-01-01")
+        app.remove_version("2022-01-01")
+        versions_changed.set()
+
+        response = await request
+        assert response.json() == "slow"
+        assert response.headers["x-api-version"] == "2022-01-01"
+        assert (await client.get("/slow", headers={"X-API-VERSION": "2023-01-01"})).status_code == 404
@@ -0,0 +1,212 @@
+import os
+from datetime import date
+from pathlib import Path
+
+import pytest
+from fastapi import APIRouter
+from starlette.testclient import TestClient
+from starlette.types import Receive, Scope, Send
+
+from tests._resources.sharded_app import create_app, make_version_router
+from verselect import HeaderRoutingFastAPI
+from verselect.pinning import VersionPinning
+from verselect.sharding import VersionShard, VersionShardingDispatcher, WorkerProcessPool, run_lifespan
+
+LEGACY_VERSIONS = ("2021-01-01", "2022-01-01")
+LATEST_VERSIONS = ("2023-01-01", "2024-01-01")
+
+
+def make_dispatcher() -> VersionShardingDispatcher:
+    return VersionShardingDispatcher(
+        VersionShard.from_versions(LATEST_VERSIONS, create_app(LATEST_VERSIONS)),
+        [VersionShard.from_versions(LEGACY_VERSIONS, create_app(LEGACY_VERSIONS))],
+    )
+
+
+@pytest.mark.parametrize(
+    ("requested_version", "served_version"),
+    [
+        ("2021-01-01", "2021-01-01"),
+        ("2022-06-01", "2022-01-01"),
+        ("2023-01-01", "2023-01-01"),
+        ("2030-01-01", "2024-01-01"),
+    ],
+)
+def test__dispatcher__routes_to_shard_of_closest_older_version(requested_version: str, served_version: str):
+    client = TestClient(make_dispatcher(), headers={"X-API-VERSION": requested_version})
+    response = client.get("/whoami")
+    assert response.status_code == 200
+    assert response.json()["version"] == served_version
+    assert response.headers["x-api-version"] == requested_version
+
+
+def test__dispatcher__every_shard_only_has_its_versions():
+    dispatcher = make_dispatcher()
+    client = TestClient(dispatcher)
+    assert list(dispatcher.default.app.swaggers) == list(LATEST_VERSIONS)
+    assert list(dispatcher.shards[0].app.swaggers) == list(LEGACY_VERSIONS)
+    for version in (*LEGACY_VERSIONS, *LATEST_VERSIONS):
+        assert client.get(f"/openapi.json?version={version}").status_code == 200
+    assert client.get("/openapi.json?version=2022-06-01").status_code == 404
+
+
+def test__dispatcher__requests_not_belonging_to_shards__go_to_default():
+    client = TestClient(make_dispatcher())
+    assert client.get("/whoami", headers={"X-API-VERSION": "2020-01-01"}).status_code == 404
+    assert client.get("/whoami", headers={"X-API-VERSION": "2022-13-45"}).status_code == 422
+    assert client.get("/whoami").status_code == 404
+
+
+def test__dispatcher__docs__only_list_versions_of_default_shard():
+    client = TestClient(make_dispatcher())
+
+    response = client.get("/docs")
+
+    assert response.status_code == 200
+    assert all(version in response.text for version in LATEST_VERSIONS)
+    assert not any(version in response.text for version in LEGACY_VERSIONS)
+
+
+def test__dispatcher__pinned_client__served_by_default_shard():
+    class LegacyVersionPinning(VersionPinning):
+        async def load_pinned_version(self, client_id: str) -> date | None:
+            return date(2022, 1, 1)
+
+    latest_app = HeaderRoutingFastAPI(version_pinning=LegacyVersionPinning())
+    latest_app.add_header_versioned_routers(make_version_router("2023-01-01"), header_value="2023-01-01")
+    dispatcher = VersionShardingDispatcher(
+        VersionShard.from_versions(["2023-01-01"], latest_app),
+        [VersionShard.from_versions(LEGACY_VERSIONS, create_app(LEGACY_VERSIONS))],
+    )
+    client = TestClient(dispatcher)
+
+    # a single app with every version would serve 2022-01-01
+    assert client.get("/whoami", headers={"X-API-Key": "integrator"}).status_code == 404
+    assert client.get("/whoami", headers={"X-API-VERSION": "2022-01-01"}).json()["version"] == "2022-01-01"
+
+
+def test__dispatcher__version_header_in_other_format__served_by_default_shard():
+    client = TestClient(make_dispatcher())
+
+    # a single app with every version would serve 2022-01-01
+    response = client.get("/whoami", headers={"X-API-VERSION": "2022-01-01T00:00:00"})
+
+    assert response.status_code == 404
+    assert response.headers["x-api-version"] == "2022-01-01"
+
+
+def test__dispatcher__version_in_several_shards__error():
+    app = create_app(LEGACY_VERSIONS)
+    with pytest.raises(ValueError, match="Version 2022-01-01 belongs to more than one shard"):
+        VersionShardingDispatcher(
+            VersionShard.from_versions(LEGACY_VERSIONS, app),
+            [VersionShard.from_versions(["2022-01-01"], app)],
+        )
+
+
+def test__dispatcher__shard_without_versions__error():
+    with pytest.raises(ValueError, match="A shard should have at least one version"):
+        VersionShard.from_versions([], create_app(()))
+
+
+def test__dispatcher__resolved_apps_cache__is_bounded():
+    dispatcher = make_dispatcher()
+    dispatcher.resolved_versions_cache_size = 2
+    for version in (b"2021-06-01", b"2022-06-01", b"2023-06-01"):
+        dispatcher.resolve_app(version)
+    assert list(dispatcher._resolved_apps) == [b"2022-06-01", b"2023-06-01"]
+
+
+def test__dispatcher__runs_lifespans_of_all_apps():
+    events = []
+
+    def make_app(name: str) -> HeaderRoutingFastAPI:
+        app = HeaderRoutingFastAPI()
+        app.router.on_startup.append(lambda: events.append(f"{name} startup"))
+        app.router.on_shutdown.append(lambda: events.append(f"{name} shutdown"))
+        app.add_header_versioned_routers(APIRouter(), header_value="2022-01-01")
+        return app
+
+    async def app_without_lifespan(scope: Scope, receive: Receive, send: Send):
+        raise RuntimeError("lifespan is not supported")
+
+    legacy_app = make_app("legacy")
+    dispatcher = VersionShardingDispatcher(
+        VersionShard.from_versions(["2022-01-01"], make_app("latest")),
+        [
+            VersionShard.from_versions(["2021-01-01"], legacy_app),
+            VersionShard.from_versions(["2021-06-01"], legacy_app),
+            VersionShard.from_versions(["2023-01-01"], app_without_lifespan),
+        ],
+    )
+    with TestClient(dispatcher):
+        assert events == ["latest startup", "legacy startup"]
+    assert events == ["latest startup", "legacy startup", "legacy shutdown", "latest shutdown"]
+
+
+async def test__run_lifespan__startup_failed__error():
+    async def app(scope: Scope, receive: Receive, send: Send):
+        await receive()
+        await send({"type": "lifespan.startup.failed", "message": "no database"})
+
+    with pytest.raises(RuntimeError, match="no database"):
+        async with run_lifespan(app):
+            pass  # pragma: no cover
+
+
+def test__dispatcher__startup_failed__lifespan_fails():
+    app = HeaderRoutingFastAPI()
+
+    def fail():
+        raise ValueError("no database")
+
+    app.router.on_startup.append(fail)
+    dispatcher = VersionShardingDispatcher(
+        VersionShard.from_versions(LATEST_VERSIONS, create_app(LATEST_VERSIONS)),
+        [VersionShard.from_versions(LEGACY_VERSIONS, app)],
+    )
+    with pytest.raises(ValueError, match="no database"), TestClient(dispatcher):
+        pass  # pragma: no cover
+
+
+def test__worker_process_pool__serves_shard_from_worker_processes(tmp_path: Path):
+    pool = WorkerProcessPool(create_app, LEGACY_VERSIONS, workers=2, socket_dir=tmp_path)
+    dispatcher = VersionShardingDispatcher(
+        VersionShard.from_versions(LATEST_VERSIONS, create_app(LATEST_VERSIONS)),
+        [pool.as_shard()],
+    )
+    with TestClient(dispatcher) as client:
+        assert len(pool.processes) == 2
+        legacy_responses = [client.get("/whoami", headers={"X-API-VERSION": "2022-06-01"}) for _ in range(4)]
+        assert {response.json()["version"] for response in legacy_responses} == {"2022-01-01"}
+        assert {response.headers["x-api-version"] for response in legacy_responses} == {"2022-06-01"}
+        # the requests are spread among the workers which are not the process of the dispatcher
+        worker_pids = {response.json()["pid"] for response in legacy_responses}
+        assert worker_pids == {process.pid for process in pool.processes}
+        assert os.getpid() not in worker_pids
+
+        latest_response = client.get("/whoami", headers={"X-API-VERSION": "2024-01-01"})
+        assert latest_response.json() == {"version": "2024-01-01", "pid": os.getpid()}
+
+        echo_response = client.post("/echo?x=1", headers={"X-API-VERSION": "2021-01-01"}, content=b"hello")
+        assert echo_response.json() == {"version": "2021-01-01", "body": "hello"}
+        assert client.get("/openapi.json?version=2021-01-01").json()["paths"].keys() == {"/whoami", "/echo"}
+        processes = pool.processes
+    assert pool.processes == []
+    assert not any(process.is_alive() for process in processes)
+
+
+def test__worker_process_pool__temporary_socket_dir__removed_on_stop():
+    pool = WorkerProcessPool(create_app, LEGACY_VERSIONS)
+    with TestClient(VersionShardingDispatcher(pool.as_shard())) as client:
+        assert client.get("/whoami", headers={"X-API-VERSION": "2021-01-01"}).status_code == 200
+        socket_dir = pool._created_socket_dir
+        assert socket_dir is not None
+        assert socket_dir.exists()
+    assert not socket_dir.exists()
+    assert pool._created_socket_dir is None
+
+
+def test__worker_process_pool__invalid_workers__error():
+    with pytest.raises(ValueError, match="workers should be at least 1"):
+        WorkerProcessPool(create_app, LEGACY_VERSIONS, workers=0)
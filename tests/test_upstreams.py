@@ -0,0 +1,157 @@
+from contextvars import ContextVar
+from datetime import date
+
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.testclient import TestClient
+
+from verselect import HeaderRoutingFastAPI
+from verselect.upstreams import UpstreamClients
+
+upstream = FastAPI()
+
+
+@upstream.get("/echo")
+async def echo(request: Request):
+    return {"version": request.headers.get("x-api-version")}
+
+
+@upstream.get("/fail")
+async def fail():
+    raise RuntimeError("upstream failed")
+
+
+def make_app(clients: UpstreamClients) -> HeaderRoutingFastAPI:
+    app = HeaderRoutingFastAPI(upstream_clients=clients)
+    router = APIRouter()
+
+    @router.get("/proxy")
+    async def proxy(version: str | None = None):
+        headers = {} if version is None else {"x-api-version": version}
+        response = await clients.get("http://upstream").get("/echo", headers=headers)
+        return response.json()
+
+    app.add_header_versioned_routers(router, header_value="2022-01-01")
+
+    unversioned_router = APIRouter()
+
+    @unversioned_router.get("/unversioned-proxy")
+    async def unversioned_proxy():
+        return (await clients.get("http://upstream").get("/echo")).json()
+
+    app.add_unversioned_routers(unversioned_router)
+    return app
+
+
+def make_clients() -> UpstreamClients:
+    return UpstreamClients(transports={"http://upstream": httpx.ASGITransport(app=upstream)})
+
+
+def test__upstream_clients__versioned_request__forwards_the_version():
+    clients = make_clients()
+    with TestClient(make_app(clients)) as client:
+        resp = client.get("/proxy", headers={"x-api-version": "2023-05-05"})
+
+    assert resp.status_code == 200
+    assert resp.json() == {"version": "2023-05-05"}
+
+
+def test__upstream_clients__explicit_version_header__not_overridden():
+    clients = make_clients()
+    with TestClient(make_app(clients)) as client:
+        resp = client.get("/proxy?version=2021-01-01", headers={"x-api-version": "2022-01-01"})
+
+    assert resp.json() == {"version": "2021-01-01"}
+
+
+def test__upstream_clients__unversioned_request__no_version_forwarded():
+    clients = make_clients()
+    with TestClient(make_app(clients)) as client:
+        resp = client.get("/unversioned-proxy")
+
+    assert resp.json() == {"version": None}
+
+
+def test__upstream_clients__shutdown__clients_closed():
+    clients = make_clients()
+    with TestClient(make_app(clients)) as client:
+        client.get("/proxy", headers={"x-api-version": "2022-01-01"})
+        first_client = clients.get("http://upstream")
+        assert clients.get("http://upstream") is first_client
+        assert not first_client.is_closed
+
+    assert first_client.is_closed
+    assert clients.get("http://upstream") is not first_client
+
+
+def test__upstream_clients__custom_app_version_header__used_for_forwarding():
+    clients = UpstreamClients(transports={"http://upstream": httpx.ASGITransport(app=upstream)})
+    app = HeaderRoutingFastAPI(api_version_header_name="X-Other-Version", upstream_clients=clients)
+
+    assert clients.api_version_var is app.api_version_var
+    assert clients.api_version_header_name == "x-other-version"
+
+
+async def test__upstream_clients__requests__latency_recorded_per_upstream():
+    version_var: ContextVar[date | None] = ContextVar("version_var", default=None)
+    clients = UpstreamClients(
+        api_version_var=version_var,
+        transports={
+            "http://upstream": httpx.ASGITransport(app=upstream),
+            "http://failing": httpx.ASGITransport(app=upstream, raise_app_exceptions=False),
+        },
+    )
+    version_var.set(date(2022, 1, 1))
+
+    async with clients:
+        assert (await clients.get("http://upstream").get("/echo")).json() == {"version": "2022-01-01"}
+        await clients.get("http://upstream").get("/echo")
+        await clients.get("http://failing").get("/fail")
+
+    snapshot = clients.snapshot()
+    assert snapshot["http://upstream"]["requests"] == 2
+    assert snapshot["http://upstream"]["responses_by_status"] == {"200": 2}
+    assert snapshot["http://upstream"]["seconds"]["count"] == 2
+    assert snapshot["http://failing"]["responses_by_status"] == {"500": 1}
+    assert snapshot["http://failing"]["errors"] == 0
+
+
+async def test__upstream_clients__transport_error__counted():
+    def refuse(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("refused", request=request)
+
+    clients = UpstreamClients(transports={"http://down": httpx.MockTransport(refuse)})
+
+    async with clients:
+        with pytest.raises(httpx.ConnectError):
+            await clients.get("http://down").get("/")
+
+    assert clients.snapshot()["http://down"]["errors"] == 1
+    assert clients.snapshot()["http://down"]["seconds"]["count"] == 1
+
+
+def test__upstream_clients__default_transport__limited_per_host():
+    clients = UpstreamClients(max_connections_per_host=3, max_keepalive_connections_per_host=2)
+
+    transport = clients.get("http://upstream")._transport
+
+    pool = transport.transport._pool  # type: ignore[attr-defined]
+    assert pool._max_connections == 3
+    assert pool._max_keepalive_connections == 2
+
+
+async def test__upstream_clients__base_urls_of_same_host__share_connection_pool():
+    clients = UpstreamClients(transports={"http://upstream:80": httpx.ASGITransport(app=upstream)})
+
+    async with clients:
+        await clients.get("http://upstream").get("/echo")
+        await clients.get("http://upstream/v1").get("/echo")
+        base_urls = ("http://upstream", "http://upstream/v1", "http://upstream:8080")
+        transports = [clients.get(base_url)._transport.transport for base_url in base_urls]  # type: ignore[attr-defined]
+
+    assert clients.get("http://upstream") is not clients.get("http://upstream/v1")
+    assert transports[0] is transports[1]
+    assert transports[2] is not transports[0]
+    assert list(clients.snapshot()) == ["http://upstream", "http://upstream:8080"]
+    assert clients.snapshot()["http://upstream"]["requests"] == 2
@@ -0,0 +1,134 @@
+from datetime import date
+
+import pytest
+from fastapi import APIRouter
+from starlette.testclient import TestClient
+
+from verselect import HeaderRoutingFastAPI
+from verselect.version_ranges import VersionRange, VersionRangeIndex
+
+
+def make_router(path: str, body: str) -> APIRouter:
+    router = APIRouter()
+
+    @router.get(path)
+    async def endpoint():
+        return body
+
+    return router
+
+
+def test__version_range_index__active_at():
+    forever = VersionRange(date(2022, 1, 1), None, [])
+    first_half = VersionRange(date(2022, 1, 1), date(2022, 7, 1), [])
+    later = VersionRange(date(2022, 3, 1), date(2023, 1, 1), [])
+    index = VersionRangeIndex([forever, first_half, later])
+
+    assert index.boundaries == [date(2022, 1, 1), date(2022, 3, 1), date(2022, 7, 1), date(2023, 1, 1)]
+    assert index.active_at(date(2021, 12, 31)) == ()
+    assert index.active_at(date(2022, 1, 1)) == (forever, first_half)
+    assert index.active_at(date(2022, 5, 1)) == (forever, first_half, later)
+    assert index.active_at(date(2022, 7, 1)) == (forever, later)
+    assert index.active_at(date(2030, 1, 1)) == (forever,)
+    for version in (date(2021, 6, 1), date(2022, 2, 1), date(2022, 6, 30), date(2022, 12, 31), date(2024, 1, 1)):
+        assert index.active_at(version) == tuple(r for r in index.ranges if r.contains(version))
+
+
+def test__version_ranged_routers__routing():
+    app = HeaderRoutingFastAPI()
+    app.add_version_ranged_routers(make_router("/users", "users"), since="2022-01-01")
+    app.add_version_ranged_routers(make_router("/legacy", "legacy"), since="2022-01-01", until="2022-06-01")
+    app.add_version_ranged_routers(make_router("/orders", "orders"), since="2022-03-01")
+    client = TestClient(app)
+
+    def get(path: str, version: str) -> int:
+        return client.get(path, headers={"X-API-VERSION": version}).status_code
+
+    assert get("/users", "2021-12-31") == 404
+    assert get("/users", "2022-01-01") == 200
+    assert get("/legacy", "2022-05-31") == 200
+    assert get("/legacy", "2022-06-01") == 404
+    assert get("/orders", "2022-02-28") == 404
+    assert get("/orders", "2022-03-01") == 200
+    assert get("/users", "2030-01-01") == 200
+    assert client.get("/users", headers={"X-API-VERSION": "2022-04-01"}).headers["x-api-version"] == "2022-04-01"
+
+
+def test__version_ranged_routers__same_as_materialized_versions():
+    users, legacy, orders = make_router("/users", "u"), make_router("/legacy", "l"), make_router("/orders", "o")
+    ranged = HeaderRoutingFastAPI()
+    ranged.add_version_ranged_routers(users, since="2022-01-01")
+    ranged.add_version_ranged_routers(legacy, since="2022-01-01", until="2022-06-01")
+    ranged.add_version_ranged_routers(orders, since="2022-03-01")
+
+    materialized = HeaderRoutingFastAPI()
+    materialized.add_header_versioned_routers(users, legacy, header_value="2022-01-01")
+    materialized.add_header_versioned_routers(users, legacy, orders, header_value="2022-03-01")
+    materialized.add_header_versioned_routers(users, orders, header_value="2022-06-01")
+
+    assert ranged.router.sorted_versions == materialized.router.sorted_versions
+    assert list(ranged.swaggers) == list(materialized.swaggers)
+    for version in ranged.swaggers:
+        assert ranged.swaggers[version] == materialized.swaggers[version]
+    for version in ("2021-01-01", "2022-01-01", "2022-02-01", "2022-03-01", "2022-07-01"):
+        for path in ("/users", "/legacy", "/orders"):
+            headers = {"X-API-VERSION": version}
+            assert (
+                TestClient(ranged).get(path, headers=headers).status_code
+                == TestClient(materialized).get(path, headers=headers).status_code
+            )
+    # the ranged routers were included once and the materialized ones once per version
+    assert ranged.get_route_sharing_report().registered_routes == 3
+    assert materialized.get_route_sharing_report().registered_routes == 7
+
+
+def test__version_ranged_routers__mixed_with_versioned_routers():
+    app = HeaderRoutingFastAPI()
+    app.add_header_versioned_routers(make_router("/items", "old items"), header_value="2022-01-01")
+    app.add_version_ranged_routers(make_router("/users", "users"), since="2022-03-01")
+    app.add_header_versioned_routers(make_router("/items", "new items"), header_value="2022-06-01")
+    client = TestClient(app)
+
+    def get(path: str, version: str):
+        return client.get(path, headers={"X-API-VERSION": version})
+
+    # the explicit routes of the closest version waterfall into the range boundary
+    assert get("/items", "2022-04-01").json() == "old items"
+    assert get("/users", "2022-04-01").json() == "users"
+    assert get("/users", "2022-02-01").status_code == 404
+    assert get("/items", "2022-07-01").json() == "new items"
+    assert get("/users", "2022-07-01").json() == "users"
+    assert list(app.swaggers) == ["2022-01-01", "2022-03-01", "2022-06-01"]
+    assert set(app.swaggers["2022-03-01"]["paths"]) == {"/items", "/users"}
+
+
+def test__version_ranged_routers__compiled_once_per_segment():
+    app = HeaderRoutingFastAPI()
+    app.add_version_ranged_routers(make_router("/users", "ranged users"), since="2022-01-01")
+    for version in ("2022-02-01", "2022-03-01", "2022-04-01"):
+        app.add_header_versioned_routers(make_router(f"/items/{version}", version), header_value=version)
+    app.add_header_versioned_routers(make_router("/users", "own users"), header_value="2022-05-01")
+    table = app.router.routing_table
+
+    ranged_indexes = {id(index.indexes[1]) for index in map(table.get_route_index, table.sorted_versions[1:])}
+    assert len(ranged_indexes) == 1
+    # the explicit routes go before the ranged ones
+    client = TestClient(app)
+    assert client.get("/users", headers={"X-API-VERSION": "2022-04-01"}).json() == "ranged users"
+    assert client.get("/users", headers={"X-API-VERSION": "2022-05-01"}).json() == "own users"
+    assert [route.path for route in table.get_version_routes(date(2022, 5, 1))] == ["/users", "/users"]
+
+    app.add_header_versioned_routers(make_router("/orders", "orders"), header_value="2022-06-01")
+
+    # the unchanged versions and ranges keep their compiled routes
+    new_table = app.router.routing_table
+    for version in table.sorted_versions:
+        assert new_table.get_route_index(version) is table.get_route_index(version)
+
+
+def test__version_ranged_routers__invalid_range():
+    app = HeaderRoutingFastAPI()
+    with pytest.raises(ValueError, match="since should be in ISO 8601 format"):
+        app.add_version_ranged_routers(make_router("/users", "users"), since="yesterday")
+    with pytest.raises(ValueError, match="until should be later than since"):
+        app.add_version_ranged_routers(make_router("/users", "users"), since="2022-01-01", until="2022-01-01")
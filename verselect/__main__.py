@@ -0,0 +1,32 @@
+"""
+Export the docs of a HeaderRoutingFastAPI app as static files:
+
+    python -m verselect export myproject.main:app ./docs                 # generate the versions on every CPU
+    python -m verselect export myproject.main:app ./docs --processes 1   # generate the versions in this process
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from .export import export_docs, load_app
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m verselect", description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="write the docs of every version to a directory")
+    export_parser.add_argument("app", help='the app to export as "module:attribute"')
+    export_parser.add_argument("directory", type=Path, help="the directory to write the files to")
+    export_parser.add_argument("--processes", type=int, help="number of processes that generate the openapis")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, "")
+    app = load_app(args.app)
+    versions = export_docs(app, args.directory, import_string=args.app, processes=args.processes)
+    print(f"Exported {len(versions)} versions to {args.directory}")  # noqa: T201
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
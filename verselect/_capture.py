@@ -0,0 +1,44 @@
+from collections.abc import Callable
+from typing import Any, TypeVar
+
+from starlette.types import Message, Send
+
+_ContextT = TypeVar("_ContextT")
+
+
+def capture_response(
+    send: Send,
+    *,
+    max_body_bytes: int,
+    on_start: Callable[[Message], _ContextT | None],
+    on_complete: Callable[[_ContextT, int, list[tuple[bytes, bytes]], bytes], None],
+) -> Send:
+    """
+    Wrap send so that the response it sends is collected while it's being sent.
+
+    on_start gets the `http.response.start` message and returns None to skip the response or a context that is
+    passed to on_complete along with the status, headers and body once the whole response was sent. Responses
+    whose body is larger than max_body_bytes are skipped.
+    """
+    state: dict[str, Any] = {}
+
+    async def send_and_capture(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            context = on_start(message)
+            if context is not None:
+                # copied before the outer layers add their own headers to the message
+                headers = list(message.get("headers", ()))
+                state.update(context=context, status=message["status"], headers=headers, body=[], size=0)
+        elif message["type"] == "http.response.body" and state:
+            body = message.get("body", b"")
+            state["size"] += len(body)
+            if state["size"] > max_body_bytes:
+                state.clear()
+            else:
+                state["body"].append(body)
+                if not message.get("more_body", False):
+                    on_complete(state["context"], state["status"], state["headers"], b"".join(state["body"]))
+                    state.clear()
+        await send(message)
+
+    return send_and_capture
@@ -0,0 +1,117 @@
+import re
+import sys
+from collections.abc import Hashable, Mapping
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Any, NamedTuple, TypeVar
+
+_OwnerT = TypeVar("_OwnerT", bound=Hashable)
+
+# Objects of these types are shared by the whole process (or by the user's code) so they never count towards
+# the memory retained by a route or an openapi document
+_SHARED_TYPES = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+
+
+def approximate_size(obj: Any, seen: set[int] | None = None) -> int:
+    """
+    Approximate the number of bytes retained by obj and everything it references.
+
+    Objects that were already counted (their ids are in seen) are skipped, so passing the same seen set
+    to several calls counts the objects shared between them only once.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _SHARED_TYPES):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, list | tuple | set | frozenset):
+            stack.extend(current)
+        elif not isinstance(current, str | bytes | int | float | bool | None):
+            stack.extend(_referenced_attributes(current))
+    return size
+
+
+class Footprint(NamedTuple):
+    # the bytes retained by the object, including the objects it shares with others
+    approximate_bytes: int
+    # the bytes of the objects that no other owner references, i.e. what dropping the owner would free
+    approximate_exclusive_bytes: int
+    # the number of compiled regular expressions among the retained objects
+    regexes: int
+
+
+def approximate_footprints(objects_by_owner: Mapping[_OwnerT, Any]) -> dict[_OwnerT, Footprint]:
+    """Approximate the memory retained by the objects of every owner and how much of it is only theirs"""
+    sizes_by_owner: dict[_OwnerT, dict[int, int]] = {}
+    regexes_by_owner: dict[_OwnerT, int] = {}
+    owner_counts: dict[int, int] = {}
+    for owner, obj in objects_by_owner.items():
+        sizes: dict[int, int] = {}
+        regexes = 0
+        stack = [obj]
+        while stack:
+            current = stack.pop()
+            if id(current) in sizes or isinstance(current, _SHARED_TYPES):
+                continue
+            sizes[id(current)] = sys.getsizeof(current)
+            if isinstance(current, dict):
+                stack.extend(current.keys())
+                stack.extend(current.values())
+            elif isinstance(current, list | tuple | set | frozenset):
+                stack.extend(current)
+            elif isinstance(current, re.Pattern):
+                regexes += 1
+            elif not isinstance(current, str | bytes | int | float | bool | None):
+                stack.extend(_referenced_attributes(current))
+        for object_id in sizes:
+            owner_counts[object_id] = owner_counts.get(object_id, 0) + 1
+        sizes_by_owner[owner] = sizes
+        regexes_by_owner[owner] = regexes
+    return {
+        owner: Footprint(
+            sum(sizes.values()),
+            sum(size for object_id, size in sizes.items() if owner_counts[object_id] == 1),
+            regexes_by_owner[owner],
+        )
+        for owner, sizes in sizes_by_owner.items()
+    }
+
+
+def _referenced_attributes(obj: Any) -> list[Any]:
+    attributes = []
+    instance_dict = getattr(obj, "__dict__", None)
+    if isinstance(instance_dict, dict):
+        attributes.append(instance_dict)
+    for cls in type(obj).__mro__:
+        slots = cls.__dict__.get("__slots__", ())
+        for slot in (slots,) if isinstance(slots, str) else slots:
+            value = getattr(obj, slot, None)
+            if value is not None:
+                attributes.append(value)
+    return attributes
+
+
+def approximate_tree_size(obj: Any) -> int:
+    """
+    Approximate the number of bytes a JSON-like value would take if none of its dicts, lists and strings were shared.
+
+    Unlike approximate_size, every occurrence of an object is counted.
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        size += sys.getsizeof(current)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, list | tuple):
+            stack.extend(current)
+    return size
@@ -0,0 +1,188 @@
+import asyncio
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import date
+from time import perf_counter
+from typing import Any, NamedTuple
+
+from fastapi import HTTPException
+from starlette.types import Receive, Scope, Send
+
+from .instrumentation import Histogram
+
+_WAIT_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class ConcurrencyLimit(NamedTuple):
+    """
+    How many requests of a version, or of all versions in a range together, are processed at once.
+
+    Pass either version or since and until (inclusive and exclusive, None means unbounded). The requests over
+    max_concurrency wait in a queue of up to max_queue requests for up to queue_timeout seconds and the rest
+    are rejected right away.
+    """
+
+    max_concurrency: int
+    max_queue: int = 0
+    queue_timeout: float = 1.0
+    version: str | None = None
+    since: str | None = None
+    until: str | None = None
+
+    @property
+    def name(self) -> str:
+        if self.version is not None:
+            return self.version
+        return f"{self.since or ''}..{self.until or ''}"
+
+
+class _Slots:
+    """The slots of a single ConcurrencyLimit along with the requests that wait for them"""
+
+    def __init__(self, limit: ConcurrencyLimit) -> None:
+        self.limit = limit
+        self.since = None if limit.since is None else date.fromisoformat(limit.since)
+        self.until = None if limit.until is None else date.fromisoformat(limit.until)
+        self.active = 0
+        self.waiters: deque[asyncio.Future[None]] = deque()
+        self.admitted = 0
+        # the requests that were admitted after waiting in the queue
+        self.queued = 0
+        # the requests that were rejected because the queue was full
+        self.rejected = 0
+        # the requests that were rejected because they waited for longer than queue_timeout
+        self.timed_out = 0
+        self.wait_seconds = Histogram(_WAIT_SECONDS_BUCKETS)
+
+    def contains(self, version: date) -> bool:
+        return (self.since is None or self.since <= version) and (self.until is None or version < self.until)
+
+    async def acquire(self) -> bool:
+        """Take a slot, waiting for one in the queue if it has room, and return whether the request got it"""
+        if self.active < self.limit.max_concurrency and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self.waiters) >= self.limit.max_queue:
+            self.rejected += 1
+            return False
+
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        start = perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.limit.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over right before the request timed out or got cancelled
+                self.release()
+            else:
+                self._remove_waiter(waiter)
+            if not isinstance(e, asyncio.TimeoutError):
+                raise
+            self.timed_out += 1
+            return False
+        finally:
+            self.wait_seconds.observe(perf_counter() - start)
+        # the slot was handed over by release so active already counts it
+        self.admitted += 1
+        self.queued += 1
+        return True
+
+    def release(self) -> None:
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _remove_waiter(self, waiter: asyncio.Future[None]) -> None:
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "max_concurrency": self.limit.max_concurrency,
+            "max_queue": self.limit.max_queue,
+            "active": self.active,
+            "waiting": len(self.waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_seconds": self.wait_seconds.snapshot(),
+        }
+
+
+class AdmissionControl:
+    """
+    Limits how many requests of every version are processed at once so that slow versions can't take up all of
+    the capacity of the worker.
+
+    Pass an instance of it to HeaderRoutingFastAPI(admission_control=...). The router admits every request right
+    after resolving its version, before looking it up in the response cache or matching its route. A limit of a
+    single version takes precedence over the limits of the ranges that contain it and of several ranges the
+    first one applies. The versions without a limit and the unversioned requests are never limited. The rejected
+    requests raise an HTTPException of status_code with a `Retry-After` of retry_after seconds, so the exception
+    handlers of the app build their responses.
+    """
+
+    def __init__(
+        self,
+        limits: Iterable[ConcurrencyLimit],
+        *,
+        status_code: int = 503,
+        retry_after: int = 1,
+    ) -> None:
+        self.slots: list[_Slots] = []
+        self._version_slots: dict[date, _Slots] = {}
+        for limit in limits:
+            if limit.max_concurrency < 1:
+                raise ValueError("max_concurrency should be at least 1")
+            if limit.version is not None and (limit.since is not None or limit.until is not None):
+                raise ValueError("A limit should have either a version or a range")
+            slots = _Slots(limit)
+            self.slots.append(slots)
+            if limit.version is not None:
+                self._version_slots.setdefault(date.fromisoformat(limit.version), slots)
+        self._ranged_slots = tuple(slots for slots in self.slots if slots.limit.version is None)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        # resolved version -> its slots. Only ever holds the versions of the app
+        self._slots_by_version: dict[date, _Slots | None] = {}
+
+    def _get_slots(self, version: date) -> _Slots | None:
+        if version in self._slots_by_version:
+            return self._slots_by_version[version]
+        slots = self._version_slots.get(version)
+        if slots is None:
+            slots = next((slots for slots in self._ranged_slots if slots.contains(version)), None)
+        self._slots_by_version[version] = slots
+        return slots
+
+    async def handle(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        version: date | None,
+        process_request: Callable[[], Awaitable[None]],
+    ) -> None:
+        """Process the request once it's admitted or reject it"""
+        slots = None if version is None or scope["type"] != "http" else self._get_slots(version)
+        if slots is None:
+            return await process_request()
+        if not await slots.acquire():
+            raise HTTPException(
+                self.status_code,
+                f"Too many concurrent requests of version {version.isoformat()}",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        try:
+            await process_request()
+        finally:
+            slots.release()
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        return {slots.limit.name: slots.snapshot() for slots in self.slots}
@@ -1,35 +1,161 @@
+import time
+from collections.abc import AsyncIterator, Callable, Mapping, Sequence
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
 from contextvars import ContextVar
 from datetime import date
 from logging import getLogger
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Sequence
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple
 
-from fastapi import Depends, FastAPI, HTTPException, Request, Response, status
+from fastapi import FastAPI, HTTPException, Request, Response, status
 from fastapi.applications import AppType
+from fastapi.dependencies.models import Dependant
+from fastapi.dependencies.utils import is_async_gen_callable, is_coroutine_callable
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
 from fastapi.params import Depends as DependsType
 from fastapi.responses import JSONResponse
-from fastapi.routing import APIRouter
-from fastapi.templating import Jinja2Templates
+from fastapi.routing import APIRoute, APIRouter
+from starlette.concurrency import run_in_threadpool
 from starlette.routing import BaseRoute, Route
 from starlette.types import Lifespan
 
-from .middleware import HeaderVersioningMiddleware, _get_api_version_dependency
+from ._memory import approximate_footprints, approximate_size
+from .instrumentation import CombinedInstrumentation, RoutingInstrumentation
+from .middleware import HeaderVersioningMiddleware
+from .openapi import UNVERSIONED, OpenAPIStore
 from .routing import RootHeaderAPIRouter
+from .usage import VersionUsage
+from .utils import parse_version
+
+if TYPE_CHECKING:
+    from fastapi.templating import Jinja2Templates
+
+    from .admission import AdmissionControl
+    from .coalescing import RequestCoalescing
+    from .pinning import VersionPinning
+    from .profiling import RequestProfiler
+    from .response_cache import ResponseCache
+    from .upstreams import UpstreamClients
 
 CURR_DIR = Path(__file__).resolve()
 logger = getLogger(__name__)
 
 
+class RouteSharingReport(NamedTuple):
+    # the number of (version, route) pairs
+    registered_routes: int
+    # the number of route objects that actually exist
+    unique_routes: int
+    approximate_bytes_saved: int
+
+
+class VersionMemoryReport(NamedTuple):
+    # the routes of the version, including the routes of its version ranges
+    routes: int
+    # the routes that also belong to other versions
+    shared_routes: int
+    # the bytes retained by the routes and the compiled index of the version, including what it shares
+    approximate_routing_bytes: int
+    # the bytes that only the routing of this version retains, i.e. what removing the version would free
+    approximate_exclusive_routing_bytes: int
+    # None if the openapi of the version wasn't generated yet
+    approximate_openapi_bytes: int | None
+    approximate_exclusive_openapi_bytes: int | None
+    compiled_regexes: int
+
+
+class MemoryReport(NamedTuple):
+    # openapi version ("unversioned" for the unversioned routes) -> its report
+    versions: dict[str, VersionMemoryReport]
+    # the number of route objects that the routing of all versions uses
+    unique_routes: int
+    approximate_routing_bytes: int
+    approximate_openapi_bytes: int
+    compiled_regexes: int
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "versions": {version: report._asdict() for version, report in self.versions.items()},
+            "unique_routes": self.unique_routes,
+            "approximate_routing_bytes": self.approximate_routing_bytes,
+            "approximate_openapi_bytes": self.approximate_openapi_bytes,
+            "compiled_regexes": self.compiled_regexes,
+        }
+
+
+class _SharedRouter:
+    def __init__(self, router: APIRouter, source_routes: tuple[BaseRoute, ...], routes: list[BaseRoute]) -> None:
+        # We keep references to the router and its routes so that their ids never get reused by other objects
+        self.router = router
+        self.source_routes = source_routes
+        self.routes = routes
+        self.registrations = 1
+
+
+class _LazyTemplates:
+    """Builds the templates of the docs dashboard on first access so that jinja2 is only imported if it's used"""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._templates: Jinja2Templates | None = None
+
+    def __get__(self, instance: object, owner: type) -> "Jinja2Templates":
+        if self._templates is None:
+            from fastapi.templating import Jinja2Templates
+
+            self._templates = Jinja2Templates(directory=self.directory)
+        return self._templates
+
+
+def _warm_up_on_startup(
+    lifespan_context: Callable[[Any], AbstractAsyncContextManager[Any]],
+    app: "HeaderRoutingFastAPI",
+) -> Callable[[Any], AbstractAsyncContextManager[Any]]:
+    @asynccontextmanager
+    async def lifespan(lifespan_app: Any) -> AsyncIterator[Any]:
+        async with lifespan_context(lifespan_app) as state:
+            # after the lifespan of the app because it can add routes
+            await app.warm_up()
+            yield state
+
+    return lifespan
+
+
+def _get_unique_routes(*route_lists: Sequence[BaseRoute]) -> list[BaseRoute]:
+    # routes compare by value so they are deduplicated by identity
+    return list({id(route): route for routes in route_lists for route in routes}.values())
+
+
+def _has_sync_calls(dependant: Dependant) -> bool:
+    if dependant.call is not None and not (
+        is_coroutine_callable(dependant.call) or is_async_gen_callable(dependant.call)
+    ):
+        return True
+    return any(_has_sync_calls(sub_dependant) for sub_dependant in dependant.dependencies)
+
+
 class HeaderRoutingFastAPI(FastAPI):
-    templates = Jinja2Templates(directory=CURR_DIR.parent / "docs")
+    templates = _LazyTemplates(CURR_DIR.parent / "docs")
 
     def __init__(
         self,
         *args: Any,
         api_version_header_name: str = "X-API-VERSION",
         api_version_var: ContextVar[date] | ContextVar[date | None] | None = None,
+        resolved_versions_cache_size: int = 1024,
+        misses_cache_size: int = 1024,
+        instrumentation: RoutingInstrumentation | None = None,
+        version_usage_url: str | None = None,
+        memory_report_url: str | None = None,
+        version_pinning: "VersionPinning | None" = None,
+        profiler: "RequestProfiler | None" = None,
+        profiles_url: str | None = None,
+        response_cache: "ResponseCache | None" = None,
+        request_coalescing: "RequestCoalescing | None" = None,
+        admission_control: "AdmissionControl | None" = None,
+        upstream_clients: "UpstreamClients | None" = None,
+        warm_up: bool = False,
         routes: list[BaseRoute] | None = None,
         docs_url: str | None = "/docs",
         redoc_url: None = None,
@@ -47,6 +173,14 @@ class HeaderRoutingFastAPI(FastAPI):
         if api_version_var is None:
             api_version_var = ContextVar("api_header_version")
         self.api_version_var = api_version_var
+        self.version_usage: VersionUsage | None = None
+        if version_usage_url is not None:
+            self.version_usage = VersionUsage()
+            instrumentation = (
+                self.version_usage
+                if instrumentation is None
+                else CombinedInstrumentation(instrumentation, self.version_usage)
+            )
         super().__init__(*args, **kwargs, openapi_url=None, docs_url=None, redoc_url=None)
         self.router: RootHeaderAPIRouter = RootHeaderAPIRouter(
             routes=self.routes,
@@ -58,12 +192,36 @@ class HeaderRoutingFastAPI(FastAPI):
             deprecated=deprecated,
             responses=responses,
             api_version_header_name=api_version_header_name,
+            resolved_versions_cache_size=resolved_versions_cache_size,
+            misses_cache_size=misses_cache_size,
+            instrumentation=instrumentation,
+            profiler=profiler,
+            response_cache=response_cache,
+            request_coalescing=request_coalescing,
+            admission_control=admission_control,
             lifespan=lifespan,
         )
-        self.swaggers = {}
+        self.version_pinning = version_pinning
+        if warm_up:
+            self.router.lifespan_context = _warm_up_on_startup(self.router.lifespan_context, self)
+        self.upstream_clients = upstream_clients
+        if upstream_clients is not None:
+            # imported here so that the apps that don't call other services don't import httpx
+            from .upstreams import close_on_shutdown
+
+            upstream_clients.bind(self.api_version_var, self.router.api_version_header_name)
+            self.router.lifespan_context = close_on_shutdown(self.router.lifespan_context, upstream_clients)
+        self.swaggers = OpenAPIStore(self.router, self.generate_openapi)
+        # ids of a router and of its routes -> the routes that were created when the router was first included
+        self._shared_routers: dict[tuple[int, ...], _SharedRouter] = {}
+        # version -> the keys of _shared_routers of the routers that were included for it, once per inclusion
+        self._shared_router_keys_by_version: dict[date, list[tuple[int, ...]]] = {}
         router = APIRouter(routes=routes)
         self.docs_url = docs_url
         self.openapi_url = openapi_url
+        self.version_usage_url = version_usage_url
+        self.memory_report_url = memory_report_url
+        self.profiles_url = profiles_url
 
         if self.openapi_url is not None:
             router.add_route(
@@ -77,22 +235,83 @@ class HeaderRoutingFastAPI(FastAPI):
                     endpoint=self.swagger_dashboard,
                     include_in_schema=False,
                 )
+        if self.version_usage_url is not None:
+            router.add_route(
+                path=self.version_usage_url,
+                endpoint=self.version_usage_snapshot,
+                include_in_schema=False,
+            )
+        if self.memory_report_url is not None:
+            router.add_route(
+                path=self.memory_report_url,
+                endpoint=self.memory_report,
+                include_in_schema=False,
+            )
+        if self.profiles_url is not None:
+            router.add_route(
+                path=self.profiles_url,
+                endpoint=self.profiles_snapshot,
+                include_in_schema=False,
+            )
         self.add_unversioned_routers(router)
         self.add_middleware(
             HeaderVersioningMiddleware,
             api_version_header_name=self.router.api_version_header_name,
             api_version_var=self.api_version_var,
             default_response_class=default_response_class,
+            instrumentation=instrumentation,
+            version_pinning=version_pinning,
         )
 
     def enrich_swagger(self):
         """
-        This method goes through all header-based apps and collect a dict[openapi_version, openapi_json]
+        This method goes through all header-based apps and generates the openapi of every version in self.swaggers
 
-        For each route a `X-API-VERSION` header with value is added
+        self.swaggers already generates the openapi of a version on its first access so this method is only useful
+        for paying the cost of generation upfront.
+        """
+        for version in self.swaggers:
+            self.swaggers[version]
+
+    async def warm_up(self) -> None:
+        """
+        Do the work that the first requests would otherwise do so that they are as fast as the rest.
 
+        It resolves every version and compiles its routes for pinned clients, starts the thread pool if an endpoint
+        or a dependency is sync, generates and encodes the openapi of every version and loads the template of the
+        docs dashboard. HeaderRoutingFastAPI(warm_up=True) calls it on startup after the lifespan of the app, so
+        the worker only reports that it's ready afterwards. Generating the openapis takes most of the time.
         """
-        unversioned_routes_openapi = get_openapi(
+        start = time.perf_counter()
+        routing_table = self.router.routing_table
+        for version in routing_table.sorted_versions:
+            routing_table.resolve_header_value(version.isoformat().encode())
+            if self.version_pinning is not None:
+                routing_table.get_pinned_route_index(version)
+        if self.version_pinning is not None:
+            routing_table.get_pinned_route_index(None)
+
+        version_routes = map(routing_table.get_version_routes, routing_table.sorted_versions)
+        routes = _get_unique_routes(routing_table.unversioned_routes, *version_routes)
+        if any(_has_sync_calls(route.dependant) for route in routes if isinstance(route, APIRoute)):
+            # the first call imports the backend of anyio and starts a worker thread
+            await run_in_threadpool(lambda: None)
+
+        if self.openapi_url is not None:
+            for version in self.swaggers:
+                self.swaggers.get_encoded(version)
+            if self.docs_url is not None:
+                self.templates.get_template("docs.html")
+        logger.info(
+            "Warmed up %d versions and %d routes in %.3f seconds",
+            len(routing_table.sorted_versions),
+            len(routes),
+            time.perf_counter() - start,
+        )
+
+    def generate_openapi(self, routes: Sequence[BaseRoute]) -> dict[str, Any]:
+        """Generate the openapi of a single version from its routes"""
+        return get_openapi(
             title=self.title,
             version=self.version,
             openapi_version=self.openapi_version,
@@ -100,40 +319,51 @@ class HeaderRoutingFastAPI(FastAPI):
             terms_of_service=self.terms_of_service,
             contact=self.contact,
             license_info=self.license_info,
-            routes=self.router.unversioned_routes,
+            routes=routes,
             tags=self.openapi_tags,
             servers=self.servers,
         )
-        if unversioned_routes_openapi["paths"]:
-            self.swaggers["unversioned"] = unversioned_routes_openapi
-
-        for header_value, routes in self.router.versioned_routes.items():
-            header_value_str = header_value.isoformat()
-            openapi = get_openapi(
-                title=self.title,
-                version=self.version,
-                openapi_version=self.openapi_version,
-                description=self.description,
-                terms_of_service=self.terms_of_service,
-                contact=self.contact,
-                license_info=self.license_info,
-                routes=routes,
-                tags=self.openapi_tags,
-                servers=self.servers,
-            )
-            # in current implementation we expect header_value to be a date
-            self.swaggers[header_value_str] = openapi
 
-    async def openapi_jsons(self, req: Request) -> JSONResponse:
+    async def openapi_jsons(self, req: Request) -> Response:
         version = req.query_params.get("version")
-        openapi_of_a_version = self.swaggers.get(version)
-        if not openapi_of_a_version:
+        if version not in self.swaggers:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"OpenApi file of with version `{version}` not found",
             )
+        openapi = self.swaggers.get_encoded(version)
+
+        content_encoding = openapi.negotiate(req.headers.get("accept-encoding", ""))
+        body, etag = openapi.bodies[content_encoding]
+        headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+        if openapi.matches(req.headers.get("if-none-match", "")):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        if content_encoding != "identity":
+            headers["Content-Encoding"] = content_encoding
+        return Response(body, media_type="application/json", headers=headers)
 
-        return JSONResponse(openapi_of_a_version)
+    async def memory_report(self, req: Request) -> Response:
+        """Serve get_memory_report of this worker"""
+        return JSONResponse(self.get_memory_report().to_dict())
+
+    async def version_usage_snapshot(self, req: Request) -> Response:
+        """Serve the version usage counters of this worker. See `verselect.usage.merge_version_usage_snapshots`"""
+        if self.version_usage is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        return JSONResponse(self.version_usage.snapshot())
+
+    async def profiles_snapshot(self, req: Request) -> Response:
+        """Serve the aggregated profiles of this worker, the `limit` slowest functions of every (version, route)"""
+        if self.router.profiler is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        try:
+            limit = int(req.query_params.get("limit", 20))
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="limit should be an integer",
+            ) from e
+        return JSONResponse(self.router.profiler.snapshot(limit=limit))
 
     async def swagger_dashboard(self, req: Request) -> Response:
         base_url = str(req.base_url).rstrip("/")
@@ -158,31 +388,191 @@ class HeaderRoutingFastAPI(FastAPI):
         header_value: str,
     ) -> list[BaseRoute]:
         """Add all routes from routers to be routed using header_value and return the added routes"""
-        try:
-            header_value_as_dt = date.fromisoformat(header_value)
-        except ValueError as e:
-            raise ValueError("header_value should be in ISO 8601 format") from e
+        header_value_as_dt = parse_version("header_value", header_value)
 
         added_routes: list[BaseRoute] = []
         for router in routers:
-            added_route_count = len(router.routes)
-            self.include_router(
-                router,
-                dependencies=[Depends(_get_api_version_dependency(self.router.api_version_header_name, header_value))],
-            )
-            added_routes.extend(self.routes[len(self.routes) - added_route_count :])
+            added_routes.extend(self._include_shared_router(router, header_value_as_dt))
+
+        self.router.add_versioned_routes(header_value_as_dt, added_routes)
+        if self.router.ranged_routes:
+            # the routes of a version also belong to the range boundaries that come after it
+            self.swaggers.invalidate()
+        else:
+            self.swaggers.invalidate(header_value_as_dt.isoformat())
+        return added_routes
 
-        for route in added_routes:
-            self.router.versioned_routes.setdefault(header_value_as_dt, []).append(route)
+    def add_versions(
+        self,
+        routers_by_version: Mapping[str, APIRouter | Sequence[APIRouter]],
+    ) -> dict[str, list[BaseRoute]]:
+        """
+        Add the routers of several versions at once and return the added routes of every version.
 
-        self.enrich_swagger()
+        It's the same as calling add_header_versioned_routers for every version but the routing table is only
+        built once, so registering many versions at startup doesn't rebuild it for every one of them.
+        """
+        versions = {header_value: parse_version("header_value", header_value) for header_value in routers_by_version}
+        added_routes_by_version: dict[str, list[BaseRoute]] = {}
+        for header_value, routers in routers_by_version.items():
+            added_routes = added_routes_by_version[header_value] = []
+            for router in (routers,) if isinstance(routers, APIRouter) else routers:
+                added_routes.extend(self._include_shared_router(router, versions[header_value]))
+
+        self.router.add_many_versioned_routes(
+            {versions[header_value]: routes for header_value, routes in added_routes_by_version.items()},
+        )
+        if self.router.ranged_routes:
+            self.swaggers.invalidate()
+        else:
+            for version in versions.values():
+                self.swaggers.invalidate(version.isoformat())
+        return added_routes_by_version
+
+    def remove_version(self, header_value: str) -> tuple[BaseRoute, ...]:
+        """
+        Remove the version that was added with add_header_versioned_routers and return its routes.
+
+        It's safe to call while requests are being served: the requests that have already been routed finish with
+        the old routes and the next requests for the version get routed to the closest older version.
+        """
+        version = parse_version("header_value", header_value)
+        removed_routes = self.router.remove_version(version)
+        dropped_route_ids: set[int] = set()
+        for key in self._shared_router_keys_by_version.pop(version, ()):
+            shared = self._shared_routers[key]
+            shared.registrations -= 1
+            if not shared.registrations:
+                del self._shared_routers[key]
+                dropped_route_ids.update(map(id, shared.routes))
+        if dropped_route_ids:
+            self.router.routes = [route for route in self.router.routes if id(route) not in dropped_route_ids]
+
+        if self.router.ranged_routes:
+            self.swaggers.invalidate()
+        else:
+            self.swaggers.invalidate(version.isoformat())
+        return removed_routes
+
+    def add_version_ranged_routers(
+        self,
+        *routers: APIRouter,
+        since: str,
+        until: str | None = None,
+    ) -> list[BaseRoute]:
+        """
+        Add all routes from routers to every version from since (inclusive) until until (exclusive, None means
+        forever) and return the added routes.
+
+        Unlike add_header_versioned_routers, the routers only need to be added once instead of for every version.
+        The boundaries of the range become versions themselves so a request still gets the routes of the closest
+        version that is not newer than the requested one.
+        """
+        since_as_dt = parse_version("since", since)
+        until_as_dt = None if until is None else parse_version("until", until)
+
+        added_routes: list[BaseRoute] = []
+        for router in routers:
+            added_routes.extend(self._include_shared_router(router))
+
+        self.router.add_ranged_routes(added_routes, since=since_as_dt, until=until_as_dt)
+        self.swaggers.invalidate()
         return added_routes
 
+    def _include_shared_router(self, router: APIRouter, version: date | None = None) -> list[BaseRoute]:
+        """
+        Include the router and return its routes or return the routes that were created when the same router
+        was included for another version.
+
+        The routes of a router are identical between versions (the version is validated by the middleware and
+        resolved by the router once per request) so there's no need to duplicate their dependants, response fields
+        and regexes for every version. The inclusion is remembered for the version, if it's given, so that
+        remove_version can tell when the routes are no longer used by any version.
+        """
+        key = (id(router), *map(id, router.routes))
+        if version is not None:
+            self._shared_router_keys_by_version.setdefault(version, []).append(key)
+        shared = self._shared_routers.get(key)
+        if shared is not None:
+            shared.registrations += 1
+            return shared.routes
+
+        added_route_count = len(router.routes)
+        self.include_router(router)
+        routes = self.routes[len(self.routes) - added_route_count :]
+        self._shared_routers[key] = _SharedRouter(router, tuple(router.routes), routes)
+        return routes
+
+    def get_route_sharing_report(self) -> "RouteSharingReport":
+        """Report how many versioned routes are shared between versions and how much memory that saves"""
+        registered_routes = unique_routes = approximate_bytes_saved = 0
+        seen: set[int] = set()
+        for shared in self._shared_routers.values():
+            unique_routes += len(shared.routes)
+            registered_routes += len(shared.routes) * shared.registrations
+            if shared.registrations > 1:
+                routes_size = approximate_size(shared.routes, seen)
+                approximate_bytes_saved += routes_size * (shared.registrations - 1)
+        return RouteSharingReport(registered_routes, unique_routes, approximate_bytes_saved)
+
+    def get_memory_report(self) -> MemoryReport:
+        """
+        Report the routes of every version and approximately how much memory their routing and openapi retain.
+
+        Only the openapis that were already generated are counted, so call enrich_swagger first to report on every
+        version. Walking every object takes a while with many versions, so it's not meant to be called per request.
+        """
+        routing_table = self.router.routing_table
+        routing_by_version: dict[str, tuple[tuple[BaseRoute, ...], Any]] = {
+            UNVERSIONED: (routing_table.unversioned_routes, routing_table.unversioned_index),
+        }
+        for version in routing_table.sorted_versions:
+            routing_by_version[version.isoformat()] = (
+                routing_table.get_version_routes(version),
+                routing_table.get_route_index(version),
+            )
+        route_ids_by_version = {version: set(map(id, routes)) for version, (routes, _) in routing_by_version.items()}
+        version_counts: dict[int, int] = {}
+        for route_ids in route_ids_by_version.values():
+            for route_id in route_ids:
+                version_counts[route_id] = version_counts.get(route_id, 0) + 1
+        openapis = {
+            version: openapi
+            for version in routing_by_version
+            if (openapi := self.swaggers.get_generated(version)) is not None
+        }
+
+        routing_footprints = approximate_footprints(routing_by_version)
+        openapi_footprints = approximate_footprints(openapis)
+        total_routing = approximate_footprints({None: tuple(routing_by_version.values())})[None]
+        versions = {}
+        for version, footprint in routing_footprints.items():
+            openapi_footprint = openapi_footprints.get(version)
+            versions[version] = VersionMemoryReport(
+                routes=len(routing_by_version[version][0]),
+                shared_routes=sum(version_counts[route_id] > 1 for route_id in route_ids_by_version[version]),
+                approximate_routing_bytes=footprint.approximate_bytes,
+                approximate_exclusive_routing_bytes=footprint.approximate_exclusive_bytes,
+                approximate_openapi_bytes=None if openapi_footprint is None else openapi_footprint.approximate_bytes,
+                approximate_exclusive_openapi_bytes=(
+                    None if openapi_footprint is None else openapi_footprint.approximate_exclusive_bytes
+                ),
+                compiled_regexes=footprint.regexes,
+            )
+        return MemoryReport(
+            versions=versions,
+            unique_routes=len(version_counts),
+            approximate_routing_bytes=total_routing.approximate_bytes,
+            approximate_openapi_bytes=approximate_size(tuple(openapis.values())),
+            compiled_regexes=total_routing.regexes,
+        )
+
     def add_unversioned_routers(self, *routers: APIRouter):
         for router in routers:
             self.include_router(router)
-            self.router.unversioned_routes.extend(router.routes)
-        self.enrich_swagger()
+            self.router.add_unversioned_routes(router.routes)
+        self.swaggers.invalidate(UNVERSIONED)
 
     def add_unversioned_routes(self, *routes: Route):
-        self.router.unversioned_routes.extend(routes)
+        self.router.add_unversioned_routes(routes)
+        self.swaggers.invalidate(UNVERSIONED)
@@ -0,0 +1,163 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from datetime import date
+from typing import Any, TypeVar
+
+from starlette.routing import BaseRoute
+from starlette.types import Message, Scope, Send
+
+from ._capture import capture_response
+from .instrumentation import ROUTING_RECORD_SCOPE_KEY, RoutingRecord
+from .utils import CREDENTIAL_HEADERS, set_bounded
+
+_EndpointT = TypeVar("_EndpointT", bound=Callable[..., Any])
+
+# The attribute of the endpoints that no_coalescing marks
+_NO_COALESCING_ATTRIBUTE = "__verselect_no_coalescing__"
+# The headers that identify the client so the requests of different clients are never coalesced
+
+
+def no_coalescing(endpoint: _EndpointT) -> _EndpointT:
+    """
+    Mark the endpoint so that its concurrent requests are never coalesced, like an endpoint whose GET has
+    side effects. Apply it below the route decorator.
+    """
+    setattr(endpoint, _NO_COALESCING_ATTRIBUTE, True)
+    return endpoint
+
+
+class _SharedResponse:
+    __slots__ = ("body", "headers", "route", "status")
+
+    def __init__(self, status: int, headers: list[tuple[bytes, bytes]], body: bytes, route: BaseRoute | None) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.route = route
+
+    async def send_to(self, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status, "headers": list(self.headers)})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class _InFlightRequest:
+    __slots__ = ("done", "response")
+
+    def __init__(self) -> None:
+        self.done = asyncio.Event()
+        # None until the request completes, and afterwards if its response can't be shared
+        self.response: _SharedResponse | None = None
+
+
+class RequestCoalescing:
+    """
+    Lets concurrent identical requests share a single execution of their endpoint.
+
+    Pass an instance of it to HeaderRoutingFastAPI(request_coalescing=...). Requests are identical if they have
+    the same resolved version, method, path, query string and values of the `Authorization` and `Cookie` headers
+    along with the given headers (add the other headers that the responses depend on). The first of them runs the
+    endpoint and the requests that arrive while it's in flight wait for it and get a copy of its response. Only
+    the methods in `methods` are coalesced, and the endpoints marked with `no_coalescing` never are.
+
+    A waiting request runs the endpoint itself if the shared response can't be used: the endpoint turned out to
+    be marked with `no_coalescing`, the response is not successful (2xx), sets a cookie or is larger than
+    max_response_bytes, or the first request failed.
+    """
+
+    def __init__(
+        self,
+        *,
+        methods: Iterable[str] = ("GET", "HEAD"),
+        headers: Iterable[str] = (),
+        max_response_bytes: int = 1024 * 1024,
+        opted_out_cache_size: int = 1024,
+    ) -> None:
+        self.methods = frozenset(methods)
+        self.headers = tuple(dict.fromkeys(header.lower().encode() for header in (*CREDENTIAL_HEADERS, *headers)))
+        self.max_response_bytes = max_response_bytes
+        self.opted_out_cache_size = opted_out_cache_size
+        # the requests that ran their endpoint
+        self.executions = 0
+        # the requests that got a copy of the response of another request
+        self.coalesced_requests = 0
+        # the requests that waited for another request but had to run their endpoint anyway
+        self.fallbacks = 0
+        # request key -> the request that is running the endpoint
+        self._in_flight: dict[Hashable, _InFlightRequest] = {}
+        # (version, compiled routes, method, path) of the endpoints marked with no_coalescing that were requested
+        self._opted_out: dict[tuple[date | None, object, str, str], None] = {}
+
+    async def handle(
+        self,
+        scope: Scope,
+        send: Send,
+        version: date | None,
+        routes: object,
+        process_request: Callable[[Send], Awaitable[None]],
+    ) -> None:
+        """Process the request or wait for an identical request that is in flight and send a copy of its response"""
+        resource_key = (version, routes, scope["method"], scope["path"])
+        if scope["method"] not in self.methods or resource_key in self._opted_out:
+            return await process_request(send)
+        key = (resource_key, scope.get("query_string", b""), self._get_header_values(scope))
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            await in_flight.done.wait()
+            if in_flight.response is None:
+                self.fallbacks += 1
+                return await process_request(send)
+            self.coalesced_requests += 1
+            record: RoutingRecord | None = scope.get(ROUTING_RECORD_SCOPE_KEY)
+            if record is not None:
+                record.route = in_flight.response.route
+            return await in_flight.response.send_to(send)
+
+        in_flight = self._in_flight[key] = _InFlightRequest()
+        self.executions += 1
+        try:
+            await process_request(self._capture(scope, resource_key, in_flight, send))
+        finally:
+            del self._in_flight[key]
+            in_flight.done.set()
+
+    def snapshot(self) -> dict[str, int]:
+        return {
+            "executions": self.executions,
+            "coalesced_requests": self.coalesced_requests,
+            "fallbacks": self.fallbacks,
+            "in_flight": len(self._in_flight),
+        }
+
+    def _get_header_values(self, scope: Scope) -> tuple[tuple[bytes, ...], ...]:
+        return tuple(tuple(value for name, value in scope["headers"] if name == header) for header in self.headers)
+
+    def _capture(
+        self,
+        scope: Scope,
+        resource_key: tuple[date | None, object, str, str],
+        in_flight: _InFlightRequest,
+        send: Send,
+    ) -> Send:
+        def on_start(start: Message) -> bool | None:
+            if getattr(scope.get("endpoint"), _NO_COALESCING_ATTRIBUTE, False):
+                self._opt_out(resource_key)
+                return None
+            if not 200 <= start["status"] < 300:
+                return None
+            if any(name.lower() == b"set-cookie" for name, _ in start.get("headers", ())):
+                return None
+            return True
+
+        def on_complete(_: bool, status: int, headers: list[tuple[bytes, bytes]], body: bytes) -> None:
+            in_flight.response = _SharedResponse(status, headers, body, scope.get("route"))
+
+        return capture_response(
+            send,
+            max_body_bytes=self.max_response_bytes,
+            on_start=on_start,
+            on_complete=on_complete,
+        )
+
+    def _opt_out(self, resource_key: tuple[date | None, object, str, str]) -> None:
+        set_bounded(self._opted_out, resource_key, None, self.opted_out_cache_size)
@@ -0,0 +1,111 @@
+from collections.abc import Hashable
+from typing import Any
+
+# Values of these types are interned by the store. Other values (numbers, booleans and None) are kept as is
+_INTERNED_TYPES = (dict, list, str)
+
+
+class _Entry:
+    __slots__ = ("address", "references")
+
+    def __init__(self, address: Hashable) -> None:
+        self.address = address
+        # the interned dicts and lists that contain the value plus the interned roots that are the value itself
+        self.references = 0
+
+
+class ContentStore:
+    """
+    A content-addressed store of JSON-like values (like openapi documents).
+
+    Interning a value returns an equal value whose dicts, lists and strings are shared with every other value
+    interned by the same store when their content is identical, so the subtrees that are the same in several
+    documents are only kept in memory once. The interned values must be treated as read-only.
+
+    Values are interned bottom-up: the address of a dict or a list is built from the addresses of its already
+    interned items, so an identical subtree is found without serializing or hashing the whole subtree again.
+    Dicts with the same items in a different order are not considered identical because they serialize differently.
+
+    Every interned value counts its references, so releasing a value only visits the parts that no other value uses.
+    """
+
+    def __init__(self) -> None:
+        # address -> the interned value. The values keep the ids in the addresses of their parents alive
+        self._values: dict[Hashable, Any] = {}
+        # id of the interned value -> its address and references
+        self._entries: dict[int, _Entry] = {}
+
+    def intern(self, value: Any) -> Any:
+        """Intern the value and keep it until it's released"""
+        interned = self._intern(value)
+        self._reference(interned)
+        return interned
+
+    def release(self, interned_value: Any) -> None:
+        """Forget the parts of a value returned by intern that no other interned value uses anymore"""
+        stack = [interned_value]
+        while stack:
+            value = stack.pop()
+            if not isinstance(value, _INTERNED_TYPES):
+                continue
+            entry = self._entries[id(value)]
+            entry.references -= 1
+            if entry.references:
+                continue
+            del self._entries[id(value)]
+            del self._values[entry.address]
+            if isinstance(value, dict):
+                stack.extend(value.keys())
+                stack.extend(value.values())
+            elif isinstance(value, list):
+                stack.extend(value)
+
+    def _intern(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            items = [(self._intern(key), self._intern(item)) for key, item in value.items()]
+            address: Hashable = (dict, tuple((id(key), _get_address(item)) for key, item in items))
+            interned = self._values.get(address)
+            if interned is None:
+                interned = self._add(address, dict(items))
+                for key, item in items:
+                    self._reference(key)
+                    self._reference(item)
+            return interned
+        if isinstance(value, list):
+            items = [self._intern(item) for item in value]
+            address = (list, tuple(_get_address(item) for item in items))
+            interned = self._values.get(address)
+            if interned is None:
+                interned = self._add(address, items)
+                for item in items:
+                    self._reference(item)
+            return interned
+        if isinstance(value, str):
+            interned = self._values.get((str, value))
+            if interned is None:
+                interned = self._add((str, value), value)
+            return interned
+        return value
+
+    def _add(self, address: Hashable, value: Any) -> Any:
+        self._values[address] = value
+        self._entries[id(value)] = _Entry(address)
+        return value
+
+    def _reference(self, interned_value: Any) -> None:
+        if isinstance(interned_value, _INTERNED_TYPES):
+            self._entries[id(interned_value)].references += 1
+
+    def clear(self) -> None:
+        self._values.clear()
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+def _get_address(interned_value: Any) -> Hashable:
+    if isinstance(interned_value, _INTERNED_TYPES):
+        return id(interned_value)
+    # True == 1 == 1.0 but they serialize differently
+    return (type(interned_value), interned_value)
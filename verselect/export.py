@@ -0,0 +1,88 @@
+import importlib
+import os
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from fastapi.openapi.docs import get_swagger_ui_html
+
+from .app import HeaderRoutingFastAPI
+
+# content-coding -> file suffix of the pre-compressed openapi
+_ENCODED_SUFFIXES = {"identity": "", "gzip": ".gz", "br": ".br"}
+
+# import string -> the app imported by the current export worker process
+_worker_apps: dict[str, HeaderRoutingFastAPI] = {}
+
+
+def load_app(import_string: str) -> HeaderRoutingFastAPI:
+    """Import the app from a "module:attribute" string, just like uvicorn does"""
+    module_name, _, attribute_path = import_string.partition(":")
+    if not module_name or not attribute_path:
+        raise ValueError(f'The app should be given as "module:attribute", got "{import_string}"')
+    app = importlib.import_module(module_name)
+    for attribute in attribute_path.split("."):
+        app = getattr(app, attribute)
+    if not isinstance(app, HeaderRoutingFastAPI):
+        raise TypeError(f'"{import_string}" is not a HeaderRoutingFastAPI app')
+    return app
+
+
+def export_docs(
+    app: HeaderRoutingFastAPI,
+    directory: str | Path,
+    *,
+    import_string: str | None = None,
+    processes: int | None = None,
+) -> tuple[str, ...]:
+    """
+    Write the docs of every version of the app to the directory as static files and return the versions:
+
+    * openapi/{version}.json along with its pre-compressed .gz (and .br if brotli is installed) variants
+    * swagger/{version}.html that shows the openapi of the version in Swagger UI
+    * index.html, the docs dashboard with links to the swagger page of every version
+
+    The files are exactly what openapi_url and docs_url would serve, so the app can be served with both of them
+    disabled. If import_string is given, the openapis are generated in a pool of processes (as many as the CPUs
+    by default) that import the app from it. Otherwise they're generated in the current process.
+    """
+    directory = Path(directory)
+    (directory / "openapi").mkdir(parents=True, exist_ok=True)
+    (directory / "swagger").mkdir(parents=True, exist_ok=True)
+    versions = tuple(sorted(app.swaggers))
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if import_string is None or processes <= 1 or len(versions) <= 1:
+        _write_openapis(app, versions, directory)
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(versions))) as executor:
+            # every version is a separate task so the slow versions don't hold back a whole chunk of versions
+            futures = [
+                executor.submit(_write_worker_openapi, import_string, version, directory) for version in versions
+            ]
+            for future in futures:
+                future.result()
+
+    for version in versions:
+        swagger_html = get_swagger_ui_html(openapi_url=f"../openapi/{version}.json", title="Swagger UI")
+        (directory / "swagger" / f"{version}.html").write_bytes(swagger_html.body)
+    dashboard = app.templates.get_template("docs.html").render(
+        table={version: f"swagger/{version}.html" for version in versions},
+    )
+    (directory / "index.html").write_text(dashboard)
+    return versions
+
+
+def _write_openapis(app: HeaderRoutingFastAPI, versions: Iterable[str], directory: Path) -> None:
+    for version in versions:
+        for content_encoding, (body, _) in app.swaggers.get_encoded(version).bodies.items():
+            (directory / "openapi" / f"{version}.json{_ENCODED_SUFFIXES[content_encoding]}").write_bytes(body)
+
+
+def _write_worker_openapi(import_string: str, version: str, directory: Path) -> None:
+    # every worker imports the app once and reuses it for all of its versions
+    app = _worker_apps.get(import_string)
+    if app is None:
+        app = _worker_apps[import_string] = load_app(import_string)
+    _write_openapis(app, [version], directory)
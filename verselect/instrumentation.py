@@ -0,0 +1,182 @@
+import bisect
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Any
+
+from starlette.types import Message, Send
+
+if TYPE_CHECKING:
+    from datetime import date
+
+    from starlette.routing import BaseRoute
+
+# The key of the RoutingRecord of the current request in the ASGI scope
+ROUTING_RECORD_SCOPE_KEY = "verselect.routing_record"
+
+
+class RoutingRecord:
+    """What verselect did to route a single request. Times are in nanoseconds."""
+
+    __slots__ = (
+        "cache_hit",
+        "match_ns",
+        "requested_version",
+        "resolve_ns",
+        "resolved_version",
+        "route",
+        "routed",
+        "routes_scanned",
+        "validate_ns",
+    )
+
+    def __init__(self) -> None:
+        # time spent by the middleware on validating the version header
+        self.validate_ns = 0
+        # time spent by the router on picking the version
+        self.resolve_ns = 0
+        # time spent by the router on finding the route within the version
+        self.match_ns = 0
+        # the number of routes whose `matches` was called
+        self.routes_scanned = 0
+        # the raw value of the version header or None for unversioned requests
+        self.requested_version: str | None = None
+        # the version whose routes served the request. None for unversioned requests and for the requests
+        # that are older than the oldest version
+        self.resolved_version: date | None = None
+        # whether the version was taken from the router's cache. None for unversioned requests
+        self.cache_hit: bool | None = None
+        # whether the router got the request. False when the middleware rejected the version header
+        self.routed = False
+        # the route that handled the request or None if no route matched
+        self.route: BaseRoute | None = None
+
+    def to_server_timing(self) -> str:
+        return ", ".join(
+            f"verselect-{name};dur={duration_ns / 1_000_000:.3f}"
+            for name, duration_ns in (
+                ("validate", self.validate_ns),
+                ("resolve", self.resolve_ns),
+                ("match", self.match_ns),
+            )
+        )
+
+
+class RoutingInstrumentation:
+    """
+    The base class for the hooks that get a RoutingRecord of every request.
+
+    Pass an instance of it to HeaderRoutingFastAPI(instrumentation=...) to enable the instrumentation.
+    When no instrumentation is passed, routing doesn't measure anything.
+    """
+
+    def __init__(self, *, server_timing: bool = False) -> None:
+        # Whether to report the routing timings in the Server-Timing header of every response
+        self.server_timing = server_timing
+
+    def on_request(self, record: RoutingRecord) -> None:
+        """Called once the response of the request has been sent"""
+
+
+class CombinedInstrumentation(RoutingInstrumentation):
+    """Passes every record to several instrumentations"""
+
+    def __init__(self, *instrumentations: RoutingInstrumentation) -> None:
+        super().__init__(server_timing=any(instrumentation.server_timing for instrumentation in instrumentations))
+        self.instrumentations = instrumentations
+
+    def on_request(self, record: RoutingRecord) -> None:
+        for instrumentation in self.instrumentations:
+            instrumentation.on_request(record)
+
+
+def with_server_timing(send: Send, record: RoutingRecord) -> Send:
+    """Wrap send so that the routing timings of the record are added to the Server-Timing header of the response"""
+
+    async def send_with_server_timing(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            message["headers"] = [
+                *message.get("headers", ()),
+                (b"server-timing", record.to_server_timing().encode("latin-1")),
+            ]
+        await send(message)
+
+    return send_with_server_timing
+
+
+class Histogram:
+    """A cumulative histogram with fixed bucket upper bounds in the style of prometheus"""
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(sorted(buckets))
+        # the last count is for the values that are larger than every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        cumulative_counts = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative_counts.append(total)
+        return {
+            "buckets": {
+                **{str(bucket): count for bucket, count in zip(self.buckets, cumulative_counts, strict=False)},
+                "+Inf": cumulative_counts[-1],
+            },
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+_SECONDS_BUCKETS = (0.000_005, 0.000_01, 0.000_025, 0.000_05, 0.000_1, 0.000_25, 0.000_5, 0.001, 0.005, 0.01)
+_ROUTES_SCANNED_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+
+class RoutingMetrics(RoutingInstrumentation):
+    """Aggregates the routing records into in-process counters and histograms"""
+
+    def __init__(self, *, server_timing: bool = False) -> None:
+        super().__init__(server_timing=server_timing)
+        self.requests = 0
+        self.unversioned_requests = 0
+        # the requests that are older than the oldest version
+        self.unresolved_requests = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.validate_seconds = Histogram(_SECONDS_BUCKETS)
+        self.resolve_seconds = Histogram(_SECONDS_BUCKETS)
+        self.match_seconds = Histogram(_SECONDS_BUCKETS)
+        self.routes_scanned = Histogram(_ROUTES_SCANNED_BUCKETS)
+
+    def on_request(self, record: RoutingRecord) -> None:
+        self.requests += 1
+        if record.requested_version is None:
+            self.unversioned_requests += 1
+        elif record.routed and record.resolved_version is None:
+            self.unresolved_requests += 1
+        if record.cache_hit is True:
+            self.cache_hits += 1
+        elif record.cache_hit is False:
+            self.cache_misses += 1
+        self.validate_seconds.observe(record.validate_ns / 1_000_000_000)
+        self.resolve_seconds.observe(record.resolve_ns / 1_000_000_000)
+        self.match_seconds.observe(record.match_ns / 1_000_000_000)
+        self.routes_scanned.observe(record.routes_scanned)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "unversioned_requests": self.unversioned_requests,
+            "unresolved_requests": self.unresolved_requests,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "validate_seconds": self.validate_seconds.snapshot(),
+            "resolve_seconds": self.resolve_seconds.snapshot(),
+            "match_seconds": self.match_seconds.snapshot(),
+            "routes_scanned": self.routes_scanned.snapshot(),
+        }
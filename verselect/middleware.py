@@ -2,14 +2,20 @@ import inspect
 from contextlib import AsyncExitStack
 from contextvars import ContextVar
 from datetime import date
-from typing import Annotated, Any, cast
+from time import perf_counter_ns
+from typing import TYPE_CHECKING, Annotated, Any, cast
 
 from fastapi import Header, Request, Response
 from fastapi._compat import _normalize_errors
 from fastapi.dependencies.utils import get_dependant, solve_dependencies
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware, DispatchFunction, RequestResponseEndpoint
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .instrumentation import ROUTING_RECORD_SCOPE_KEY, RoutingInstrumentation, RoutingRecord, with_server_timing
+from .utils import PINNED_VERSION_SCOPE_KEY, parse_iso_date, set_bounded
+
+if TYPE_CHECKING:
+    from .pinning import VersionPinning
 
 
 def _get_api_version_dependency(api_version_header_name: str, version_example: str):
@@ -29,7 +35,18 @@ def _get_api_version_dependency(api_version_header_name: str, version_example: s
     return api_version_dependency
 
 
-class HeaderVersioningMiddleware(BaseHTTPMiddleware):
+class HeaderVersioningMiddleware:
+    """
+    A pure ASGI middleware that validates the version header, sets `api_version_var` and adds the
+    version header to the response.
+
+    If the request has no version header and version_pinning picks a version for its client, the request
+    gets that version as its header so it's routed exactly like a request that sent it.
+
+    It doesn't use BaseHTTPMiddleware to avoid the overhead of its task group and memory streams
+    which also allows the responses to be streamed as is.
+    """
+
     def __init__(
         self,
         app: ASGIApp,
@@ -37,46 +54,122 @@ class HeaderVersioningMiddleware(BaseHTTPMiddleware):
         api_version_header_name: str,
         api_version_var: ContextVar[date] | ContextVar[date | None],
         default_response_class: type[Response] = JSONResponse,
-        dispatch: DispatchFunction | None = None,
+        cache_size: int = 1024,
+        instrumentation: RoutingInstrumentation | None = None,
+        version_pinning: "VersionPinning | None" = None,
     ) -> None:
-        super().__init__(app, dispatch)
+        self.app = app
         self.api_version_header_name = api_version_header_name
         self.api_version_var = api_version_var
         self.default_response_class = default_response_class
+        self.cache_size = cache_size
+        self.instrumentation = instrumentation
+        self.version_pinning = version_pinning
+        self._api_version_header_name_bytes = api_version_header_name.lower().encode()
+        # raw header value -> (parsed version, encoded version for the response header)
+        self._parsed_versions: dict[bytes, tuple[date, bytes]] = {}
         # We use the dependant to apply fastapi's validation to the header, making validation at middleware level
-        # consistent with validation and route level.
+        # consistent with validation and route level. It's only used when the header is not a valid YYYY-MM-DD date
+        # so the error body and the edge cases are exactly the same as fastapi's.
         self.version_header_validation_dependant = get_dependant(
             path="",
             call=_get_api_version_dependency(api_version_header_name, "2000-08-23"),
         )
 
-    async def dispatch(
-        self,
-        request: Request,
-        call_next: RequestResponseEndpoint,
-    ):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         # We handle api version at middleware level because if we try to add a Dependency to all routes, it won't work:
         # we use this header for routing so the user will simply get a 404 if the header is invalid.
-        api_version: date | None
-        if self.api_version_header_name in request.headers:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if self.instrumentation is None:
+            return await self._handle(scope, receive, send, None)
+
+        record = scope[ROUTING_RECORD_SCOPE_KEY] = RoutingRecord()
+        if self.instrumentation.server_timing:
+            send = with_server_timing(send, record)
+        try:
+            await self._handle(scope, receive, send, record)
+        finally:
+            self.instrumentation.on_request(record)
+
+    async def _handle(self, scope: Scope, receive: Receive, send: Send, record: RoutingRecord | None) -> None:
+        start = 0 if record is None else perf_counter_ns()
+        header_value = await self._get_version_header(scope)
+        if header_value is None:
+            if record is not None:
+                record.validate_ns = perf_counter_ns() - start
+            return await self.app(scope, receive, send)
+
+        parsed_version = self._parsed_versions.get(header_value)
+        if parsed_version is None:
+            parsed_version, errors = await self._parse_version(scope, header_value)
+            if parsed_version is None:
+                if record is not None:
+                    record.requested_version = header_value.decode("latin-1")
+                    record.validate_ns = perf_counter_ns() - start
+                response = self.default_response_class(status_code=422, content=_normalize_errors(errors))
+                return await response(scope, receive, send)
+        if record is not None:
+            record.validate_ns = perf_counter_ns() - start
+        api_version, encoded_api_version = parsed_version
+        self.api_version_var.set(api_version)
+        if encoded_api_version != header_value:
+            # fastapi accepts more formats than YYYY-MM-DD so we normalize the header for the routing
+            scope["headers"] = [
+                (name, encoded_api_version if name == self._api_version_header_name_bytes else value)
+                for name, value in scope["headers"]
+            ]
+
+        async def send_with_api_version(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # We return it because we will be returning the **matched** version, not the requested one.
+                message["headers"] = [
+                    *(header for header in message.get("headers", ()) if header[0].lower() != header_name),
+                    (header_name, encoded_api_version),
+                ]
+            await send(message)
+
+        header_name = self._api_version_header_name_bytes
+        return await self.app(scope, receive, send_with_api_version)
+
+    async def _get_version_header(self, scope: Scope) -> bytes | None:
+        header_value = self._find_version_header(scope)
+        if header_value is None and self.version_pinning is not None:
+            return await self._pin_version(scope, self.version_pinning)
+        return header_value
+
+    async def _pin_version(self, scope: Scope, version_pinning: "VersionPinning") -> bytes | None:
+        pinned_version = await version_pinning.resolve(scope)
+        if pinned_version is None:
+            return None
+        header_value = pinned_version.isoformat().encode()
+        scope[PINNED_VERSION_SCOPE_KEY] = pinned_version
+        scope["headers"] = [*scope["headers"], (self._api_version_header_name_bytes, header_value)]
+        return header_value
+
+    def _find_version_header(self, scope: Scope) -> bytes | None:
+        for name, value in scope["headers"]:
+            if name == self._api_version_header_name_bytes:
+                return value
+        return None
+
+    async def _parse_version(self, scope: Scope, header_value: bytes) -> tuple[tuple[date, bytes] | None, list[Any]]:
+        api_version = parse_iso_date(header_value)
+        if api_version is not None:
+            parsed_version = (api_version, header_value)
+        else:
+            # Anything that is not a valid YYYY-MM-DD date gets validated by fastapi for the sake of its error format
             async with AsyncExitStack() as async_exit_stack:
                 solved_result = await solve_dependencies(
-                    request=request,
+                    request=Request(scope),
                     dependant=self.version_header_validation_dependant,
                     async_exit_stack=async_exit_stack,
                 )
             values, errors, *_ = solved_result
             if errors:
-                return self.default_response_class(status_code=422, content=_normalize_errors(errors))
+                return None, errors
             api_version = cast(date, values[self.api_version_header_name.replace("-", "_")])
-            self.api_version_var.set(api_version)
-        else:
-            api_version = None
-
-        response = await call_next(request)
-
-        if api_version is not None:
-            # We return it because we will be returning the **matched** version, not the requested one.
-            response.headers[self.api_version_header_name] = api_version.isoformat()
+            parsed_version = (api_version, api_version.isoformat().encode())
 
-        return response
+        set_bounded(self._parsed_versions, header_value, parsed_version, self.cache_size)
+        return parsed_version, []
@@ -0,0 +1,264 @@
+import copy
+import gzip
+import hashlib
+import json
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from datetime import date
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from fastapi.openapi.constants import REF_PREFIX
+from fastapi.openapi.utils import validation_error_definition, validation_error_response_definition
+from fastapi.routing import APIRoute
+from starlette.routing import BaseRoute
+
+from ._memory import approximate_size, approximate_tree_size
+from .content_store import ContentStore
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+if TYPE_CHECKING:
+    from .routing import RootHeaderAPIRouter
+
+UNVERSIONED = "unversioned"
+HTTP_422 = "422"
+_VALIDATION_ERROR_RESPONSE = {
+    "description": "Validation Error",
+    "content": {"application/json": {"schema": {"$ref": REF_PREFIX + "HTTPValidationError"}}},
+}
+
+
+class EncodedOpenAPI(NamedTuple):
+    """The serialized openapi of a version along with its compressed variants"""
+
+    # content-coding (as in the Content-Encoding header) -> (body, etag)
+    bodies: dict[str, tuple[bytes, str]]
+
+    @classmethod
+    def from_openapi(cls, openapi: dict[str, Any]) -> "EncodedOpenAPI":
+        # same serialization as in starlette's JSONResponse
+        body = json.dumps(openapi, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+        content_hash = hashlib.sha256(body).hexdigest()[:32]
+        # Strong etags must differ between content-codings of the same document
+        bodies = {
+            "identity": (body, f'"{content_hash}"'),
+            "gzip": (gzip.compress(body, compresslevel=9, mtime=0), f'"{content_hash}-gzip"'),
+        }
+        if brotli is not None:  # pragma: no cover
+            bodies["br"] = (brotli.compress(body), f'"{content_hash}-br"')
+        return cls(bodies)
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """Pick the smallest content-coding acceptable according to the Accept-Encoding header"""
+        accepted = _parse_accept_encoding(accept_encoding)
+        for coding in ("br", "gzip"):
+            if coding in self.bodies and accepted.get(coding, accepted.get("*", 0)) > 0:
+                return coding
+        return "identity"
+
+    def matches(self, if_none_match: str) -> bool:
+        """Whether any of the etags of the If-None-Match header points to this document"""
+        if if_none_match.strip() == "*":
+            return True
+        etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+        return any(etag in etags for _, etag in self.bodies.values())
+
+
+def _parse_accept_encoding(accept_encoding: str) -> dict[str, float]:
+    accepted: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+class OpenAPISharingReport(NamedTuple):
+    # openapi version -> the bytes its openapi saves by sharing identical parts within itself and with the earlier
+    # versions. Every shared part is counted as saved by all the versions that use it except for the first one
+    bytes_saved_per_version: dict[str, int]
+    # the bytes that all generated openapis would take if they didn't share anything
+    approximate_bytes_without_sharing: int
+    approximate_bytes: int
+
+    @property
+    def approximate_bytes_saved(self) -> int:
+        return self.approximate_bytes_without_sharing - self.approximate_bytes
+
+
+class OpenAPIStore(Mapping[str, dict[str, Any]]):
+    """
+    A lazy dict[openapi_version, openapi_json] of all versions of the app.
+
+    The openapi of a version is only generated when it's requested for the first time and then cached
+    until the routes of that version change. The cached openapis are interned into a ContentStore, so the schemas,
+    path items and any other subtrees that are identical between versions are only kept once. That's also why
+    the openapis must never be mutated.
+    """
+
+    def __init__(
+        self,
+        router: "RootHeaderAPIRouter",
+        generate_openapi: Callable[[Sequence[BaseRoute]], dict[str, Any]],
+    ) -> None:
+        self.router = router
+        self.generate_openapi = generate_openapi
+        self._openapis: dict[str, dict[str, Any]] = {}
+        self._encoded_openapis: dict[str, EncodedOpenAPI] = {}
+        self._content_store = ContentStore()
+
+    def get_routes(self, version: str) -> Sequence[BaseRoute] | None:
+        routing_table = self.router.routing_table
+        if version == UNVERSIONED:
+            if any(_is_in_schema(route) for route in routing_table.unversioned_routes):
+                return routing_table.unversioned_routes
+            return None
+        try:
+            parsed_version = date.fromisoformat(version)
+        except (ValueError, TypeError):
+            return None
+        if not routing_table.has_version(parsed_version):
+            return None
+        return routing_table.get_version_routes(parsed_version)
+
+    def invalidate(self, version: str | None = None) -> None:
+        """Drop the cached openapi of the version or of all versions if version is None"""
+        if version is None:
+            self._openapis.clear()
+            self._encoded_openapis.clear()
+            self._content_store.clear()
+        else:
+            openapi = self._openapis.pop(version, None)
+            if openapi is not None:
+                self._encoded_openapis.pop(version, None)
+                self._content_store.release(openapi)
+
+    def get_generated(self, version: str) -> dict[str, Any] | None:
+        """Return the openapi of the version if it was already generated, without generating it"""
+        return self._openapis.get(version)
+
+    def get_encoded(self, version: str) -> EncodedOpenAPI:
+        """Return the openapi of the version serialized once and compressed with every supported content-coding"""
+        encoded = self._encoded_openapis.get(version)
+        if encoded is None:
+            encoded = self._encoded_openapis[version] = EncodedOpenAPI.from_openapi(self[version])
+        return encoded
+
+    def __getitem__(self, version: str) -> dict[str, Any]:
+        openapi = self._openapis.get(version)
+        if openapi is None:
+            routes = self.get_routes(version)
+            if routes is None:
+                raise KeyError(version)
+            openapi = self.generate_openapi(routes)
+            if version != UNVERSIONED:
+                _add_version_header_parameter(openapi, self.router.api_version_header_name, version)
+            openapi = self._openapis[version] = self._content_store.intern(openapi)
+        return openapi
+
+    def get_sharing_report(self) -> OpenAPISharingReport:
+        """
+        Report how many bytes the generated openapis save by sharing their identical parts.
+
+        Only the openapis that were already generated are counted, so call enrich_swagger of the app first
+        to report on every version.
+        """
+        bytes_saved_per_version: dict[str, int] = {}
+        bytes_without_sharing = total_bytes = 0
+        seen: set[int] = set()
+        for version in self:
+            openapi = self._openapis.get(version)
+            if openapi is None:
+                continue
+            size_without_sharing = approximate_tree_size(openapi)
+            # the parts shared with the earlier versions were already counted for them
+            size = approximate_size(openapi, seen)
+            bytes_saved_per_version[version] = size_without_sharing - size
+            bytes_without_sharing += size_without_sharing
+            total_bytes += size
+        return OpenAPISharingReport(bytes_saved_per_version, bytes_without_sharing, total_bytes)
+
+    def __iter__(self) -> Iterator[str]:
+        if self.get_routes(UNVERSIONED) is not None:
+            yield UNVERSIONED
+        for version in self.router.sorted_versions:
+            yield version.isoformat()
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __contains__(self, version: object) -> bool:
+        return isinstance(version, str) and self.get_routes(version) is not None
+
+
+def _add_version_header_parameter(openapi: dict[str, Any], api_version_header_name: str, version: str) -> None:
+    """
+    Document the version header in every operation of a version exactly like fastapi would document
+    a `Header` dependency with the version as its example and default, right after the path and query parameters.
+
+    Versioned routes don't have such a dependency because the header is validated by the middleware
+    and resolved by the router once per request.
+    """
+    header_parameter = {
+        "name": api_version_header_name,
+        "in": "header",
+        "required": False,
+        "schema": {
+            "type": "string",
+            "format": "date",
+            "examples": [version],
+            "default": version,
+            "title": api_version_header_name.title(),
+        },
+    }
+    validation_error_is_documented = False
+    for path_item in openapi.get("paths", {}).values():
+        for method in path_item:
+            if "parameters" not in path_item[method]:
+                path_item[method] = _with_empty_parameters(path_item[method])
+            operation = path_item[method]
+            parameters = operation["parameters"]
+            if not any(p["in"] == "header" and p["name"].lower() == api_version_header_name for p in parameters):
+                position = sum(1 for parameter in parameters if parameter["in"] in ("path", "query"))
+                parameters.insert(position, copy.deepcopy(header_parameter))
+            responses = operation.setdefault("responses", {})
+            if not any(status in responses for status in (HTTP_422, "4XX", "default")):
+                responses[HTTP_422] = copy.deepcopy(_VALIDATION_ERROR_RESPONSE)
+                validation_error_is_documented = True
+
+    schemas = openapi.setdefault("components", {}).setdefault("schemas", {})
+    if validation_error_is_documented and "ValidationError" not in schemas:
+        schemas["ValidationError"] = validation_error_definition
+        schemas["HTTPValidationError"] = validation_error_response_definition
+        openapi["components"]["schemas"] = dict(sorted(schemas.items()))
+    if not openapi["components"]["schemas"]:
+        del openapi["components"]["schemas"]
+    if not openapi["components"]:
+        del openapi["components"]
+
+
+def _with_empty_parameters(operation: dict[str, Any]) -> dict[str, Any]:
+    # keep the same key order as fastapi so that the serialized openapi doesn't change
+    with_parameters: dict[str, Any] = {}
+    for key, value in operation.items():
+        if key in ("requestBody", "callbacks", "responses") and "parameters" not in with_parameters:
+            with_parameters["parameters"] = []
+        with_parameters[key] = value
+    with_parameters.setdefault("parameters", [])
+    return with_parameters
+
+
+def _is_in_schema(route: BaseRoute) -> bool:
+    return isinstance(route, APIRoute) and route.include_in_schema
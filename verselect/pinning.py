@@ -0,0 +1,183 @@
+import abc
+import asyncio
+import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import closing, contextmanager
+from datetime import date
+from logging import getLogger
+from pathlib import Path
+
+from starlette.types import Scope
+
+logger = getLogger(__name__)
+
+
+class _CachedPin:
+    __slots__ = ("expires_at", "version")
+
+    def __init__(self, version: date | None, expires_at: float) -> None:
+        self.version = version
+        self.expires_at = expires_at
+
+
+class VersionPinning(abc.ABC):
+    """
+    Picks the version of the requests that have no version header from the client that sent them.
+
+    Subclass it and implement `load_pinned_version` to look the version up in your storage. By default the client
+    is identified by the value of the `client_id_header` header; override `get_client_id` to identify it by
+    anything else in the scope, like the subject of its TLS client certificate.
+
+    The pinned versions are cached in-process for `ttl` seconds (at most `cache_size` clients, least recently used
+    are evicted first). Only the first request of a client waits for the lookup: an expired version is still used
+    while a single background lookup refreshes it, and concurrent lookups of the same client are coalesced.
+    A failed lookup is only retried after `failure_ttl` seconds: until then the client keeps its previous version
+    or gets no version at all if it had none.
+    """
+
+    def __init__(
+        self,
+        *,
+        client_id_header: str = "x-api-key",
+        ttl: float = 60.0,
+        failure_ttl: float = 5.0,
+        cache_size: int = 10_000,
+    ) -> None:
+        self.client_id_header = client_id_header
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.cache_size = cache_size
+        self._client_id_header_bytes = client_id_header.lower().encode()
+        self._cache: OrderedDict[str, _CachedPin] = OrderedDict()
+        # client id -> its in-flight lookup
+        self._lookups: dict[str, asyncio.Task[date | None]] = {}
+
+    def get_client_id(self, scope: Scope) -> str | None:
+        for name, value in scope["headers"]:
+            if name == self._client_id_header_bytes:
+                return value.decode("latin-1")
+        return None
+
+    @abc.abstractmethod
+    async def load_pinned_version(self, client_id: str) -> date | None:
+        """Return the version pinned for the client or None if it has none"""
+
+    async def resolve(self, scope: Scope) -> date | None:
+        """Return the version pinned for the client of the request or None if it has none"""
+        client_id = self.get_client_id(scope)
+        if client_id is None:
+            return None
+        cached = self._cache.get(client_id)
+        if cached is None:
+            return await self._lookup(client_id)
+        self._cache.move_to_end(client_id)
+        if cached.expires_at <= time.monotonic() and client_id not in self._lookups:
+            self._start_lookup(client_id)
+        return cached.version
+
+    def invalidate(self, client_id: str | None = None) -> None:
+        """Forget the cached version of the client or of all clients if client_id is None"""
+        if client_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(client_id, None)
+
+    async def _lookup(self, client_id: str) -> date | None:
+        lookup = self._lookups.get(client_id)
+        if lookup is None:
+            lookup = self._start_lookup(client_id)
+        # shielded so that a cancelled request doesn't cancel the lookup that other requests are waiting for
+        return await asyncio.shield(lookup)
+
+    def _start_lookup(self, client_id: str) -> "asyncio.Task[date | None]":
+        lookup = self._lookups[client_id] = asyncio.create_task(self._load_and_cache(client_id))
+        return lookup
+
+    async def _load_and_cache(self, client_id: str) -> date | None:
+        try:
+            version = await self.load_pinned_version(client_id)
+        except Exception:
+            logger.exception("Failed to load the pinned version of a client")
+            # keep serving the version we already know, if any
+            cached = self._cache.get(client_id)
+            version = None if cached is None else cached.version
+            self._cache_pin(client_id, version, self.failure_ttl)
+        else:
+            self._cache_pin(client_id, version, self.ttl)
+        finally:
+            del self._lookups[client_id]
+        return version
+
+    def _cache_pin(self, client_id: str, version: date | None, ttl: float) -> None:
+        self._cache[client_id] = _CachedPin(version, time.monotonic() + ttl)
+        self._cache.move_to_end(client_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+class SQLiteVersionPinning(VersionPinning):
+    """
+    Loads the pinned versions from a table of a local SQLite database:
+
+        CREATE TABLE version_pins (client_id TEXT PRIMARY KEY, version TEXT NOT NULL)
+
+    The lookups run in a thread so they never block the event loop.
+    """
+
+    def __init__(
+        self,
+        database: str | Path,
+        *,
+        table: str = "version_pins",
+        client_id_header: str = "x-api-key",
+        ttl: float = 60.0,
+        failure_ttl: float = 5.0,
+        cache_size: int = 10_000,
+    ) -> None:
+        if not table.isidentifier():
+            raise ValueError("table should be a valid identifier")
+        super().__init__(
+            client_id_header=client_id_header,
+            ttl=ttl,
+            failure_ttl=failure_ttl,
+            cache_size=cache_size,
+        )
+        self.database = database
+        self.table = table
+
+    def create_table(self) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} (client_id TEXT PRIMARY KEY, version TEXT NOT NULL)",
+            )
+
+    def pin(self, client_id: str, version: str | None) -> None:
+        """Pin the client to the version (or unpin it if version is None) and forget its cached version"""
+        with self._connect() as connection:
+            if version is None:
+                connection.execute(f"DELETE FROM {self.table} WHERE client_id = ?", (client_id,))  # noqa: S608
+            else:
+                connection.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (client_id, version) VALUES (?, ?)",  # noqa: S608
+                    (client_id, date.fromisoformat(version).isoformat()),
+                )
+        self.invalidate(client_id)
+
+    async def load_pinned_version(self, client_id: str) -> date | None:
+        return await asyncio.to_thread(self._load_pinned_version, client_id)
+
+    def _load_pinned_version(self, client_id: str) -> date | None:
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT version FROM {self.table} WHERE client_id = ?",  # noqa: S608
+                (client_id,),
+            ).fetchone()
+        return None if row is None else date.fromisoformat(row[0])
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # sqlite3 connections can't be shared between threads so every lookup opens its own
+        with closing(sqlite3.connect(self.database)) as connection, connection:
+            yield connection
@@ -0,0 +1,150 @@
+import cProfile
+import hmac
+import pstats
+import random
+from collections.abc import Coroutine, Generator, Iterable
+from datetime import date
+from typing import Any
+
+from starlette.routing import BaseRoute
+from starlette.types import Receive, Scope, Send
+
+from .usage import _format_route, _format_version
+
+
+class RequestProfiler:
+    """
+    Profiles the handling of a fraction of the requests and aggregates the profiles per (version, route).
+
+    Pass an instance of it to HeaderRoutingFastAPI(profiler=...) to enable the profiling. A request is profiled if
+    it sends `trigger_header` with `trigger_token` as its value or, otherwise, with the probability of `sample_rate`
+    if its resolved version is one of `versions` and the path of its route is one of `paths` (None means any).
+    When no profiler is passed, routing checks a single attribute per request.
+
+    The profiling is deterministic (cProfile) and bound to the task of the request: the profiler is only enabled
+    while the coroutine of the request is running, so the other requests that run on the event loop meanwhile
+    are not counted. Sync endpoints and anything else that runs in other threads or tasks is only counted as
+    the time the request spent waiting for it.
+    """
+
+    def __init__(
+        self,
+        *,
+        sample_rate: float = 0.01,
+        versions: Iterable[str] | None = None,
+        paths: Iterable[str] | None = None,
+        trigger_header: str = "x-verselect-profile",
+        trigger_token: str | None = None,
+    ) -> None:
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate should be between 0 and 1")
+        self.sample_rate = sample_rate
+        self.versions = None if versions is None else frozenset(map(date.fromisoformat, versions))
+        self.paths = None if paths is None else frozenset(paths)
+        self.trigger_header = trigger_header
+        self.trigger_token = trigger_token
+        self._trigger_header_bytes = trigger_header.lower().encode()
+        self._trigger_token_bytes = None if trigger_token is None else trigger_token.encode()
+        # (formatted version, formatted route) -> the aggregated profile of its requests
+        self.profiles: dict[tuple[str, str], RouteProfile] = {}
+
+    def should_profile(self, scope: Scope, version: date | None, route: BaseRoute) -> bool:
+        if self._trigger_token_bytes is not None:
+            for name, value in scope["headers"]:
+                if name == self._trigger_header_bytes:
+                    # the token is a secret so it's compared in constant time
+                    return hmac.compare_digest(value, self._trigger_token_bytes)
+        if self.versions is not None and version not in self.versions:
+            return False
+        if self.paths is not None and getattr(route, "path", None) not in self.paths:
+            return False
+        return random.random() < self.sample_rate  # noqa: S311
+
+    async def handle(self, route: BaseRoute, version: date | None, scope: Scope, receive: Receive, send: Send) -> None:
+        """Let the route handle the request, profiling it if it should be profiled"""
+        if not self.should_profile(scope, version, route):
+            return await route.handle(scope, receive, send)
+        profile = cProfile.Profile()
+        try:
+            await _ProfiledCoroutine(route.handle(scope, receive, send), profile)
+        finally:
+            key = (_format_version(version), _format_route(route))
+            route_profile = self.profiles.get(key)
+            if route_profile is None:
+                route_profile = self.profiles[key] = RouteProfile()
+            route_profile.add(profile)
+
+    def snapshot(self, *, limit: int = 20) -> dict[str, dict[str, Any]]:
+        """Return the `limit` functions with the largest cumulative time of every (version, route)"""
+        snapshot: dict[str, dict[str, Any]] = {}
+        for (version, route), route_profile in self.profiles.items():
+            snapshot.setdefault(version, {})[route] = route_profile.snapshot(limit=limit)
+        return snapshot
+
+    def reset(self) -> None:
+        self.profiles.clear()
+
+
+class RouteProfile:
+    """The profiles of the requests of a single (version, route) merged together"""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.stats: pstats.Stats | None = None
+
+    def add(self, profile: cProfile.Profile) -> None:
+        self.requests += 1
+        profile.create_stats()
+        if not profile.stats:  # type: ignore[attr-defined]
+            return
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+
+    def snapshot(self, *, limit: int) -> dict[str, Any]:
+        functions = []
+        if self.stats is not None:
+            stats: dict[tuple[str, int, str], tuple[int, int, float, float, Any]]
+            stats = self.stats.stats  # type: ignore[attr-defined]
+            slowest = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+            for (filename, line, name), (primitive_calls, calls, total_time, cumulative_time, _) in slowest:
+                functions.append(
+                    {
+                        "function": f"{filename}:{line}({name})",
+                        "calls": calls,
+                        "primitive_calls": primitive_calls,
+                        "total_seconds": total_time,
+                        "cumulative_seconds": cumulative_time,
+                    },
+                )
+        return {"requests": self.requests, "functions": functions}
+
+
+class _ProfiledCoroutine:
+    """Runs the coroutine with the profile enabled only while the coroutine itself is running"""
+
+    def __init__(self, coroutine: Coroutine[Any, Any, Any], profile: cProfile.Profile) -> None:
+        self.coroutine = coroutine
+        self.profile = profile
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        value: Any = None
+        error: BaseException | None = None
+        try:
+            while True:
+                self.profile.enable()
+                try:
+                    yielded = self.coroutine.send(value) if error is None else self.coroutine.throw(error)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    self.profile.disable()
+                try:
+                    value = yield yielded
+                    error = None
+                except BaseException as e:  # noqa: BLE001
+                    # passed to the coroutine as is, including the cancellation of the task
+                    value, error = None, e
+        finally:
+            self.coroutine.close()
@@ -0,0 +1,295 @@
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Sequence
+from datetime import date
+from typing import Any, NamedTuple, TypeVar
+from urllib.parse import parse_qsl
+
+from starlette.routing import BaseRoute
+from starlette.types import Message, Receive, Scope, Send
+
+from ._capture import capture_response
+from .utils import CREDENTIAL_HEADERS
+
+_EndpointT = TypeVar("_EndpointT", bound=Callable[..., Any])
+# (resolved version, compiled routes, method, path)
+_ResourceKey = tuple[date | None, object, str, str]
+
+# The attribute of the endpoints that cache_response marks as cacheable
+_CACHE_POLICY_ATTRIBUTE = "__verselect_cache_policy__"
+_CACHEABLE_STATUS_CODES = frozenset({200})
+_UNCACHEABLE_CACHE_CONTROL_DIRECTIVES = frozenset({"no-store", "no-cache", "private"})
+
+
+class CachePolicy(NamedTuple):
+    ttl: float
+    # the names of the query params that are a part of the key or None if the whole query string is
+    query_params: frozenset[str] | None
+    # the names of the request headers that are a part of the key (lowercase)
+    vary: tuple[str, ...]
+
+
+def cache_response(
+    *,
+    ttl: float,
+    query_params: Sequence[str] | None = None,
+    vary: Sequence[str] = (),
+) -> Callable[[_EndpointT], _EndpointT]:
+    """
+    Mark the endpoint so that the ResponseCache of the app caches its successful GET responses for ttl seconds.
+
+    The responses are cached per resolved version, path, query params (only the given ones if query_params is not
+    None), credentials (the `Authorization` and `Cookie` headers) and the values of the request headers in vary
+    along with the headers in the `Vary` of the response. So the endpoint should return the same response for
+    every request that shares these. A cached response is served before the route is matched and before its
+    dependencies run, so it's only served to requests with exactly the same credentials as the request that
+    got it. Apply it below the route decorator:
+
+        @router.get("/countries")
+        @cache_response(ttl=300, query_params=["lang"])
+        async def get_countries(lang: str = "en"): ...
+    """
+
+    def decorator(endpoint: _EndpointT) -> _EndpointT:
+        policy = CachePolicy(
+            ttl,
+            None if query_params is None else frozenset(query_params),
+            tuple(header.lower() for header in vary),
+        )
+        setattr(endpoint, _CACHE_POLICY_ATTRIBUTE, policy)
+        return endpoint
+
+    return decorator
+
+
+class CachedResponse:
+    __slots__ = ("body", "created_at", "expires_at", "headers", "route", "size", "status", "version")
+
+    def __init__(
+        self,
+        status: int,
+        headers: list[tuple[bytes, bytes]],
+        body: bytes,
+        route: BaseRoute | None,
+        version: date | None,
+        expires_at: float,
+    ) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.route = route
+        self.version = version
+        self.created_at = time.monotonic()
+        self.expires_at = expires_at
+        self.size = len(body) + sum(len(name) + len(value) for name, value in headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        age = str(int(time.monotonic() - self.created_at)).encode()
+        await send({"type": "http.response.start", "status": self.status, "headers": [*self.headers, (b"age", age)]})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class _CachedResource:
+    """The cached responses of a single (version, routes, method, path) along with how they vary"""
+
+    __slots__ = ("policy", "response_vary", "variants")
+
+    def __init__(self, policy: CachePolicy, response_vary: tuple[str, ...]) -> None:
+        self.policy = policy
+        # the names of the request headers from the Vary header of the responses
+        self.response_vary = response_vary
+        self.variants: dict[Hashable, CachedResponse] = {}
+
+
+class ResponseCache:
+    """
+    An in-memory cache of the responses of the endpoints marked with `cache_response`.
+
+    Pass an instance of it to HeaderRoutingFastAPI(response_cache=...). The router looks the request up by its
+    resolved version before matching any route, so a hit skips the route matching and the endpoint. The responses
+    are dropped after the ttl of their endpoint or, least recently used first, once there are more than
+    max_entries of them or they take more than max_bytes. A response that is larger than max_entry_bytes,
+    sets a cookie or forbids caching with `Cache-Control` is never cached.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_entry_bytes: int = 1024 * 1024,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # (version, compiled routes, method, path) -> its cached responses. The routes are a part of the key
+        # so that the responses of unversioned routes, pinned clients and changed versions never get mixed up
+        self._resources: dict[_ResourceKey, _CachedResource] = {}
+        # (resource key, variant key) in the order of their use
+        self._entries: OrderedDict[tuple[_ResourceKey, Hashable], None] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, scope: Scope, version: date | None, routes: object) -> CachedResponse | None:
+        """Return the cached response for the request or None if there's none"""
+        if scope["method"] != "GET":
+            return None
+        key: _ResourceKey = (version, routes, scope["method"], scope["path"])
+        resource = self._resources.get(key)
+        if resource is None:
+            self.misses += 1
+            return None
+        variant_key = _get_variant_key(scope, resource.policy, resource.response_vary)
+        response = resource.variants.get(variant_key)
+        if response is None:
+            self.misses += 1
+            return None
+        if response.expires_at <= time.monotonic():
+            self._remove(key, variant_key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end((key, variant_key))
+        self.hits += 1
+        return response
+
+    def capture(self, scope: Scope, version: date | None, routes: object, send: Send) -> Send:
+        """Wrap send so that the response is cached if the endpoint that sends it is cacheable"""
+        if scope["method"] != "GET":
+            return send
+        # the key is taken before the routes get to change the scope
+        key = (version, routes, scope["method"], scope["path"])
+
+        def on_start(start: Message) -> CachePolicy | None:
+            policy: CachePolicy | None = getattr(scope.get("endpoint"), _CACHE_POLICY_ATTRIBUTE, None)
+            if policy is None or not _is_cacheable(start):
+                return None
+            return policy
+
+        def on_complete(policy: CachePolicy, status: int, headers: list[tuple[bytes, bytes]], body: bytes) -> None:
+            self._store(key, scope, version, policy, status, headers, body)
+
+        return capture_response(
+            send,
+            max_body_bytes=self.max_entry_bytes,
+            on_start=on_start,
+            on_complete=on_complete,
+        )
+
+    def invalidate(self, *, version: str | None = None, path: str | None = None) -> None:
+        """Drop the cached responses of the resolved version and path (None means all of them)"""
+        parsed_version = None if version is None else date.fromisoformat(version)
+        for key in list(self._resources):
+            resource_version, _, _, resource_path = key
+            if (version is None or resource_version == parsed_version) and (path is None or resource_path == path):
+                self._remove_resource(key)
+
+    def clear(self) -> None:
+        self._resources.clear()
+        self._entries.clear()
+        self.size = 0
+
+    def _store(
+        self,
+        key: _ResourceKey,
+        scope: Scope,
+        version: date | None,
+        policy: CachePolicy,
+        status: int,
+        headers: list[tuple[bytes, bytes]],
+        body: bytes,
+    ) -> None:
+        response_vary = _get_response_vary(headers)
+        if response_vary is None:
+            return
+        resource = self._resources.get(key)
+        if resource is not None and (resource.policy != policy or resource.response_vary != response_vary):
+            # its responses are keyed by the old policy so they can't be found anymore
+            self._remove_resource(key)
+            resource = None
+        if resource is None:
+            resource = self._resources[key] = _CachedResource(policy, response_vary)
+
+        variant_key = _get_variant_key(scope, policy, response_vary)
+        response = CachedResponse(
+            status,
+            headers,
+            body,
+            scope.get("route"),
+            version,
+            time.monotonic() + policy.ttl,
+        )
+        replaced_response = resource.variants.get(variant_key)
+        if replaced_response is not None:
+            # concurrent misses of the same request
+            self.size -= replaced_response.size
+        resource.variants[variant_key] = response
+        self._entries[(key, variant_key)] = None
+        self._entries.move_to_end((key, variant_key))
+        self.size += response.size
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            self._remove(*next(iter(self._entries)))
+
+    def _remove_resource(self, key: _ResourceKey) -> None:
+        for variant_key in list(self._resources[key].variants):
+            self._remove(key, variant_key)
+
+    def _remove(self, key: _ResourceKey, variant_key: Hashable) -> None:
+        resource = self._resources[key]
+        response = resource.variants.pop(variant_key)
+        del self._entries[(key, variant_key)]
+        self.size -= response.size
+        if not resource.variants:
+            del self._resources[key]
+
+
+def _is_cacheable(start: Message) -> bool:
+    if start["status"] not in _CACHEABLE_STATUS_CODES:
+        return False
+    for name, value in start.get("headers", ()):
+        lowercase_name = name.lower()
+        if lowercase_name == b"set-cookie":
+            return False
+        if lowercase_name == b"cache-control":
+            directives = {directive.strip().split("=")[0] for directive in value.decode("latin-1").lower().split(",")}
+            if not directives.isdisjoint(_UNCACHEABLE_CACHE_CONTROL_DIRECTIVES):
+                return False
+    return True
+
+
+def _get_response_vary(headers: list[tuple[bytes, bytes]]) -> tuple[str, ...] | None:
+    """Return the request headers from the Vary of the response or None if it varies on everything"""
+    vary: set[str] = set()
+    for name, value in headers:
+        if name.lower() == b"vary":
+            vary.update(header.strip().lower() for header in value.decode("latin-1").split(",") if header.strip())
+    if "*" in vary:
+        return None
+    return tuple(sorted(vary))
+
+
+def _get_variant_key(scope: Scope, policy: CachePolicy, response_vary: tuple[str, ...]) -> Hashable:
+    query_string: bytes = scope.get("query_string", b"")
+    if policy.query_params is None:
+        query: Hashable = query_string
+    else:
+        query = tuple(
+            sorted(
+                (name, value)
+                for name, value in parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)
+                if name in policy.query_params
+            ),
+        )
+    request_headers: dict[str, list[bytes]] = {}
+    for name, value in scope["headers"]:
+        request_headers.setdefault(name.decode("latin-1"), []).append(value)
+    return (
+        query,
+        # the dependencies that check the credentials don't run for a cached response
+        tuple(tuple(request_headers.get(header, ())) for header in CREDENTIAL_HEADERS),
+        tuple(tuple(request_headers.get(header, ())) for header in policy.vary),
+        tuple(tuple(request_headers.get(header, ())) for header in response_vary),
+    )
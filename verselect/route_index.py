@@ -0,0 +1,213 @@
+from collections.abc import Iterable, Sequence
+from heapq import merge
+from itertools import chain
+from typing import NamedTuple
+
+from starlette._utils import get_route_path
+from starlette.convertors import (
+    CONVERTOR_TYPES,
+    FloatConvertor,
+    IntegerConvertor,
+    StringConvertor,
+    UUIDConvertor,
+)
+from starlette.routing import PARAM_REGEX, BaseRoute, Mount, Route, WebSocketRoute
+from starlette.types import Scope
+
+from .utils import set_bounded
+
+# Convertors whose regex can never match a "/", so a parameter using them always spans exactly one path segment
+_SINGLE_SEGMENT_CONVERTORS = (StringConvertor, IntegerConvertor, FloatConvertor, UUIDConvertor)
+
+
+class IndexedRoute(NamedTuple):
+    position: int
+    route: BaseRoute
+    # None means that the route accepts any method (or that it's not an http route at all)
+    methods: frozenset[str] | None
+
+
+class _SegmentNode:
+    __slots__ = ("literals", "rest", "terminal", "wildcard")
+
+    def __init__(self) -> None:
+        self.literals: dict[str, _SegmentNode] = {}
+        self.wildcard: _SegmentNode | None = None
+        # routes whose path ends exactly at this node
+        self.terminal: list[IndexedRoute] = []
+        # routes with a multi-segment parameter (like `{path:path}`) starting at this node
+        self.rest: list[IndexedRoute] = []
+
+
+class _PathTable:
+    """
+    A hash map of static paths and a segment trie of parameterized paths.
+
+    The lookup only narrows down the candidates: every candidate still has to be checked using `route.matches`.
+    So the trie is allowed to return false positives but never false negatives.
+    """
+
+    def __init__(self) -> None:
+        self.static: dict[str, list[IndexedRoute]] = {}
+        self.root = _SegmentNode()
+
+    def add(self, path: str, entry: IndexedRoute) -> None:
+        if PARAM_REGEX.search(path) is None:
+            self.static.setdefault(path, []).append(entry)
+            return
+        node = self.root
+        for segment in path.split("/"):
+            params = PARAM_REGEX.findall(segment)
+            if not params:
+                node = node.literals.setdefault(segment, _SegmentNode())
+            elif all(_is_single_segment_param(convertor) for _, convertor in params):
+                if node.wildcard is None:
+                    node.wildcard = _SegmentNode()
+                node = node.wildcard
+            else:
+                node.rest.append(entry)
+                return
+        node.terminal.append(entry)
+
+    def lookup(self, path: str) -> list[Iterable[IndexedRoute]]:
+        found: list[Iterable[IndexedRoute]] = []
+        if path in self.static:
+            found.append(self.static[path])
+        _collect(self.root, path.split("/"), 0, found)
+        return found
+
+
+def _is_single_segment_param(convertor_name: str) -> bool:
+    convertor = CONVERTOR_TYPES.get(convertor_name.lstrip(":") or "str")
+    return isinstance(convertor, _SINGLE_SEGMENT_CONVERTORS)
+
+
+def _collect(node: _SegmentNode, segments: list[str], depth: int, found: list[Iterable[IndexedRoute]]) -> None:
+    if node.rest:
+        found.append(node.rest)
+    if depth == len(segments):
+        if node.terminal:
+            found.append(node.terminal)
+        return
+    literal_child = node.literals.get(segments[depth])
+    if literal_child is not None:
+        _collect(literal_child, segments, depth + 1, found)
+    if node.wildcard is not None:
+        _collect(node.wildcard, segments, depth + 1, found)
+
+
+class RouteIndex:
+    """
+    A compiled version of a list of routes that allows to find the routes that might match a path without
+    running the regex of every single route.
+
+    Only `Route` and `WebSocketRoute` instances get indexed by their path. All other routes (Mount, Host, etc)
+    are always returned as candidates. Candidates are always returned in the order of the original list so
+    the first-match semantics of starlette's router are preserved.
+
+    The index also remembers the requests that matched none of its routes (and whether their path with
+    the trailing slash added or removed matched) so repeated misses, like the ones of scanners, need no matching
+    at all. Since an index never changes, the remembered misses go away together with the index when the routes
+    of the version change. Misses are only remembered when every route matches by the path alone, so
+    routes like Host that match by headers turn it off.
+    """
+
+    def __init__(self, routes: Sequence[BaseRoute], *, misses_cache_size: int = 1024) -> None:
+        self.routes = routes
+        self.size = len(routes)
+        self.misses_cache_size = misses_cache_size
+        self._http = _PathTable()
+        self._websocket = _PathTable()
+        self._fallback: list[IndexedRoute] = []
+        # (scope type, method, root path, path, redirect_slashes) -> whether the path with the slash toggled matched
+        self._misses: dict[tuple[str, str | None, str, str, bool], bool] = {}
+
+        for position, route in enumerate(routes):
+            if isinstance(route, Route):
+                methods = frozenset(route.methods) if route.methods else None
+                self._http.add(route.path, IndexedRoute(position, route, methods))
+            elif isinstance(route, WebSocketRoute):
+                self._websocket.add(route.path, IndexedRoute(position, route, None))
+            else:
+                self._fallback.append(IndexedRoute(position, route, None))
+        # Mounts only match by the path prefix. Anything else (Host or custom routes) can match by anything
+        self.caches_misses = misses_cache_size > 0 and all(isinstance(entry.route, Mount) for entry in self._fallback)
+
+    def is_stale(self, routes: Sequence[BaseRoute]) -> bool:
+        return routes is not self.routes or len(routes) != self.size
+
+    def candidates(self, scope: Scope) -> Iterable[IndexedRoute]:
+        if scope["type"] == "http":
+            table = self._http
+        elif scope["type"] == "websocket":
+            table = self._websocket
+        else:
+            return self._fallback
+        found = table.lookup(get_route_path(scope))
+        if self._fallback:
+            found.append(self._fallback)
+        if not found:
+            return ()
+        if len(found) == 1:
+            return found[0]
+        return merge(*found)
+
+    def get_cached_miss(self, scope: Scope, redirect_slashes: bool) -> bool | None:
+        """
+        Return None if the request is not a remembered miss or whether the path with the trailing slash
+        toggled matched if it is
+        """
+        if not self._misses:
+            return None
+        return self._misses.get(_get_miss_key(scope, redirect_slashes))
+
+    def cache_miss(self, scope: Scope, redirect_slashes: bool, redirects: bool) -> None:
+        if not self.caches_misses:
+            return
+        set_bounded(self._misses, _get_miss_key(scope, redirect_slashes), redirects, self.misses_cache_size)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(routes={self.size})"
+
+
+class ChainedRouteIndex(RouteIndex):
+    """
+    The routes of several indexes one after another, like the routes added for a version followed by the routes
+    of the version ranges that contain it.
+
+    The indexes are shared with every other chain that uses them so the routes are only compiled once no matter
+    how many versions use them. Only the misses are remembered per chain.
+    """
+
+    def __init__(self, indexes: Sequence[RouteIndex], *, misses_cache_size: int = 1024) -> None:
+        self.indexes = tuple(indexes)
+        self.size = sum(len(index) for index in self.indexes)
+        self.misses_cache_size = misses_cache_size
+        self._misses = {}
+        self.caches_misses = misses_cache_size > 0 and all(index.caches_misses for index in self.indexes)
+
+    @property  # type: ignore[override]
+    def routes(self) -> tuple[BaseRoute, ...]:
+        return tuple(route for index in self.indexes for route in index.routes)
+
+    def is_stale(self, routes: Sequence[BaseRoute]) -> bool:
+        return len(routes) != self.size or any(
+            route is not other_route for route, other_route in zip(routes, self.routes, strict=True)
+        )
+
+    def candidates(self, scope: Scope) -> Iterable[IndexedRoute]:
+        return chain.from_iterable(index.candidates(scope) for index in self.indexes)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(routes={self.size}, indexes={len(self.indexes)})"
+
+
+def _get_miss_key(scope: Scope, redirect_slashes: bool) -> tuple[str, str | None, str, str, bool]:
+    return (scope["type"], scope.get("method"), scope.get("root_path", ""), scope["path"], redirect_slashes)
+
+
+# Shared by every routing table and app, so it must not remember the misses of any of them
+EMPTY_ROUTE_INDEX = RouteIndex((), misses_cache_size=0)
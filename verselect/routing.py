@@ -1,10 +1,10 @@
-import bisect
+import threading
 from collections import OrderedDict
-from collections.abc import Sequence
+from collections.abc import Awaitable, Iterator, Mapping, Sequence
+from contextlib import contextmanager
 from datetime import date
-from functools import cached_property
-from logging import getLogger
-from typing import Any
+from time import perf_counter_ns
+from typing import TYPE_CHECKING, Any
 
 from fastapi.routing import APIRouter
 from starlette.datastructures import URL
@@ -12,7 +12,17 @@ from starlette.responses import RedirectResponse
 from starlette.routing import BaseRoute, Match
 from starlette.types import Receive, Scope, Send
 
-logger = getLogger(__name__)
+from .instrumentation import ROUTING_RECORD_SCOPE_KEY, RoutingInstrumentation, RoutingRecord, with_server_timing
+from .route_index import RouteIndex
+from .routing_table import RoutingTable
+from .utils import PINNED_VERSION_SCOPE_KEY
+from .version_ranges import VersionRange, VersionRangeIndex
+
+if TYPE_CHECKING:
+    from .admission import AdmissionControl
+    from .coalescing import RequestCoalescing
+    from .profiling import RequestProfiler
+    from .response_cache import ResponseCache
 
 
 class RootHeaderAPIRouter(APIRouter):
@@ -30,49 +40,141 @@ class RootHeaderAPIRouter(APIRouter):
     matched to the higher versioned route
     """
 
-    def __init__(self, *args: Any, api_version_header_name: str, **kwargs: Any):
+    def __init__(
+        self,
+        *args: Any,
+        api_version_header_name: str,
+        resolved_versions_cache_size: int = 1024,
+        misses_cache_size: int = 1024,
+        instrumentation: RoutingInstrumentation | None = None,
+        profiler: "RequestProfiler | None" = None,
+        response_cache: "ResponseCache | None" = None,
+        request_coalescing: "RequestCoalescing | None" = None,
+        admission_control: "AdmissionControl | None" = None,
+        **kwargs: Any,
+    ):
         super().__init__(*args, **kwargs)
-        self.versioned_routes: dict[date, list[BaseRoute]] = {}
-        self.unversioned_routes: list[BaseRoute] = []
         self.api_version_header_name = api_version_header_name.lower()
+        self.resolved_versions_cache_size = resolved_versions_cache_size
+        self.instrumentation = instrumentation
+        self.profiler = profiler
+        self.response_cache = response_cache
+        self.request_coalescing = request_coalescing
+        self.admission_control = admission_control
+        self._api_version_header_name_bytes = self.api_version_header_name.encode()
+        self.routing_table = RoutingTable(
+            resolved_versions_cache_size=resolved_versions_cache_size,
+            misses_cache_size=misses_cache_size,
+        )
+        # Only serializes the changes of the routing table with each other. Requests never take it
+        self._routing_table_lock = threading.Lock()
+
+    @property
+    def versioned_routes(self) -> Mapping[date, tuple[BaseRoute, ...]]:
+        return self.routing_table.versioned_routes
+
+    @property
+    def ranged_routes(self) -> tuple[VersionRange, ...]:
+        return self.routing_table.ranged_routes
+
+    @property
+    def unversioned_routes(self) -> tuple[BaseRoute, ...]:
+        return self.routing_table.unversioned_routes
+
+    @property
+    def sorted_versioned_routes(self) -> OrderedDict[date, list[BaseRoute]]:
+        return self.routing_table.sorted_versioned_routes
+
+    @property
+    def version_range_index(self) -> VersionRangeIndex:
+        return self.routing_table.version_range_index
 
-    @cached_property
-    def sorted_versioned_routes(self):
-        sorted_routes = sorted(self.versioned_routes.items())
-        return OrderedDict(sorted_routes)
+    @property
+    def sorted_versions(self) -> tuple[date, ...]:
+        """All versions: the versions of versioned_routes and the boundaries of the version ranges"""
+        return self.routing_table.sorted_versions
 
-    @cached_property
-    def min_routes_version(self):
-        return min(self.sorted_versioned_routes.keys())
+    @property
+    def min_routes_version(self) -> date | None:
+        return self.routing_table.min_routes_version
+
+    @contextmanager
+    def _replacing_routing_table(self) -> Iterator[dict[str, Any]]:
+        """
+        Collect the routes to replace and swap in a new routing table built from them.
+
+        The table is built before the swap so the requests keep using the old table until the new one is ready.
+        """
+        with self._routing_table_lock:
+            changes: dict[str, Any] = {}
+            yield changes
+            self.routing_table = self.routing_table.replace(**changes)
+
+    def add_versioned_routes(self, version: date, routes: Sequence[BaseRoute]) -> None:
+        """Add routes to the version, creating the version if it doesn't exist yet"""
+        self.add_many_versioned_routes({version: routes})
+
+    def add_many_versioned_routes(self, routes_by_version: Mapping[date, Sequence[BaseRoute]]) -> None:
+        """Add routes to several versions at once, building the new routing table only once"""
+        routes_by_version = {version: routes for version, routes in routes_by_version.items() if routes}
+        if not routes_by_version:
+            return
+        with self._replacing_routing_table() as changes:
+            versioned_routes = dict(self.routing_table.versioned_routes)
+            for version, routes in routes_by_version.items():
+                versioned_routes[version] = (*versioned_routes.get(version, ()), *routes)
+            changes["versioned_routes"] = versioned_routes
+
+    def remove_version(self, version: date) -> tuple[BaseRoute, ...]:
+        """
+        Remove the version that was added with add_versioned_routes and return its routes.
+
+        Requests for it will be routed to the closest older version from now on. The boundaries of version ranges
+        can't be removed this way.
+        """
+        with self._replacing_routing_table() as changes:
+            versioned_routes = dict(self.routing_table.versioned_routes)
+            removed_routes = versioned_routes.pop(version, ())
+            changes["versioned_routes"] = versioned_routes
+        return removed_routes
+
+    def add_ranged_routes(self, routes: Sequence[BaseRoute], *, since: date, until: date | None = None) -> None:
+        """Add routes that exist in every version from since (inclusive) until until (exclusive)"""
+        if until is not None and until <= since:
+            raise ValueError("until should be later than since")
+        with self._replacing_routing_table() as changes:
+            changes["ranged_routes"] = (*self.routing_table.ranged_routes, VersionRange(since, until, tuple(routes)))
+
+    def add_unversioned_routes(self, routes: Sequence[BaseRoute]) -> None:
+        with self._replacing_routing_table() as changes:
+            changes["unversioned_routes"] = (*self.routing_table.unversioned_routes, *routes)
+
+    def has_version(self, version: date) -> bool:
+        return self.routing_table.has_version(version)
+
+    def get_version_routes(self, version: date) -> tuple[BaseRoute, ...]:
+        """
+        Return the routes of the version: the routes that were added for the closest version that is not newer
+        than it followed by the routes of the version ranges that contain it
+        """
+        return self.routing_table.get_version_routes(version)
 
     def find_closest_date_but_not_new(self, request_version: date):
-        routes = list(self.sorted_versioned_routes.keys())
-        index = bisect.bisect_left(routes, request_version)
-        # as bisect_left returns the index where to insert item x in list a, assuming a is sorted
-        # we need to get the previous item and that will be a match
-        return routes[index - 1]
+        return self.routing_table.find_closest_date_but_not_new(request_version)
 
     def pick_version(
         self,
         request_header_value: date,
-    ) -> list[BaseRoute]:
-        routes = []
-        request_version = request_header_value.isoformat()
-
-        if self.min_routes_version > request_header_value:
-            # then the request version is older that the oldest route we have
-            logger.info(
-                f"Request version {request_version} "
-                f"is older than the oldest "
-                f"version {self.min_routes_version.isoformat()} ",
-            )
-            return routes
-        version_chosen = self.find_closest_date_but_not_new(request_header_value)
-        logger.info(
-            f"Partial match. The endpoint with {version_chosen} "
-            f"version was selected for API call version {request_version}",
-        )
-        return self.versioned_routes[version_chosen]
+    ) -> tuple[BaseRoute, ...]:
+        routing_table = self.routing_table
+        version_chosen = routing_table.resolve_version(request_header_value)
+        if version_chosen is None:
+            return ()
+        return routing_table.get_version_routes(version_chosen)
+
+    def resolve_version(self, request_header_value: date) -> date | None:
+        """Return the version whose routes will serve the request or None if the request is older than all of them"""
+        return self.routing_table.resolve_version(request_header_value)
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
@@ -85,61 +187,229 @@ class RootHeaderAPIRouter(APIRouter):
             await self.lifespan(scope, receive, send)
             return
 
-        request_headers = dict(scope["headers"])
-        header_value = request_headers.get(self.api_version_header_name.encode(), b"").decode()
-        if header_value:
-            header_value = date.fromisoformat(header_value)
+        header_value = b""
+        for name, value in scope["headers"]:
+            if name == self._api_version_header_name_bytes:
+                header_value = value
+                break
 
-        # if header_value is None, then it's an unversioned request and we need to use the unversioned routes
+        # The request uses the same table from start to end even if a new one gets swapped in meanwhile
+        routing_table = self.routing_table
+        if self.instrumentation is not None:
+            await self._call_instrumented(scope, receive, send, header_value, routing_table, self.instrumentation)
+            return
+
+        # if header_value is empty, then it's an unversioned request and we need to use the unversioned routes
         # if there will be a value, we search for the most suitable version
+        version = None
+        if not header_value:
+            routes = routing_table.unversioned_index
+        else:
+            version, routes = routing_table.resolve_header_value(header_value)
+            if PINNED_VERSION_SCOPE_KEY in scope:
+                routes = routing_table.get_pinned_route_index(version)
+        await self._dispatch(scope, receive, send, routes, version)
+
+    async def _call_instrumented(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        header_value: bytes,
+        routing_table: RoutingTable,
+        instrumentation: RoutingInstrumentation,
+    ) -> None:
+        record: RoutingRecord | None = scope.get(ROUTING_RECORD_SCOPE_KEY)
+        # The middleware creates and reports the record but the router can also be used without it
+        owns_record = record is None
+        if record is None:
+            record = scope[ROUTING_RECORD_SCOPE_KEY] = RoutingRecord()
+            if instrumentation.server_timing:
+                send = with_server_timing(send, record)
+
+        record.routed = True
+        start = perf_counter_ns()
         if not header_value:
-            routes = self.unversioned_routes
-        elif header_value in self.versioned_routes:
-            routes = self.versioned_routes[header_value]
+            routes = routing_table.unversioned_index
         else:
-            routes = self.pick_version(request_header_value=header_value)
-        await self.process_request(scope=scope, receive=receive, send=send, routes=routes)
+            record.requested_version = header_value.decode("latin-1")
+            record.cache_hit = routing_table.is_resolved(header_value)
+            record.resolved_version, routes = routing_table.resolve_header_value(header_value)
+            if PINNED_VERSION_SCOPE_KEY in scope:
+                routes = routing_table.get_pinned_route_index(record.resolved_version)
+        record.resolve_ns = perf_counter_ns() - start
+
+        try:
+            await self._dispatch(scope, receive, send, routes, record.resolved_version)
+        finally:
+            if owns_record:
+                instrumentation.on_request(record)
+
+    async def _dispatch(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        routes: RouteIndex,
+        version: date | None,
+        *,
+        admitted: bool = False,
+    ) -> None:
+        """
+        Process the request with the routes once the admission control admits it, serving it from the response
+        cache or from an identical request that is in flight if possible
+        """
+        if self.admission_control is not None and not admitted:
+            return await self._process_admitted_request(scope, receive, send, routes, version, self.admission_control)
+        if self.response_cache is not None or self.request_coalescing is not None:
+            return await self._process_shared_request(scope, receive, send, routes, version)
+        return await self.process_request(scope=scope, receive=receive, send=send, routes=routes, version=version)
 
-    async def process_request(self, scope: Scope, receive: Receive, send: Send, routes: Sequence[BaseRoute]) -> None:
+    async def _process_admitted_request(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        routes: RouteIndex,
+        version: date | None,
+        admission_control: "AdmissionControl",
+    ) -> None:
+        """Process the request once the admission control of its version admits it"""
+
+        def process_request() -> Awaitable[None]:
+            return self._dispatch(scope, receive, send, routes, version, admitted=True)
+
+        await admission_control.handle(scope, receive, send, version, process_request)
+
+    async def _process_shared_request(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        routes: RouteIndex,
+        version: date | None,
+    ) -> None:
+        """
+        Serve the request from the response cache or from the response of an identical request that is in flight
+        if possible, otherwise process it and cache the response if its endpoint allows it
+        """
+        if scope["type"] != "http":
+            return await self.process_request(scope=scope, receive=receive, send=send, routes=routes, version=version)
+        response_cache = self.response_cache
+        if response_cache is not None:
+            cached_response = response_cache.get(scope, version, routes)
+            if cached_response is not None:
+                record: RoutingRecord | None = scope.get(ROUTING_RECORD_SCOPE_KEY)
+                if record is not None:
+                    record.route = cached_response.route
+                return await cached_response(scope, receive, send)
+            send = response_cache.capture(scope, version, routes, send)
+        if self.request_coalescing is None:
+            return await self.process_request(scope=scope, receive=receive, send=send, routes=routes, version=version)
+
+        def process_request(send: Send) -> Awaitable[None]:
+            return self.process_request(scope=scope, receive=receive, send=send, routes=routes, version=version)
+
+        return await self.request_coalescing.handle(scope, send, version, routes, process_request)
+
+    async def process_request(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        routes: RouteIndex | Sequence[BaseRoute],
+        version: date | None = None,
+    ) -> None:
         """
         its a copy-paste from starlette.routing.Router
-        but in this version self.routes were replaced with routes from the function arguments
+        but in this version self.routes were replaced with the routes from the function arguments
+        and only the routes that the index considers to be candidates for the path get matched.
+        version is the version that the routes belong to (None for unversioned routes)
         """
+        if not isinstance(routes, RouteIndex):
+            routes = RouteIndex(routes)
+
+        record: RoutingRecord | None = scope.get(ROUTING_RECORD_SCOPE_KEY)
+        start = 0 if record is None else perf_counter_ns()
+        redirects = routes.get_cached_miss(scope, self.redirect_slashes)
+        if redirects is not None:
+            # the same request has already matched nothing so there's nothing to match again
+            if record is not None:
+                record.match_ns = perf_counter_ns() - start
+                record.routes_scanned = 0
+            redirect_url = URL(scope=_toggle_trailing_slash(scope)) if redirects else None
+            return await self._respond_without_route(scope, receive, send, redirect_url)
 
+        route, child_scope, routes_scanned = self.find_route(scope, routes)
+        redirect_url = None
+        if route is None and scope["type"] == "http" and self.redirect_slashes and scope["path"] != "/":
+            redirect_url = self.find_redirect_slashes_url(scope, routes)
+        if route is None:
+            routes.cache_miss(scope, self.redirect_slashes, redirects=redirect_url is not None)
+        if record is not None:
+            record.match_ns = perf_counter_ns() - start
+            record.routes_scanned = routes_scanned
+            record.route = route
+
+        if route is not None:
+            scope.update(child_scope)
+            if self.profiler is not None:
+                return await self.profiler.handle(route, version, scope, receive, send)
+            return await route.handle(scope, receive, send)
+
+        return await self._respond_without_route(scope, receive, send, redirect_url)
+
+    async def _respond_without_route(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        redirect_url: URL | None,
+    ) -> None:
+        if redirect_url is not None:
+            response = RedirectResponse(url=str(redirect_url))
+            return await response(scope, receive, send)
+        return await self.default(scope, receive, send)
+
+    def find_route(self, scope: Scope, routes: RouteIndex) -> tuple[BaseRoute | None, Scope, int]:
+        """
+        Return the first route that fully matches the scope or, if there's none, the first route that
+        partially matches it along with its child scope and the number of routes whose `matches` was called.
+
+        Partial matches are cases where an endpoint is able to handle the request, but is not a preferred option.
+        We use this in particular to deal with "405 Method Not Allowed".
+        """
         partial = None
         partial_scope = {}
-        for route in routes:
-            # Determine if any route matches the incoming scope,
-            # and hand over to the matching route if found.
+        routes_scanned = 0
+        method = scope.get("method")
+        for _, route, methods in routes.candidates(scope):
+            # A route that doesn't accept the method can only produce a partial match
+            # so there's no need to match it if we have already found one
+            if partial is not None and methods is not None and method not in methods:
+                continue
+            routes_scanned += 1
             match, child_scope = route.matches(scope)
             if match == Match.FULL:
-                scope.update(child_scope)
-                await route.handle(scope, receive, send)
-                return None
+                return route, child_scope, routes_scanned
             if match == Match.PARTIAL and partial is None:
                 partial = route
                 partial_scope = child_scope
+        return partial, partial_scope, routes_scanned
 
-        if partial is not None:
-            #  Handle partial matches. These are cases where an endpoint is
-            # able to handle the request, but is not a preferred option.
-            # We use this in particular to deal with "405 Method Not Allowed".
-            scope.update(partial_scope)
-            return await partial.handle(scope, receive, send)
-
-        if scope["type"] == "http" and self.redirect_slashes and scope["path"] != "/":
-            redirect_scope = dict(scope)
-            if scope["path"].endswith("/"):
-                redirect_scope["path"] = redirect_scope["path"].rstrip("/")
-            else:
-                redirect_scope["path"] = redirect_scope["path"] + "/"
-
-            for route in routes:
-                match, child_scope = route.matches(redirect_scope)
-                if match != Match.NONE:
-                    redirect_url = URL(scope=redirect_scope)
-                    response = RedirectResponse(url=str(redirect_url))
-                    await response(scope, receive, send)
-                    return None
+    def find_redirect_slashes_url(self, scope: Scope, routes: RouteIndex) -> URL | None:
+        redirect_scope = _toggle_trailing_slash(scope)
+        for _, route, _ in routes.candidates(redirect_scope):
+            match, _ = route.matches(redirect_scope)
+            if match != Match.NONE:
+                return URL(scope=redirect_scope)
+        return None
 
-        return await self.default(scope, receive, send)
+
+def _toggle_trailing_slash(scope: Scope) -> Scope:
+    redirect_scope = dict(scope)
+    if scope["path"].endswith("/"):
+        redirect_scope["path"] = redirect_scope["path"].rstrip("/")
+    else:
+        redirect_scope["path"] = redirect_scope["path"] + "/"
+    return redirect_scope
@@ -0,0 +1,267 @@
+import bisect
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from datetime import date
+from functools import cached_property
+from logging import getLogger
+from types import MappingProxyType
+
+from starlette.routing import BaseRoute
+
+from .route_index import EMPTY_ROUTE_INDEX, ChainedRouteIndex, RouteIndex
+from .utils import set_bounded
+from .version_ranges import EMPTY_VERSION_RANGE_INDEX, VersionRange, VersionRangeIndex
+
+logger = getLogger(__name__)
+
+
+class RoutingTable:
+    """
+    An immutable compiled snapshot of the routes of every version.
+
+    RootHeaderAPIRouter reads its current table once per request and never mutates it: every change builds
+    a new table and swaps it in with a single assignment, so in-flight requests never see partial state and
+    the request path needs no locks. The only thing that changes within a table is the bounded cache of resolved
+    header values, which only memoizes what can be computed from the table itself.
+
+    The routes of every version are compiled once and the routes of the version ranges are compiled once per
+    segment of the version range index: a version looks up its own routes and then the ones of its segment.
+    Building a table reuses the compiled indexes of the previous table for the versions and the segments whose
+    routes didn't change, and versions with identical routes share a single index.
+    """
+
+    def __init__(
+        self,
+        *,
+        versioned_routes: Mapping[date, Sequence[BaseRoute]] | None = None,
+        ranged_routes: Sequence[VersionRange] = (),
+        unversioned_routes: Sequence[BaseRoute] = (),
+        resolved_versions_cache_size: int = 1024,
+        misses_cache_size: int = 1024,
+        previous: "RoutingTable | None" = None,
+    ) -> None:
+        self.versioned_routes: Mapping[date, tuple[BaseRoute, ...]] = MappingProxyType(
+            {version: tuple(routes) for version, routes in sorted((versioned_routes or {}).items())},
+        )
+        self.ranged_routes = tuple(ranged_routes)
+        self.unversioned_routes = tuple(unversioned_routes)
+        self.resolved_versions_cache_size = resolved_versions_cache_size
+        self.misses_cache_size = misses_cache_size
+
+        if previous is not None and _are_same_routes(previous.ranged_routes, self.ranged_routes):
+            self.version_range_index = previous.version_range_index
+        elif self.ranged_routes:
+            self.version_range_index = VersionRangeIndex(self.ranged_routes)
+        else:
+            self.version_range_index = EMPTY_VERSION_RANGE_INDEX
+        self.explicit_versions = tuple(self.versioned_routes)
+        self.sorted_versions = tuple(sorted({*self.explicit_versions, *self.version_range_index.boundaries}))
+        self.min_routes_version = self.sorted_versions[0] if self.sorted_versions else None
+
+        self._compile_explicit_versions(previous)
+        if previous is not None and previous.unversioned_routes is self.unversioned_routes:
+            self.unversioned_index = previous.unversioned_index
+        else:
+            self.unversioned_index = RouteIndex(self.unversioned_routes, misses_cache_size=misses_cache_size)
+        # segment of the version range index -> the compiled routes of the ranges active in it. The routes of
+        # a range are compiled once per segment instead of once per version
+        if previous is not None and previous.version_range_index is self.version_range_index:
+            self._indexes_by_ranges = previous._indexes_by_ranges
+            self._segment_indexes = previous._segment_indexes
+        else:
+            self._compile_segments(previous)
+        self._chain_versions(previous)
+
+        # raw header value -> (version that was picked for it, compiled routes of that version)
+        self._resolved_versions: dict[bytes, tuple[date | None, RouteIndex]] = {}
+        # version -> the compiled routes of the version followed by the unversioned routes. Built on first use
+        self._pinned_route_indexes: dict[date, RouteIndex] = {}
+
+    def replace(
+        self,
+        *,
+        versioned_routes: Mapping[date, Sequence[BaseRoute]] | None = None,
+        ranged_routes: Sequence[VersionRange] | None = None,
+        unversioned_routes: Sequence[BaseRoute] | None = None,
+    ) -> "RoutingTable":
+        """Build a new table with the given routes replaced and everything else taken from this table"""
+        return RoutingTable(
+            versioned_routes=self.versioned_routes if versioned_routes is None else versioned_routes,
+            ranged_routes=self.ranged_routes if ranged_routes is None else ranged_routes,
+            unversioned_routes=self.unversioned_routes if unversioned_routes is None else unversioned_routes,
+            resolved_versions_cache_size=self.resolved_versions_cache_size,
+            misses_cache_size=self.misses_cache_size,
+            previous=self,
+        )
+
+    @cached_property
+    def sorted_versioned_routes(self) -> OrderedDict[date, list[BaseRoute]]:
+        """The routes of every version that was added with its own routes, ordered by version. Built on first use"""
+        return OrderedDict((version, list(routes)) for version, routes in self.versioned_routes.items())
+
+    def _compile_explicit_versions(self, previous: "RoutingTable | None") -> None:
+        # ids of the routes -> their compiled index
+        self._indexes_by_routes: dict[tuple[int, ...], RouteIndex] = {}
+        reusable_indexes = {} if previous is None else previous._indexes_by_routes
+        # explicit version -> the ids of its routes, kept so that unchanged versions don't compute them again
+        self._explicit_keys: dict[date, tuple[int, ...]] = {}
+        self._explicit_indexes: dict[date, RouteIndex] = {}
+        for version, routes in self.versioned_routes.items():
+            if previous is not None and previous.versioned_routes.get(version) is routes:
+                key = previous._explicit_keys[version]
+            else:
+                key = tuple(map(id, routes))
+            self._explicit_keys[version] = key
+            # The ids are safe to use as a key because every index keeps references to its routes
+            index = self._indexes_by_routes.get(key)
+            if index is None:
+                index = reusable_indexes.get(key)
+                if index is None:
+                    index = RouteIndex(routes, misses_cache_size=self.misses_cache_size)
+                self._indexes_by_routes[key] = index
+            self._explicit_indexes[version] = index
+
+    def _compile_segments(self, previous: "RoutingTable | None") -> None:
+        # ids of the ranges -> the compiled routes of the ranges. The segments whose ranges didn't change keep
+        # their index and the ids are safe to use because the previous table keeps its ranges alive
+        self._indexes_by_ranges: dict[tuple[int, ...], RouteIndex] = {}
+        reusable_indexes = {} if previous is None else previous._indexes_by_ranges
+        segment_indexes = []
+        for ranges in self.version_range_index.segments:
+            key = tuple(map(id, ranges))
+            index = self._indexes_by_ranges.get(key)
+            if index is None:
+                index = reusable_indexes.get(key)
+                if index is None:
+                    routes = tuple(route for version_range in ranges for route in version_range.routes)
+                    index = RouteIndex(routes, misses_cache_size=self.misses_cache_size)
+                self._indexes_by_ranges[key] = index
+            segment_indexes.append(index)
+        self._segment_indexes = tuple(segment_indexes)
+
+    def _chain_versions(self, previous: "RoutingTable | None") -> None:
+        # ids of the explicit and the segment index -> the index that chains them
+        self._chained_indexes: dict[tuple[int, int], RouteIndex] = {}
+        reusable_indexes = {} if previous is None else previous._chained_indexes
+        # version -> its explicit routes followed by the routes of its ranges
+        self._route_indexes: dict[date, RouteIndex] = {}
+        for version in self.sorted_versions:
+            explicit_index = self._get_explicit_index(version)
+            segment = self.version_range_index.segment_at(version)
+            segment_index = EMPTY_ROUTE_INDEX if segment is None else self._segment_indexes[segment]
+            if not segment_index:
+                index = explicit_index
+            elif not explicit_index:
+                index = segment_index
+            else:
+                # the chain keeps references to both indexes so their ids can't be reused while it exists
+                key = (id(explicit_index), id(segment_index))
+                index = self._chained_indexes.get(key)
+                if index is None:
+                    index = reusable_indexes.get(key)
+                    if index is None:
+                        index = ChainedRouteIndex(
+                            (explicit_index, segment_index),
+                            misses_cache_size=self.misses_cache_size,
+                        )
+                    self._chained_indexes[key] = index
+            self._route_indexes[version] = index
+
+    def _get_explicit_index(self, version: date) -> RouteIndex:
+        index = bisect.bisect_right(self.explicit_versions, version)
+        if not index:
+            return EMPTY_ROUTE_INDEX
+        return self._explicit_indexes[self.explicit_versions[index - 1]]
+
+    def has_version(self, version: date) -> bool:
+        return version in self._route_indexes
+
+    def get_version_routes(self, version: date) -> tuple[BaseRoute, ...]:
+        """
+        Return the routes of the version: the routes that were added for the closest version that is not newer
+        than it followed by the routes of the version ranges that contain it
+        """
+        index = self._route_indexes.get(version)
+        if index is None:
+            return ()
+        return tuple(index.routes)
+
+    def get_route_index(self, version: date | None) -> RouteIndex:
+        """Return the compiled index of the routes of the version (None stands for unversioned routes)"""
+        if version is None:
+            return self.unversioned_index
+        return self._route_indexes.get(version, EMPTY_ROUTE_INDEX)
+
+    def get_pinned_route_index(self, version: date | None) -> RouteIndex:
+        """
+        Return the compiled routes for the requests whose version was pinned for their client: the routes of
+        the version followed by the unversioned routes since the client didn't ask for the version itself
+        """
+        if version is None:
+            return self.unversioned_index
+        index = self._pinned_route_indexes.get(version)
+        if index is None:
+            index = self._pinned_route_indexes[version] = ChainedRouteIndex(
+                (self.get_route_index(version), self.unversioned_index),
+                misses_cache_size=self.misses_cache_size,
+            )
+        return index
+
+    def find_closest_date_but_not_new(self, request_version: date) -> date:
+        routes = self.sorted_versions
+        index = bisect.bisect_right(routes, request_version)
+        # as bisect_right returns the index where to insert item x in list a, assuming a is sorted
+        # we need to get the previous item and that will be a match
+        return routes[index - 1]
+
+    def resolve_version(self, request_header_value: date) -> date | None:
+        """Return the version whose routes will serve the request or None if the request is older than all of them"""
+        if request_header_value in self._route_indexes:
+            return request_header_value
+        if self.min_routes_version is None or self.min_routes_version > request_header_value:
+            # then the request version is older that the oldest route we have
+            logger.info(
+                "Request version %s is older than the oldest version %s",
+                request_header_value,
+                self.min_routes_version,
+            )
+            return None
+        version_chosen = self.find_closest_date_but_not_new(request_header_value)
+        logger.info(
+            "Partial match. The endpoint with %s version was selected for API call version %s",
+            version_chosen,
+            request_header_value,
+        )
+        return version_chosen
+
+    def is_resolved(self, header_value: bytes) -> bool:
+        """Whether the version for the raw value of the version header is already cached"""
+        return header_value in self._resolved_versions
+
+    def resolve_header_value(self, header_value: bytes) -> tuple[date | None, RouteIndex]:
+        """Return the version picked for the raw value of the version header along with its compiled routes"""
+        resolved = self._resolved_versions.get(header_value)
+        if resolved is not None:
+            return resolved
+        version = self.resolve_version(date.fromisoformat(header_value.decode()))
+        resolved = (version, self.get_route_index(version) if version is not None else EMPTY_ROUTE_INDEX)
+        set_bounded(self._resolved_versions, header_value, resolved, self.resolved_versions_cache_size)
+        return resolved
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(versions={len(self.sorted_versions)}, ranges={len(self.ranged_routes)}, "
+            f"unversioned_routes={len(self.unversioned_routes)})"
+        )
+
+
+def _are_same_routes(routes: Sequence[object], other_routes: Sequence[object]) -> bool:
+    if routes is other_routes:
+        return True
+    # routes compare by value so we compare identities instead
+    return len(routes) == len(other_routes) and all(
+        route is other_route for route, other_route in zip(routes, other_routes, strict=True)
+    )
+
+
+EMPTY_ROUTING_TABLE = RoutingTable()
@@ -0,0 +1,347 @@
+import asyncio
+import bisect
+import itertools
+import multiprocessing
+import shutil
+import tempfile
+import time
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator, Sequence
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import date
+from pathlib import Path
+from typing import NamedTuple
+from urllib.parse import parse_qsl
+
+import httpx
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .utils import parse_iso_date, parse_version, set_bounded
+
+try:
+    import uvicorn
+except ImportError:  # pragma: no cover
+    uvicorn = None
+
+# Receives the versions of a shard as YYYY-MM-DD strings and builds an app with the routes of only these versions
+AppFactory = Callable[[tuple[str, ...]], ASGIApp]
+
+# Hop-by-hop headers are specific to a single connection so they are never forwarded
+_HOP_BY_HOP_HEADERS = frozenset(
+    {
+        b"connection",
+        b"keep-alive",
+        b"proxy-authenticate",
+        b"proxy-authorization",
+        b"te",
+        b"trailer",
+        b"transfer-encoding",
+        b"upgrade",
+    },
+)
+
+
+class VersionShard(NamedTuple):
+    """A group of versions that is served by its own app"""
+
+    versions: tuple[date, ...]
+    app: ASGIApp
+
+    @classmethod
+    def from_versions(cls, versions: Iterable[str], app: ASGIApp) -> "VersionShard":
+        parsed_versions = tuple(sorted({parse_version("versions", version) for version in versions}))
+        if not parsed_versions:
+            raise ValueError("A shard should have at least one version")
+        return cls(parsed_versions, app)
+
+
+class VersionShardingDispatcher:
+    """
+    A pure ASGI app that resolves the version of every request once and forwards it to the app of the shard
+    that owns that version.
+
+    A request gets the shard of the closest version that is not newer than the requested one among the versions
+    of all shards, which is the same version HeaderRoutingFastAPI would pick if it had all the versions. The default
+    shard gets the unversioned requests and the requests that are older than every version.
+
+    Requests for the openapi of a version (`openapi_url?version=...`) go to the shard that owns the version so that
+    every shard only has to generate the openapi of its own versions.
+
+    The dispatcher only knows the YYYY-MM-DD value of the version header, so unlike a single app with every version:
+
+    * the docs dashboard is served by the default shard and only lists the versions of the default shard
+    * the requests without a version header always go to the default shard, so the clients pinned to a version
+      of another shard by version_pinning don't get the routes of that version
+    * the version headers in any other format that fastapi accepts, like `2022-01-01T00:00:00`, always go to
+      the default shard
+    """
+
+    def __init__(
+        self,
+        default: VersionShard,
+        shards: Sequence[VersionShard] = (),
+        *,
+        api_version_header_name: str = "X-API-VERSION",
+        openapi_url: str | None = "/openapi.json",
+        resolved_versions_cache_size: int = 1024,
+    ) -> None:
+        self.default = default
+        self.shards = tuple(shards)
+        self.openapi_url = openapi_url
+        self.resolved_versions_cache_size = resolved_versions_cache_size
+        self._api_version_header_name_bytes = api_version_header_name.lower().encode()
+        self._apps_by_version: dict[date, ASGIApp] = {}
+        for shard in (default, *self.shards):
+            for version in shard.versions:
+                if version in self._apps_by_version:
+                    raise ValueError(f"Version {version.isoformat()} belongs to more than one shard")
+                self._apps_by_version[version] = shard.app
+        self._sorted_versions = sorted(self._apps_by_version)
+        # raw header value -> the app that serves it
+        self._resolved_apps: dict[bytes, ASGIApp] = {}
+
+    @property
+    def apps(self) -> tuple[ASGIApp, ...]:
+        """The app of the default shard followed by the apps of the shards without duplicates"""
+        return tuple(dict.fromkeys(shard.app for shard in (self.default, *self.shards)))
+
+    def resolve_app(self, header_value: bytes) -> ASGIApp:
+        """Return the app that serves the raw value of the version header"""
+        app = self._resolved_apps.get(header_value)
+        if app is not None:
+            return app
+        requested_version = parse_iso_date(header_value)
+        if requested_version is None:
+            # the app of the default shard validates the header and normalizes the other formats
+            return self.default.app
+        index = bisect.bisect_right(self._sorted_versions, requested_version)
+        app = self._apps_by_version[self._sorted_versions[index - 1]] if index else self.default.app
+        set_bounded(self._resolved_apps, header_value, app, self.resolved_versions_cache_size)
+        return app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        return await self._pick_app(scope)(scope, receive, send)
+
+    def _pick_app(self, scope: Scope) -> ASGIApp:
+        for name, value in scope["headers"]:
+            if name == self._api_version_header_name_bytes:
+                return self.resolve_app(value)
+        if self.openapi_url is not None and scope["path"] == self.openapi_url:
+            for name, value in parse_qsl(scope.get("query_string", b"").decode("latin-1")):
+                if name == "version":
+                    return self._apps_by_version.get(parse_iso_date(value.encode()), self.default.app)
+        return self.default.app
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        """Run the lifespans of all apps: they start in order and shut down in reverse order"""
+        await receive()
+        async with AsyncExitStack() as stack:
+            try:
+                for app in self.apps:
+                    await stack.enter_async_context(run_lifespan(app))
+            except BaseException as e:
+                await stack.aclose()
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                raise
+            await send({"type": "lifespan.startup.complete"})
+            await receive()
+        await send({"type": "lifespan.shutdown.complete"})
+
+
+@asynccontextmanager
+async def run_lifespan(app: ASGIApp) -> AsyncIterator[None]:
+    """Run the startup of the app on enter and its shutdown on exit. Apps that don't support lifespan are skipped"""
+    receive_queue: asyncio.Queue[Message] = asyncio.Queue()
+    send_queue: asyncio.Queue[Message] = asyncio.Queue()
+    task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}}, receive_queue.get, send_queue.put))
+
+    async def next_message() -> Message | None:
+        message = asyncio.ensure_future(send_queue.get())
+        await asyncio.wait({message, task}, return_when=asyncio.FIRST_COMPLETED)
+        if message.done():
+            return message.result()
+        message.cancel()
+        # Just like uvicorn, we consider that an app that returns or fails before replying doesn't support lifespan
+        task.exception()
+        return None
+
+    await receive_queue.put({"type": "lifespan.startup"})
+    message = await next_message()
+    if message is None:
+        yield
+        return
+    if message["type"] == "lifespan.startup.failed":
+        await task
+        raise RuntimeError(message.get("message", ""))
+    try:
+        yield
+    finally:
+        await receive_queue.put({"type": "lifespan.shutdown"})
+        message = await next_message()
+        await task
+        if message is not None and message["type"] == "lifespan.shutdown.failed":
+            raise RuntimeError(message.get("message", ""))
+
+
+class WorkerProcessPool:
+    """
+    An ASGI app that serves a shard from its own worker processes on the same machine.
+
+    Every worker builds its app by calling app_factory with the versions of the shard, so it only loads the routes
+    and the openapi of these versions, and serves it with uvicorn on a unix socket. The pool starts the workers on
+    the startup of the lifespan, stops them on its shutdown and forwards the requests to the workers in turns.
+    Websockets are not forwarded.
+
+    app_factory must be importable by the workers (a module-level function) because they are spawned.
+    """
+
+    def __init__(
+        self,
+        app_factory: AppFactory,
+        versions: Iterable[str],
+        *,
+        workers: int = 1,
+        socket_dir: str | Path | None = None,
+        startup_timeout: float = 30.0,
+        shutdown_timeout: float = 10.0,
+    ) -> None:
+        if uvicorn is None:  # pragma: no cover
+            raise ImportError("WorkerProcessPool requires uvicorn to be installed")
+        if workers < 1:
+            raise ValueError("workers should be at least 1")
+        self.app_factory = app_factory
+        self.versions = tuple(sorted({parse_version("versions", version).isoformat() for version in versions}))
+        self.workers = workers
+        self.socket_dir = socket_dir
+        # the directory that start created for the sockets because no socket_dir was given
+        self._created_socket_dir: Path | None = None
+        self.startup_timeout = startup_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.processes: list[multiprocessing.process.BaseProcess] = []
+        self._clients: list[httpx.AsyncClient] = []
+        self._next_client: Iterator[httpx.AsyncClient] = iter(())
+
+    def as_shard(self) -> VersionShard:
+        return VersionShard.from_versions(self.versions, self)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            return await send({"type": "websocket.close", "code": 1000})
+        return await _forward(next(self._next_client), scope, receive, send)
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        await receive()
+        try:
+            await self.start()
+        except BaseException as e:
+            await self.stop()
+            await send({"type": "lifespan.startup.failed", "message": str(e)})
+            raise
+        await send({"type": "lifespan.startup.complete"})
+        await receive()
+        await self.stop()
+        await send({"type": "lifespan.shutdown.complete"})
+
+    async def start(self) -> None:
+        """Start the workers and wait until all of them accept requests"""
+        if self.socket_dir is not None:
+            socket_dir = Path(self.socket_dir)
+        else:
+            socket_dir = self._created_socket_dir = Path(tempfile.mkdtemp(prefix="verselect-"))
+        context = multiprocessing.get_context("spawn")
+        for worker_number in range(self.workers):
+            socket_path = str(socket_dir / f"{self.versions[0]}-{worker_number}.sock")
+            process = context.Process(
+                target=_serve_worker,
+                args=(self.app_factory, self.versions, socket_path),
+                name=f"verselect-worker-{self.versions[0]}-{worker_number}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+            self._clients.append(
+                httpx.AsyncClient(
+                    transport=httpx.AsyncHTTPTransport(uds=socket_path),
+                    base_url="http://worker",
+                    # the requests shouldn't time out just because they are served by another process
+                    timeout=None,  # noqa: S113
+                ),
+            )
+        self._next_client = itertools.cycle(self._clients)
+        await asyncio.gather(*(self._wait_until_ready(client) for client in self._clients))
+
+    async def _wait_until_ready(self, client: httpx.AsyncClient) -> None:
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            try:
+                await client.request("HEAD", "/")
+            except httpx.TransportError:
+                if time.monotonic() > deadline or not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError(f"The workers of versions {', '.join(self.versions)} didn't start") from None
+                await asyncio.sleep(0.05)
+            else:
+                return
+
+    async def stop(self) -> None:
+        """Stop the workers, waiting for them to finish the requests they are serving"""
+        for client in self._clients:
+            await client.aclose()
+        for process in self.processes:
+            process.terminate()
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, self.shutdown_timeout)
+            if process.is_alive():  # pragma: no cover
+                process.kill()
+        self.processes = []
+        self._clients = []
+        self._next_client = iter(())
+        if self._created_socket_dir is not None:
+            shutil.rmtree(self._created_socket_dir, ignore_errors=True)
+            self._created_socket_dir = None
+
+
+async def _forward(client: httpx.AsyncClient, scope: Scope, receive: Receive, send: Send) -> None:
+    async def request_body() -> AsyncIterator[bytes]:
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            more_body = message.get("more_body", False)
+            yield message.get("body", b"")
+
+    # some servers (and starlette's test client) leave the query string in raw_path
+    raw_path = (scope.get("raw_path") or scope["path"].encode()).partition(b"?")[0]
+    query_string = scope.get("query_string", b"")
+    request = client.build_request(
+        scope["method"],
+        httpx.URL(raw_path=raw_path + b"?" + query_string if query_string else raw_path),
+        headers=[(name, value) for name, value in scope["headers"] if name not in _HOP_BY_HOP_HEADERS],
+        content=request_body(),
+    )
+    response = await client.send(request, stream=True)
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [
+                    (name.lower(), value)
+                    for name, value in response.headers.raw
+                    if name.lower() not in _HOP_BY_HOP_HEADERS
+                ],
+            },
+        )
+        async for chunk in response.aiter_raw():
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        await response.aclose()
+
+
+def _serve_worker(app_factory: AppFactory, versions: tuple[str, ...], socket_path: str) -> None:
+    uvicorn.run(app_factory(versions), uds=socket_path, log_level="warning")
@@ -0,0 +1,182 @@
+from collections.abc import AsyncIterator, Callable, Mapping
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from contextvars import ContextVar
+from datetime import date
+from time import perf_counter
+from types import TracebackType
+from typing import Any
+
+import httpx
+
+from .instrumentation import Histogram
+
+_LATENCY_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class UpstreamMetrics:
+    """The requests sent to a single upstream and how long it took to get their response headers"""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        # the requests that failed without a response, like the ones that timed out
+        self.errors = 0
+        self.responses_by_status: dict[int, int] = {}
+        self.seconds = Histogram(_LATENCY_SECONDS_BUCKETS)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "responses_by_status": {str(status): count for status, count in sorted(self.responses_by_status.items())},
+            "seconds": self.seconds.snapshot(),
+        }
+
+
+class _VersionForwardingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, clients: "UpstreamClients", metrics: UpstreamMetrics):
+        self.transport = transport
+        self.clients = clients
+        self.metrics = metrics
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        header_name = self.clients.api_version_header_name
+        version = None if self.clients.api_version_var is None else self.clients.api_version_var.get(None)
+        if version is not None and header_name not in request.headers:
+            request.headers[header_name] = version.isoformat()
+        self.metrics.requests += 1
+        start = perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self.metrics.errors += 1
+            raise
+        finally:
+            self.metrics.seconds.observe(perf_counter() - start)
+        self.metrics.responses_by_status[response.status_code] = (
+            self.metrics.responses_by_status.get(response.status_code, 0) + 1
+        )
+        return response
+
+    async def aclose(self) -> None:
+        """Leave the transport open since the other clients of the host share it. UpstreamClients closes it"""
+
+
+class UpstreamClients:
+    """
+    Shared `httpx.AsyncClient`s for calling other services that forward the API version of the current request.
+
+    `get(base_url)` returns the same client for every call with the same base url. A client has a single base url,
+    so the clients of base urls on the same host (scheme, host and port) share one connection pool instead: the
+    requests to an upstream reuse its pooled connections and every host gets its own connection limits.
+    Every request gets the version header with the version from api_version_var unless it already has one,
+    and the latency of every host is recorded in `metrics`.
+
+    Pass it to HeaderRoutingFastAPI(upstream_clients=...) to use the api_version_var and the version header of
+    the app and to close the clients on shutdown. Otherwise close them with `aclose` or `async with`.
+    """
+
+    def __init__(
+        self,
+        *,
+        api_version_var: ContextVar[date] | ContextVar[date | None] | None = None,
+        api_version_header_name: str | None = None,
+        max_connections_per_host: int = 100,
+        max_keepalive_connections_per_host: int = 20,
+        keepalive_expiry: float = 5.0,
+        timeout: float | None = 10.0,
+        transports: Mapping[str, httpx.AsyncBaseTransport] | None = None,
+        **client_kwargs: Any,
+    ) -> None:
+        self.api_version_var = api_version_var
+        self.api_version_header_name = api_version_header_name or "X-API-VERSION"
+        self._has_header_name = api_version_header_name is not None
+        self.limits = httpx.Limits(
+            max_connections=max_connections_per_host,
+            max_keepalive_connections=max_keepalive_connections_per_host,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        # host -> the transport to use instead of a pooled HTTP transport, like an ASGITransport in tests
+        self.transports = {_get_host(base_url): transport for base_url, transport in (transports or {}).items()}
+        self.client_kwargs = client_kwargs
+        # host -> its metrics. Kept when the clients are closed
+        self.metrics: dict[str, UpstreamMetrics] = {}
+        # host -> the transport shared by the clients of its base urls
+        self._host_transports: dict[str, httpx.AsyncBaseTransport] = {}
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    def bind(
+        self,
+        api_version_var: ContextVar[date] | ContextVar[date | None],
+        api_version_header_name: str,
+    ) -> None:
+        """Use the version of the app unless the clients were given their own"""
+        if self.api_version_var is None:
+            self.api_version_var = api_version_var
+        if not self._has_header_name:
+            self.api_version_header_name = api_version_header_name
+
+    def get(self, base_url: str) -> httpx.AsyncClient:
+        """Return the shared client of the upstream, creating it on first use"""
+        client = self._clients.get(base_url)
+        if client is None:
+            host = _get_host(base_url)
+            metrics = self.metrics.get(host)
+            if metrics is None:
+                metrics = self.metrics[host] = UpstreamMetrics()
+            transport = self._host_transports.get(host)
+            if transport is None:
+                transport = self.transports.get(host) or httpx.AsyncHTTPTransport(limits=self.limits)
+                self._host_transports[host] = transport
+            client = self._clients[base_url] = httpx.AsyncClient(
+                base_url=base_url,
+                transport=_VersionForwardingTransport(transport, self, metrics),
+                timeout=self.timeout,
+                **self.client_kwargs,
+            )
+        return client
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        return {host: metrics.snapshot() for host, metrics in self.metrics.items()}
+
+    async def aclose(self) -> None:
+        """Close the clients and their connections. The clients that are requested afterwards are created anew"""
+        clients = list(self._clients.values())
+        transports = list(self._host_transports.values())
+        self._clients.clear()
+        self._host_transports.clear()
+        for client in clients:
+            await client.aclose()
+        for transport in transports:
+            await transport.aclose()
+
+    async def __aenter__(self) -> "UpstreamClients":  # noqa: PYI034 (typing.Self needs python 3.11)
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await self.aclose()
+
+
+def _get_host(base_url: str) -> str:
+    """Return the scheme, host and port of the url, leaving out the default port of the scheme"""
+    url = httpx.URL(base_url)
+    return f"{url.scheme}://{url.netloc.decode('ascii')}"
+
+
+def close_on_shutdown(
+    lifespan_context: Callable[[Any], AbstractAsyncContextManager[Any]],
+    clients: UpstreamClients,
+) -> Callable[[Any], AbstractAsyncContextManager[Any]]:
+    """Wrap the lifespan of the app so that the clients are closed after it shuts down"""
+
+    @asynccontextmanager
+    async def lifespan(app: Any) -> AsyncIterator[Any]:
+        async with clients, lifespan_context(app) as state:
+            yield state
+
+    return lifespan
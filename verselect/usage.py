@@ -0,0 +1,120 @@
+from collections.abc import Iterable
+from datetime import date
+from typing import Any
+
+from starlette.routing import BaseRoute
+
+from .instrumentation import RoutingInstrumentation, RoutingRecord
+from .openapi import UNVERSIONED
+
+# The requested values that didn't fit into the limit are counted under this key
+OTHER_REQUESTED_VALUES = "other"
+# Requests that no route matched are counted under this route
+NO_ROUTE = "<no route>"
+
+
+class VersionUsage(RoutingInstrumentation):
+    """
+    Counts which requested header values, resolved versions and versioned routes still get traffic.
+
+    The counters belong to a single worker. They are plain dicts that are only updated from the event loop
+    so they need no locks. Snapshots of several workers can be combined with `merge_version_usage_snapshots`.
+    """
+
+    def __init__(self, *, max_requested_values: int = 1024) -> None:
+        super().__init__()
+        # The header values are controlled by the clients so we don't let them grow the counters indefinitely
+        self.max_requested_values = max_requested_values
+        self.requested_values: dict[str, int] = {}
+        self.other_requested_values = 0
+        self.resolved_versions: dict[date | None, int] = {}
+        # (resolved version, id of the route) -> requests. Routes compare by value so they can't be keys themselves
+        self.routes: dict[tuple[date | None, int], int] = {}
+        # id of the route -> the route. We keep the routes so that their ids are never reused by other objects
+        self._counted_routes: dict[int, BaseRoute | None] = {}
+        # the requests that are older than the oldest version
+        self.too_old_requests = 0
+        # the requests whose version header was rejected by the middleware
+        self.invalid_requests = 0
+
+    def on_request(self, record: RoutingRecord) -> None:
+        requested_version = record.requested_version
+        if requested_version is not None:
+            if requested_version in self.requested_values:
+                self.requested_values[requested_version] += 1
+            elif len(self.requested_values) < self.max_requested_values:
+                self.requested_values[requested_version] = 1
+            else:
+                self.other_requested_values += 1
+            if not record.routed:
+                self.invalid_requests += 1
+                return
+            if record.resolved_version is None:
+                self.too_old_requests += 1
+                return
+        elif not record.routed:
+            # a request that is not handled by the versioning at all such as a websocket
+            return
+
+        version = record.resolved_version
+        self.resolved_versions[version] = self.resolved_versions.get(version, 0) + 1
+        route_id = id(record.route)
+        if route_id not in self._counted_routes:
+            self._counted_routes[route_id] = record.route
+        key = (version, route_id)
+        self.routes[key] = self.routes.get(key, 0) + 1
+
+    def snapshot(self) -> dict[str, Any]:
+        requested_values = dict(self.requested_values)
+        if self.other_requested_values:
+            requested_values[OTHER_REQUESTED_VALUES] = self.other_requested_values
+        routes: dict[str, dict[str, int]] = {}
+        for (version, route_id), count in self.routes.items():
+            version_routes = routes.setdefault(_format_version(version), {})
+            name = _format_route(self._counted_routes[route_id])
+            version_routes[name] = version_routes.get(name, 0) + count
+        return {
+            "requested_values": requested_values,
+            "resolved_versions": {_format_version(version): count for version, count in self.resolved_versions.items()},
+            "routes": routes,
+            "too_old_requests": self.too_old_requests,
+            "invalid_requests": self.invalid_requests,
+        }
+
+
+def merge_version_usage_snapshots(snapshots: Iterable[dict[str, Any]]) -> dict[str, Any]:
+    """Sum the snapshots of several workers into a single snapshot of the same shape"""
+    merged: dict[str, Any] = {
+        "requested_values": {},
+        "resolved_versions": {},
+        "routes": {},
+        "too_old_requests": 0,
+        "invalid_requests": 0,
+    }
+    for snapshot in snapshots:
+        _add_counts(merged["requested_values"], snapshot["requested_values"])
+        _add_counts(merged["resolved_versions"], snapshot["resolved_versions"])
+        for version, routes in snapshot["routes"].items():
+            _add_counts(merged["routes"].setdefault(version, {}), routes)
+        merged["too_old_requests"] += snapshot["too_old_requests"]
+        merged["invalid_requests"] += snapshot["invalid_requests"]
+    return merged
+
+
+def _add_counts(counts: dict[str, int], other_counts: dict[str, int]) -> None:
+    for key, count in other_counts.items():
+        counts[key] = counts.get(key, 0) + count
+
+
+def _format_version(version: date | None) -> str:
+    return UNVERSIONED if version is None else version.isoformat()
+
+
+def _format_route(route: BaseRoute | None) -> str:
+    if route is None:
+        return NO_ROUTE
+    path = getattr(route, "path", None) or repr(route)
+    methods = getattr(route, "methods", None)
+    if methods:
+        return f"{','.join(sorted(methods))} {path}"
+    return path
@@ -0,0 +1,41 @@
+import re
+from datetime import date
+from typing import TypeVar
+
+_ISO_DATE_REGEX = re.compile(rb"[0-9]{4}-[0-9]{2}-[0-9]{2}")
+
+# The middleware sets the pinned version under this key of the scope when it picks the version for the request
+PINNED_VERSION_SCOPE_KEY = "verselect.pinned_version"
+
+# The request headers that identify who sent the request, so a response to one of them is never given to another
+CREDENTIAL_HEADERS = ("authorization", "cookie")
+
+_KeyT = TypeVar("_KeyT")
+_ValueT = TypeVar("_ValueT")
+
+
+def parse_version(argument_name: str, value: str) -> date:
+    """Parse a version given to the app, raising a ValueError that names the argument if it's not an ISO 8601 date"""
+    try:
+        return date.fromisoformat(value)
+    except ValueError as e:
+        raise ValueError(f"{argument_name} should be in ISO 8601 format") from e
+
+
+def parse_iso_date(value: bytes) -> date | None:
+    """Parse a raw YYYY-MM-DD header value or return None if it's in any other format or not a valid date"""
+    if not _ISO_DATE_REGEX.fullmatch(value):
+        return None
+    try:
+        return date.fromisoformat(value.decode("ascii"))
+    except ValueError:
+        return None
+
+
+def set_bounded(cache: dict[_KeyT, _ValueT], key: _KeyT, value: _ValueT, max_size: int) -> None:
+    """Set the key of a dict that holds up to max_size entries, evicting the oldest entry if it's full"""
+    if cache and len(cache) >= max_size:
+        # dicts are ordered so this evicts the oldest entry. If another request has already evicted it,
+        # there's nothing left to do
+        cache.pop(next(iter(cache), None), None)  # type: ignore[arg-type]
+    cache[key] = value
@@ -0,0 +1,69 @@
+import bisect
+from collections.abc import Sequence
+from datetime import date
+from typing import NamedTuple
+
+from starlette.routing import BaseRoute
+
+
+class VersionRange(NamedTuple):
+    """Routes that exist in every version from since (inclusive) until until (exclusive, None means forever)"""
+
+    since: date
+    until: date | None
+    routes: Sequence[BaseRoute]
+
+    def contains(self, version: date) -> bool:
+        return self.since <= version and (self.until is None or version < self.until)
+
+
+class VersionRangeIndex:
+    """
+    An interval index of version ranges.
+
+    The boundaries of all ranges split the timeline into segments where the set of active ranges doesn't change,
+    so the ranges active at any version are found with a single bisect instead of checking every range.
+    """
+
+    def __init__(self, ranges: Sequence[VersionRange]) -> None:
+        self.ranges = ranges
+        self.boundaries = sorted({r.since for r in ranges} | {r.until for r in ranges if r.until is not None})
+        self._boundary_set = frozenset(self.boundaries)
+        # segment i covers [boundaries[i], boundaries[i + 1])
+        active: list[list[VersionRange]] = [[] for _ in self.boundaries]
+        # ranges are added in the order of declaration so that earlier declarations take precedence in matching
+        for version_range in ranges:
+            start = bisect.bisect_left(self.boundaries, version_range.since)
+            end = (
+                len(self.boundaries)
+                if version_range.until is None
+                else bisect.bisect_left(self.boundaries, version_range.until)
+            )
+            for segment in active[start:end]:
+                segment.append(version_range)
+        # segment -> the ranges active in it
+        self.segments = tuple(tuple(segment) for segment in active)
+
+    def is_boundary(self, version: date) -> bool:
+        return version in self._boundary_set
+
+    def segment_at(self, version: date) -> int | None:
+        """Return the segment that contains the version or None if the version is older than every range"""
+        segment = bisect.bisect_right(self.boundaries, version) - 1
+        return None if segment < 0 else segment
+
+    def active_at(self, version: date) -> tuple[VersionRange, ...]:
+        """Return the ranges that contain the version in the order of their declaration"""
+        segment = self.segment_at(version)
+        if segment is None:
+            return ()
+        return self.segments[segment]
+
+    def __len__(self) -> int:
+        return len(self.ranges)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(ranges={len(self.ranges)}, boundaries={len(self.boundaries)})"
+
+
+EMPTY_VERSION_RANGE_INDEX = VersionRangeIndex(())